@@ -746,6 +746,10 @@ def command_go(args):
         parser.add_option(
             '--preserve', dest='preserve', action='store_true',
             help='preserve old rundir')
+        parser.add_option(
+            '--resume', dest='resume', action='store_true',
+            help='continue an interrupted run from the last checkpoint in '
+                 'its run directory')
         parser.add_option(
             '--status', dest='status', default='state',
             type='choice', choices=['state', 'quiet'],
@@ -769,6 +773,7 @@ def command_go(args):
             env,
             force=options.force,
             preserve=options.preserve,
+            resume=options.resume,
             status=status,
             nparallel=options.nparallel)
         if len(env.get_selected_names()) == 1:
@@ -16,9 +16,11 @@ from pyrocko import parimap, model, marker as pmarker
 from .dataset import NotFound, InvalidObject
 from .problems.base import (
     Problem,
+    load_problem_info,
     load_problem_info_and_data,
     load_problem_data,
     load_optimiser_info,
+    load_target_dependants,
 )
 
 from .optimisers.base import BadProblem
@@ -144,11 +146,11 @@ def harvest(rundir, problem=None, nbest=10, force=False, weed=0):
 
     if problem is None:
         problem, xs, misfits, bootstrap_misfits, _ = load_problem_info_and_data(
-            rundir, nchains=nchains
+            rundir, nchains=nchains, mmap=True
         )
     else:
         xs, misfits, bootstrap_misfits, _ = load_problem_data(
-            rundir, problem, nchains=nchains
+            rundir, problem, nchains=nchains, mmap=True
         )
 
     logger.info('Harvesting problem "%s"...' % problem.name)
@@ -197,8 +199,16 @@ def harvest(rundir, problem=None, nbest=10, force=False, weed=0):
     if weed == 2:
         ibests = ibests[gms[ibests] < mean_gm_best]
 
+    target_dependants = load_target_dependants(rundir, problem, mmap=True)
     for i in ibests:
-        problem.dump_problem_data(dumpdir, xs[i], misfits[i, :, :])
+        problem.dump_problem_data(
+            dumpdir,
+            xs[i],
+            misfits[i, :, :],
+            target_dependants=(
+                target_dependants[i] if target_dependants is not None else None
+            ),
+        )
 
     logger.info('Done harvesting problem "%s".' % problem.name)
 
@@ -449,8 +459,15 @@ def check(
 g_state = {}
 
 
-def go(environment, force=False, preserve=False, nparallel=1, status="state"):
-    g_data = (environment, force, preserve, status, nparallel)
+def go(
+    environment,
+    force=False,
+    preserve=False,
+    resume=False,
+    nparallel=1,
+    status="state",
+):
+    g_data = (environment, force, preserve, resume, status, nparallel)
     g_state[id(g_data)] = g_data
 
     nselected = environment.nselected
@@ -461,7 +478,7 @@ def go(environment, force=False, preserve=False, nparallel=1, status="state"):
 
 
 def process_event(iselected, g_data_id):
-    environment, force, preserve, status, nparallel = g_state[g_data_id]
+    environment, force, preserve, resume, status, nparallel = g_state[g_data_id]
 
     config = environment.get_config()
 
@@ -484,7 +501,11 @@ def process_event(iselected, g_data_id):
     rundir = expand_template(config.rundir_template, dict(problem_name=problem.name))
     environment.set_rundir_path(rundir)
 
-    if op.exists(rundir):
+    optimiser = config.optimiser_config.get_optimiser()
+
+    resuming = resume and op.exists(rundir) and optimiser.has_checkpoint(rundir)
+
+    if op.exists(rundir) and not resuming:
         if preserve:
             nold_rundirs = len(glob.glob(rundir + "*"))
             shutil.move(rundir, rundir + "-old-%d" % (nold_rundirs))
@@ -505,20 +526,32 @@ def process_event(iselected, g_data_id):
 
     logger.info("Rundir: %s" % rundir)
 
-    logger.info('Analysing problem "%s".' % problem.name)
+    if resuming:
+        logger.info('Resuming problem "%s" from checkpoint.' % problem.name)
 
-    for analyser_conf in config.analyser_configs:
-        analyser = analyser_conf.get_analyser()
-        analyser.analyse(problem, ds)
+        problem = load_problem_info(rundir)
+        config.setup_modelling_environment(problem)
+        for target in problem.targets:
+            target.set_dataset(ds)
 
-    basepath = config.get_basepath()
-    config.change_basepath(rundir)
-    guts.dump(config, filename=op.join(rundir, "config.yaml"))
-    config.change_basepath(basepath)
+        ds.prefetch(problem.targets, problem.get_engine(), problem.base_source)
 
-    optimiser = config.optimiser_config.get_optimiser()
-    optimiser.init_bootstraps(problem)
-    problem.dump_problem_info(rundir)
+    else:
+        ds.prefetch(problem.targets, problem.get_engine(), problem.base_source)
+
+        logger.info('Analysing problem "%s".' % problem.name)
+
+        for analyser_conf in config.analyser_configs:
+            analyser = analyser_conf.get_analyser()
+            analyser.analyse(problem, ds)
+
+        basepath = config.get_basepath()
+        config.change_basepath(rundir)
+        guts.dump(config, filename=op.join(rundir, "config.yaml"))
+        config.change_basepath(basepath)
+
+        optimiser.init_bootstraps(problem)
+        problem.dump_problem_info(rundir)
 
     monitor = None
     if status == "state":
@@ -540,7 +573,7 @@ def process_event(iselected, g_data_id):
                 highscore.InjectionSamplerPhase(xs_inject=xs_inject)
             ]
 
-        optimiser.optimise(problem, rundir=rundir)
+        optimiser.optimise(problem, rundir=rundir, resume=resuming)
 
         harvest(rundir, problem, force=True)
 
@@ -554,6 +587,8 @@ def process_event(iselected, g_data_id):
         if monitor:
             monitor.terminate()
 
+    logger.debug("Waveform cache statistics: %s" % ds.get_cache_stats())
+
     tstop = time.time()
     logger.info(
         "Stop %i / %i (%g min)" % (iselected + 1, nselected, (tstop - tstart) / 60.0)
@@ -612,7 +647,7 @@ class ResultStats(Object):
     parameter_stats_list = List.T(ParameterStats.T())
 
 
-def make_stats(problem, xs, misfits, pnames=None):
+def make_stats(problem, xs, misfits, pnames=None, target_dependants=None):
     gms = problem.combine_misfits(misfits)
     ibest = num.argmin(gms)
     rs = ResultStats(problem=problem)
@@ -621,7 +656,7 @@ def make_stats(problem, xs, misfits, pnames=None):
 
     for pname in pnames:
         iparam = problem.name_to_index(pname)
-        vs = problem.extract(xs, iparam)
+        vs = problem.extract(xs, iparam, target_dependants)
         mi, p2_5, p5, p16, median, p84, p95, p97_5, ma = map(
             float,
             num.percentile(vs, [0.0, 2.5, 5.0, 16.0, 50.0, 84.0, 95.0, 97.5, 100.0]),
@@ -713,11 +748,13 @@ def export(what, rundirs, type=None, pnames=None, filename=None):
     if shortform:
         print("#", " ".join(["%16s" % x for x in pnames]), file=out)
 
-    def dump(x, gm, indices):
+    def dump(x, gm, indices, target_dependants=None):
         if type == "vector":
             print(
                 " ",
-                " ".join("%16.7g" % problem.extract(x, i) for i in indices),
+                " ".join(
+                    "%16.7g" % problem.extract(x, i, target_dependants) for i in indices
+                ),
                 "%16.7g" % gm,
                 file=out,
             )
@@ -740,8 +777,17 @@ def export(what, rundirs, type=None, pnames=None, filename=None):
     header = None
     for rundir in rundirs:
         problem, xs, misfits, bootstrap_misfits, _ = load_problem_info_and_data(
-            rundir, subset="harvest"
+            rundir, subset="harvest", mmap=True
         )
+        target_dependants = load_target_dependants(
+            op.join(rundir, "harvest"), problem, mmap=True
+        )
+
+        def target_dependants_of(i):
+            if target_dependants is None:
+                return None
+
+            return target_dependants[i]
 
         if type == "vector":
             pnames_take = pnames_clean or problem.parameter_names[: problem.nparameters]
@@ -763,8 +809,9 @@ def export(what, rundirs, type=None, pnames=None, filename=None):
             indices = None
 
         if what == "best":
-            x_best, gm_best = stats.get_best_x_and_gm(problem, xs, misfits)
-            dump(x_best, gm_best, indices)
+            gms = problem.combine_misfits(misfits)
+            ibest = num.argmin(gms)
+            dump(xs[ibest], gms[ibest], indices, target_dependants_of(ibest))
 
         elif what == "mean":
             x_mean, gm_mean = stats.get_mean_x_and_gm(problem, xs, misfits)
@@ -774,10 +821,10 @@ def export(what, rundirs, type=None, pnames=None, filename=None):
             gms = problem.combine_misfits(misfits)
             isort = num.argsort(gms)
             for i in isort:
-                dump(xs[i], gms[i], indices)
+                dump(xs[i], gms[i], indices, target_dependants_of(i))
 
         elif what == "stats":
-            rs = make_stats(problem, xs, misfits, pnames_clean)
+            rs = make_stats(problem, xs, misfits, pnames_clean, target_dependants)
             if shortform:
                 print(" ", format_stats(rs, pnames), file=out)
             else:
@@ -1,15 +1,35 @@
 import glob
 import copy
+import os
 import os.path as op
 import logging
 import math
+import hashlib
+import pickle
+import shutil
+import tempfile
+import time
+import weakref
+import threading
 import numpy as num
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import pyrocko
 from pyrocko import util, pile, model, config, trace, marker as pmarker
 from pyrocko.io.io_common import FileLoadError
 from pyrocko.fdsn import enhanced_sacpz, station as fs
-from pyrocko.guts import Object, Tuple, String, Float, List, Bool, dump_all, load_all
+from pyrocko.guts import (
+    Object,
+    Tuple,
+    String,
+    Float,
+    Int,
+    List,
+    Bool,
+    dump_all,
+    load_all,
+)
 
 from pyrocko import gf
 
@@ -162,8 +182,251 @@ def load_check_event_groups(fns):
     return egs
 
 
+def _cache_entry_nbytes(obj):
+    if isinstance(obj, trace.Trace) and obj.ydata is not None:
+        return obj.ydata.nbytes + WaveformCache.nbytes_overhead
+
+    return WaveformCache.nbytes_overhead
+
+
+class WaveformCache(object):
+    """
+    LRU cache for processed waveforms with a memory budget.
+
+    Entries are evicted in least-recently-used order when the summed size of
+    the cached traces exceeds *nbytes_max*. If *spill_dirname* is given,
+    evicted traces are pickled to a private directory below it and loaded
+    back on the next access, up to *spill_nbytes_max* bytes on disk.
+
+    The cache supports the subset of the dict interface used by
+    :py:class:`Dataset`, so that plain dicts can still be passed as cache.
+    It may be shared between threads.
+    """
+
+    nbytes_overhead = 512
+
+    def __init__(self, nbytes_max=1024**3, spill_dirname=None, spill_nbytes_max=None):
+        self.nbytes_max = nbytes_max
+        self.spill_dirname = spill_dirname
+        self.spill_nbytes_max = spill_nbytes_max
+
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._spilled = OrderedDict()
+        self._spill_nbytes = 0
+        self._spill_dir = None
+        self._finalizer = None
+        self._lock = threading.RLock()
+
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.nhits = 0
+        self.nmisses = 0
+        self.nevictions = 0
+        self.nspills = 0
+        self.nspill_hits = 0
+
+    def get_stats(self):
+        with self._lock:
+            return dict(
+                nhits=self.nhits,
+                nmisses=self.nmisses,
+                nevictions=self.nevictions,
+                nspills=self.nspills,
+                nspill_hits=self.nspill_hits,
+                nentries=len(self._entries),
+                nbytes=self._nbytes,
+                nentries_spilled=len(self._spilled),
+                nbytes_spilled=self._spill_nbytes,
+            )
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries) + len(self._spilled)
+
+    def __contains__(self, k):
+        with self._lock:
+            return k in self._entries or k in self._spilled
+
+    def __getitem__(self, k):
+        obj = self.get(k, self)
+        if obj is self:
+            raise KeyError(k)
+
+        return obj
+
+    def get(self, k, default=None):
+        with self._lock:
+            if k in self._entries:
+                self._entries.move_to_end(k)
+                self.nhits += 1
+                return self._entries[k][0]
+
+            if k in self._spilled:
+                obj = self._unspill(k)
+                self.nhits += 1
+                self.nspill_hits += 1
+                self[k] = obj
+                return obj
+
+            self.nmisses += 1
+            return default
+
+    def __setitem__(self, k, obj):
+        nbytes = _cache_entry_nbytes(obj)
+        with self._lock:
+            if k in self._entries:
+                self._nbytes -= self._entries.pop(k)[1]
+            elif k in self._spilled:
+                self._remove_spilled(k)
+
+            self._entries[k] = (obj, nbytes)
+            self._nbytes += nbytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+            self._spilled.clear()
+            self._spill_nbytes = 0
+            if self._finalizer is not None:
+                self._finalizer()
+                self._finalizer = None
+                self._spill_dir = None
+
+    def _evict(self):
+        while self._nbytes > self.nbytes_max and self._entries:
+            k, (obj, nbytes) = self._entries.popitem(last=False)
+            self._nbytes -= nbytes
+            self.nevictions += 1
+            if self.spill_dirname is not None and not isinstance(obj, Exception):
+                self._spill(k, obj, nbytes)
+
+    def _spill_filename(self, k):
+        if self._spill_dir is None:
+            util.ensuredir(self.spill_dirname)
+            self._spill_dir = tempfile.mkdtemp(
+                prefix="waveform-cache-", dir=self.spill_dirname
+            )
+            self._finalizer = weakref.finalize(
+                self, shutil.rmtree, self._spill_dir, True
+            )
+
+        return op.join(
+            self._spill_dir, hashlib.sha1(repr(k).encode("utf8")).hexdigest()
+        )
+
+    def _spill(self, k, obj, nbytes):
+        if self.spill_nbytes_max is not None and nbytes > self.spill_nbytes_max:
+            return
+
+        fn = self._spill_filename(k)
+        with open(fn, "wb") as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        self._spilled[k] = (fn, nbytes)
+        self._spill_nbytes += nbytes
+        self.nspills += 1
+
+        while (
+            self.spill_nbytes_max is not None
+            and self._spill_nbytes > self.spill_nbytes_max
+        ):
+            self._remove_spilled(next(iter(self._spilled)))
+
+    def _unspill(self, k):
+        fn = self._spilled[k][0]
+        with open(fn, "rb") as f:
+            obj = pickle.load(f)
+
+        self._remove_spilled(k)
+        return obj
+
+    def _remove_spilled(self, k):
+        fn, nbytes = self._spilled.pop(k)
+        self._spill_nbytes -= nbytes
+        try:
+            os.unlink(fn)
+        except OSError:
+            pass
+
+
+class WaveformDiskCache(object):
+    """
+    Persistent, content-addressed store of processed waveforms.
+
+    Each entry holds the restituted and projected traces obtained when
+    requesting one channel with one set of processing parameters. Entries
+    are stored as uncompressed NumPy ``.npz`` files below *dirname*, named
+    by the hex digest of the key given by
+    :py:meth:`Dataset.get_waveform_fingerprint`.
+    """
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self.nhits = 0
+        self.nmisses = 0
+
+    def _path(self, key):
+        return op.join(self.dirname, key[:2], key[2:] + ".npz")
+
+    def get(self, key):
+        fn = self._path(key)
+        if not op.exists(fn):
+            self.nmisses += 1
+            return None
+
+        try:
+            with num.load(fn, allow_pickle=False) as data:
+                trs = []
+                for i, (codes, tmin, deltat) in enumerate(
+                    zip(data["codes"], data["tmins"], data["deltats"])
+                ):
+                    trs.append(
+                        trace.Trace(
+                            *(str(c) for c in codes),
+                            tmin=float(tmin),
+                            deltat=float(deltat),
+                            ydata=data["ydata_%i" % i]
+                        )
+                    )
+
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Ignoring unreadable waveform cache file %s: %s" % (fn, e))
+            self.nmisses += 1
+            return None
+
+        self.nhits += 1
+        return trs
+
+    def put(self, key, trs):
+        fn = self._path(key)
+        util.ensuredirs(fn)
+        arrays = dict(
+            codes=num.array([tr.nslc_id for tr in trs], dtype=str).reshape(-1, 4),
+            tmins=num.array([tr.tmin for tr in trs], dtype=float),
+            deltats=num.array([tr.deltat for tr in trs], dtype=float),
+        )
+        for i, tr in enumerate(trs):
+            arrays["ydata_%i" % i] = tr.get_ydata()
+
+        fd, fn_temp = tempfile.mkstemp(dir=op.dirname(fn), suffix=".npz.tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                num.savez(f, **arrays)
+
+            os.replace(fn_temp, fn)
+
+        except OSError as e:
+            logger.warning("Could not write waveform cache file %s: %s" % (fn, e))
+            if op.exists(fn_temp):
+                os.unlink(fn_temp)
+
+
 class Dataset(object):
-    def __init__(self, name=None):
+    def __init__(self, name=None, cache=None):
         self.events = []
         self.event_groups = {}
         self.pile = pile.Pile()
@@ -182,16 +445,43 @@ class Dataset(object):
         self.apply_correction_factors = True
         self.apply_displaced_sampling_workaround = False
         self.extend_incomplete = False
+        self.prefetch_nthreads = 4
         self.clip_handling = "by_nsl"
         self.kite_scenes = []
         self.gnss_campaigns = []
         self.synthetic_test = None
         self._picks = None
-        self._cache = {}
+        self._cache = cache if cache is not None else WaveformCache()
+        self._disk_cache = None
         self._name = name
+        self._waveform_index = {}
+        self._waveform_nslcs = {}
+        self._waveform_index_nupdates = None
+        self._pile_lock = threading.RLock()
+        self._response_index = {}
+        self._response_cache = {}
 
     def empty_cache(self):
-        self._cache = {}
+        self._cache.clear()
+
+    def set_cache(self, cache):
+        self._cache = cache
+
+    def set_disk_cache(self, disk_cache):
+        self._disk_cache = disk_cache
+
+    def get_cache_stats(self):
+        if isinstance(self._cache, WaveformCache):
+            stats = self._cache.get_stats()
+        else:
+            stats = dict(nentries=len(self._cache))
+
+        if self._disk_cache is not None:
+            stats.update(
+                nhits_disk=self._disk_cache.nhits, nmisses_disk=self._disk_cache.nmisses
+            )
+
+        return stats
 
     def set_synthetic_test(self, synthetic_test):
         self.synthetic_test = synthetic_test
@@ -296,6 +586,105 @@ class Dataset(object):
         self.pile.load_files(
             sorted(fns), cache=cache, fileformat=fileformat, show_progress=show_progress
         )
+        self._get_waveform_index()
+
+    def _get_waveform_index(self):
+        """
+        Get mapping of channel codes to the waveform files containing them.
+
+        The index is rebuilt whenever the content of the pile has changed,
+        e.g. when files have been added or have been modified on disk.
+        """
+        nupdates = self.pile.get_update_count()
+        if self._waveform_index_nupdates != nupdates:
+            index = defaultdict(list)
+            for file in self.pile.iter_files():
+                for nslc in set(tr.nslc_id for tr in file.iter_traces()):
+                    index[nslc].append(file)
+
+            nslcs = defaultdict(list)
+            for nslc in sorted(index):
+                nslcs[nslc[:3]].append(nslc)
+
+            self._waveform_index = dict(index)
+            self._waveform_nslcs = dict(nslcs)
+            self._waveform_index_nupdates = nupdates
+
+        return self._waveform_index
+
+    def _get_waveform_headers(self, nslcs, tmin, tmax):
+        """Get trace headers of the given channels overlapping a time span."""
+        nslcs = set(nslcs)
+        headers = []
+        with self._pile_lock:
+            index = self._get_waveform_index()
+            for file in set(file for nslc in nslcs for file in index.get(nslc, [])):
+                if file.overlaps(tmin, tmax):
+                    headers.extend(
+                        tr
+                        for tr in file.iter_traces()
+                        if tr.nslc_id in nslcs and tr.is_relevant(tmin, tmax)
+                    )
+
+        headers.sort(key=lambda tr: tr.tmin)
+        return headers
+
+    def _get_waveform_nslcs(self, nsl):
+        with self._pile_lock:
+            self._get_waveform_index()
+            return list(self._waveform_nslcs.get(tuple(nsl), []))
+
+    def _chop_waveforms(self, nslc, tmin, tmax, tpad, want_incomplete):
+        """
+        Extract waveforms of a channel from the files listed in the index.
+
+        Gives the same result as :py:meth:`pyrocko.pile.Pile.all` with a
+        trace selector matching ``nslc`` but only loads and visits the files
+        containing the channel. Access to the pile is serialised, so that this
+        may be called from several threads.
+        """
+        wmin, wmax = tmin - tpad, tmax + tpad
+        with self._pile_lock:
+            files = [
+                file
+                for file in self._get_waveform_index().get(nslc, [])
+                if file.overlaps(wmin, wmax)
+            ]
+
+            chopped = []
+            for file in files:
+                file.load_data()
+                file.use_data()
+                try:
+                    for tr in file.iter_traces():
+                        if tr.nslc_id == nslc and tr.is_relevant(wmin, wmax):
+                            try:
+                                chopped.append(tr.chop(wmin, wmax, inplace=False))
+                            except trace.NoData:
+                                pass
+
+                finally:
+                    file.drop_data()
+
+        chopped.sort(key=lambda tr: tr.full_id)
+        chopped = trace.degapper(chopped, maxgap=5)
+
+        if want_incomplete:
+            return chopped
+
+        # same completeness criterion as used by the pile
+        complete = []
+        for tr in chopped:
+            emin = tr.tmin - wmin
+            emax = tr.tmax + tr.deltat - wmax
+            if abs(emin) <= 0.5 * tr.deltat and abs(emax) <= 0.5 * tr.deltat:
+                complete.append(tr)
+
+            elif 0.0 < emin <= 5.0 * tr.deltat and -5.0 * tr.deltat <= emax < 0.0:
+                tr.extend(wmin, wmax - tr.deltat, fillmethod="repeat")
+                complete.append(tr)
+
+        return complete
 
     def add_responses(self, sacpz_dirname=None, stationxml_filenames=None):
         if sacpz_dirname:
@@ -316,6 +705,28 @@ class Dataset(object):
                     fs.load_xml(filename=stationxml_filename)
                 )
 
+        self._update_response_index()
+
+    def _update_response_index(self):
+        """
+        Index the channel epochs of the loaded StationXML responses by codes.
+
+        Also drops all memoised responses, as they may be outdated.
+        """
+        index = defaultdict(list)
+        for sx in self.responses_stationxml:
+            for network, station, channel in sx.iter_network_station_channels():
+                nslc = (
+                    network.code,
+                    station.code,
+                    channel.location_code.strip(),
+                    channel.code,
+                )
+                index[nslc].append((channel, sx))
+
+        self._response_index = dict(index)
+        self._response_cache.clear()
+
     def add_clippings(self, markers_filename):
         markers = pmarker.load_markers(markers_filename)
         clippings = {}
@@ -535,7 +946,7 @@ class Dataset(object):
             if k in self.stations:
                 return self.stations[k]
 
-        raise NotFound("No station information:", keys)
+        raise NotFound("No station information:", (net, sta, loc))
 
     def get_stations(self):
         return [
@@ -575,21 +986,39 @@ class Dataset(object):
 
             raise NotFound("No response information available.")
 
-        quantity_to_unit = {
-            "displacement": "M",
-            "velocity": "M/S",
-            "acceleration": "M/S**2",
-        }
-
         if self.is_blacklisted(obj):
             raise NotFound("Response is blacklisted:", self.get_nslc(obj))
 
         if not self.is_whitelisted(obj):
             raise NotFound("Response is not on whitelist:", self.get_nslc(obj))
 
-        net, sta, loc, cha = self.get_nslc(obj)
+        nslc = self.get_nslc(obj)
         tmin, tmax = self.get_tmin_tmax(obj)
 
+        # The response only depends on the epochs spanning the time window, so
+        # the memo grows with the number of epochs, not with the number of
+        # distinct trace time windows.
+        epochs = self._get_response_epochs(nslc, tmin, tmax)
+
+        k = (nslc, quantity, epochs)
+        if k not in self._response_cache:
+            try:
+                self._response_cache[k] = self._get_response(
+                    nslc, tmin, tmax, quantity, epochs
+                )
+
+            except NotFound as e:
+                self._response_cache[k] = e.with_traceback(None)
+
+        resp = self._response_cache[k]
+        if isinstance(resp, NotFound):
+            raise NotFound(resp.reason, resp.codes, resp.time_range)
+
+        return resp
+
+    def _get_response_keys(self, nslc):
+        net, sta, loc, cha = nslc
+
         keys_x = [(net, sta, loc, cha), (net, sta, "", cha), ("", sta, "", cha)]
 
         keys = []
@@ -597,29 +1026,71 @@ class Dataset(object):
             if k not in keys:
                 keys.append(k)
 
+        return keys
+
+    def _get_response_epochs(self, nslc, tmin, tmax):
+        """
+        Find the response epochs of a channel spanning a time window.
+
+        Returns a pair of tuples: the matching SAC PZ responses as ``(codes,
+        index)`` pairs into :py:attr:`responses` and the indices of the
+        matching StationXML channel epochs in the response index of ``nslc``.
+        """
+        net, sta, loc, cha = nslc
+
+        pz_epochs = []
+        for k in self._get_response_keys(nslc):
+            for i, x in enumerate(self.responses.get(k, [])):
+                if x.tmin < tmin and (x.tmax is None or tmax < x.tmax):
+                    pz_epochs.append((k, i))
+
+        sx_epochs = []
+        for i, (channel, _) in enumerate(
+            self._response_index.get((net, sta, loc.strip(), cha), [])
+        ):
+            if channel.spans(tmin, tmax):
+                sx_epochs.append(i)
+
+        return tuple(pz_epochs), tuple(sx_epochs)
+
+    def _get_response(self, nslc, tmin, tmax, quantity, epochs):
+        quantity_to_unit = {
+            "displacement": "M",
+            "velocity": "M/S",
+            "acceleration": "M/S**2",
+        }
+
+        net, sta, loc, cha = nslc
+        pz_epochs, sx_epochs = epochs
+
         candidates = []
-        for k in keys:
-            if k in self.responses:
-                for x in self.responses[k]:
-                    if x.tmin < tmin and (x.tmax is None or tmax < x.tmax):
-                        if quantity == "displacement":
-                            candidates.append(x.response)
-                        elif quantity == "velocity":
-                            candidates.append(
-                                trace.MultiplyResponse(
-                                    [x.response, trace.DifferentiationResponse()]
-                                )
-                            )
-                        elif quantity == "acceleration":
-                            candidates.append(
-                                trace.MultiplyResponse(
-                                    [x.response, trace.DifferentiationResponse(2)]
-                                )
-                            )
-                        else:
-                            assert False
+        for k, i in pz_epochs:
+            x = self.responses[k][i]
+            if quantity == "displacement":
+                candidates.append(x.response)
+            elif quantity == "velocity":
+                candidates.append(
+                    trace.MultiplyResponse(
+                        [x.response, trace.DifferentiationResponse()]
+                    )
+                )
+            elif quantity == "acceleration":
+                candidates.append(
+                    trace.MultiplyResponse(
+                        [x.response, trace.DifferentiationResponse(2)]
+                    )
+                )
+            else:
+                assert False
 
-        for sx in self.responses_stationxml:
+        channels = self._response_index.get((net, sta, loc.strip(), cha), [])
+        sxs = []
+        for i in sx_epochs:
+            _, sx = channels[i]
+            if sx not in sxs:
+                sxs.append(sx)
+
+        for sx in sxs:
             try:
                 candidates.append(
                     sx.get_pyrocko_response(
@@ -667,11 +1138,11 @@ class Dataset(object):
             if self.has_clipping((net, sta, loc, cha), tmin, tmax):
                 raise NotFound("Waveform clipped:", (net, sta, loc, cha))
 
-        trs = self.pile.all(
+        trs = self._chop_waveforms(
+            (net, sta, loc, cha),
             tmin=tmin + toffset_noise_extract,
             tmax=tmax + toffset_noise_extract,
             tpad=tpad,
-            trace_selector=lambda tr: tr.nslc_id == (net, sta, loc, cha),
             want_incomplete=want_incomplete or extend_incomplete,
         )
 
@@ -764,12 +1235,8 @@ class Dataset(object):
         if not station.get_channels():
             station = copy.deepcopy(station)
 
-            nsl = station.nsl()
-            trs = self.pile.all(
-                tmin=tmin,
-                tmax=tmax,
-                trace_selector=lambda tr: tr.nslc_id[:3] == nsl,
-                load_data=False,
+            trs = self._get_waveform_headers(
+                self._get_waveform_nslcs(station.nsl()), tmin, tmax
             )
 
             channels = list(set(tr.channel for tr in trs))
@@ -797,6 +1264,72 @@ class Dataset(object):
 
         return projections
 
+    def get_waveform_fingerprint(
+        self, station, backazimuth, source, target, tmin, tmax, tpad, cache_k
+    ):
+        """
+        Get digest of everything the processed waveforms of a station depend on.
+
+        This covers the processing parameters, station metadata, the files
+        and trace headers of the raw data in the padded time window,
+        instrument responses, station corrections, clippings and black- and
+        whitelisting of the raw channels.
+        """
+
+        if source is not None and target is not None:
+            backazimuth = source.azibazi_to(target)[1]
+
+        nsl = station.nsl()
+        quantity = cache_k[-1]
+
+        raw = []
+        for tr in self._get_waveform_headers(
+            self._get_waveform_nslcs(nsl), tmin - tpad, tmax + tpad
+        ):
+            try:
+                resp = str(self.get_response(tr, quantity=quantity))
+            except NotFound as e:
+                resp = str(e)
+
+            if self.clip_handling == "by_nslc":
+                clipped = self.has_clipping(tr.nslc_id, tmin, tmax)
+            else:
+                clipped = self.has_clipping(nsl, tmin, tmax)
+
+            raw.append(
+                (
+                    tr.nslc_id,
+                    tr.file.abspath,
+                    tr.file.mtime,
+                    tr.tmin,
+                    tr.tmax,
+                    tr.deltat,
+                    self.is_blacklisted(tr.nslc_id),
+                    self.is_whitelisted(tr.nslc_id),
+                    clipped,
+                    str(self.station_corrections.get(tr.nslc_id, None)),
+                    resp,
+                )
+            )
+
+        raw.sort(key=repr)
+
+        ident = (
+            WaveformDiskCache.__name__,
+            pyrocko.__version__,
+            cache_k,
+            str(station),
+            backazimuth,
+            self.apply_correction_delays,
+            self.apply_correction_factors,
+            self.apply_displaced_sampling_workaround,
+            self.extend_incomplete,
+            self.clip_handling,
+            raw,
+        )
+
+        return hashlib.sha1(repr(ident).encode("utf8")).hexdigest()
+
     def _get_waveform(
         self,
         obj,
@@ -839,14 +1372,15 @@ class Dataset(object):
         nslc = tuple(nslc)
 
         cache_k = nslc + (tmin, tmax, tuple(freqlimits), tfade, deltat, tpad, quantity)
-        if cache is not None and (nslc + cache_k) in cache:
-            obj = cache[nslc + cache_k]
-            if isinstance(obj, Exception):
-                raise obj
-            elif obj is None:
-                raise NotFound("Waveform not found!", nslc)
-            else:
-                return obj
+        if cache is not None:
+            obj = cache.get(nslc + cache_k, cache)
+            if obj is not cache:
+                if isinstance(obj, Exception):
+                    raise obj
+                elif obj is None:
+                    raise NotFound("Waveform not found!", nslc)
+                else:
+                    return obj
 
         syn_test = self.synthetic_test
         toffset_noise_extract = 0.0
@@ -888,6 +1422,34 @@ class Dataset(object):
             station, backazimuth, source, target, tmin, tmax
         )
 
+        disk_cache_key = None
+        if self._disk_cache is not None and not syn_test and not debug:
+            disk_cache_key = self.get_waveform_fingerprint(
+                station,
+                backazimuth,
+                source,
+                target,
+                tmin,
+                tmax,
+                tpad + tfade + abs_delay_max,
+                cache_k,
+            )
+
+            trs_projected = self._disk_cache.get(disk_cache_key)
+            if trs_projected is not None:
+                if cache is not None:
+                    for tr in trs_projected:
+                        cache[tr.nslc_id + cache_k] = tr
+
+                for tr in reversed(trs_projected):
+                    if tr.channel == channel:
+                        return tr
+
+                if cache is not None:
+                    cache[nslc + cache_k] = None
+
+                raise NotFound("waveform not available", nslc)
+
         try:
             trs_projected = []
             trs_restituted = []
@@ -954,6 +1516,9 @@ class Dataset(object):
                 if tmin is not None and tmax is not None:
                     tr.chop(tmin, tmax)
 
+            if disk_cache_key is not None:
+                self._disk_cache.put(disk_cache_key, trs_projected)
+
             if syn_test:
                 trs_projected_synthetic = []
                 for tr in trs_projected:
@@ -1018,6 +1583,81 @@ class Dataset(object):
             tr = self._get_waveform(obj, **kwargs)
             return tr.chop(tmin, tmax, inplace=False)
 
+    def prefetch(self, targets, engine, source, nthreads=None):
+        """
+        Process the observed waveforms of targets ahead of the optimisation.
+
+        The waveforms are requested with the time windows the targets would
+        use when modelling *source*, usually the problem's reference source,
+        so that they are found in the cache when the first models are
+        evaluated. Stations are processed in parallel by up to *nthreads*
+        threads (default: :py:attr:`prefetch_nthreads`), reading of the raw
+        data is serialised.
+
+        Targets which cannot set up their waveform requests, e.g. because
+        they are outside of the Green's function store, are skipped.
+
+        :returns: number of waveforms or targets which are not available
+        """
+        if nthreads is None:
+            nthreads = self.prefetch_nthreads
+
+        if not nthreads:
+            return 0
+
+        if self.synthetic_test:
+            # synthetic waveforms are modelled with the engine, which is not
+            # shared between threads
+            nthreads = 1
+
+        nmissing = 0
+        queries = defaultdict(list)
+        for target in targets:
+            try:
+                target_queries = target.get_waveform_queries(engine, source)
+            except (gf.OutOfBounds, gf.SeismosizerError) as e:
+                # e.g. station outside of the Green's function store, the
+                # target fails with the same error when it is evaluated
+                logger.debug(
+                    "Not prefetching waveforms of target %s: %s"
+                    % (target.string_id(), e)
+                )
+                nmissing += 1
+                continue
+
+            for nslc, kwargs in target_queries:
+                queries[nslc[:3]].append((nslc, kwargs))
+
+        def fetch(station_queries):
+            nmissing = 0
+            for nslc, kwargs in station_queries:
+                try:
+                    self.get_waveform(nslc, **kwargs)
+                except (NotFound, gf.OutOfBounds, gf.SeismosizerError) as e:
+                    logger.debug(str(e))
+                    nmissing += 1
+
+            return nmissing
+
+        logger.info(
+            "Prefetching observed waveforms of %i stations using %i threads..."
+            % (len(queries), nthreads)
+        )
+
+        tstart = time.time()
+        if nthreads == 1:
+            nmissing += sum(map(fetch, queries.values()))
+        else:
+            with ThreadPoolExecutor(max_workers=nthreads) as executor:
+                nmissing += sum(executor.map(fetch, queries.values()))
+
+        logger.info(
+            "Prefetched observed waveforms in %.1f s (%i not available)."
+            % (time.time() - tstart, nmissing)
+        )
+
+        return nmissing
+
     def get_events(self, magmin=None, event_names=None):
         evs = []
         for ev in self.events:
@@ -1175,6 +1815,35 @@ class DatasetConfig(HasPaths):
     )
     synthetic_test = SyntheticTest.T(optional=True)
 
+    waveform_cache_nbytes_max = Int.T(
+        optional=True,
+        help="Memory budget [bytes] for processed waveforms kept in the "
+        "dataset's cache. Least recently used waveforms are evicted first. "
+        "Default: 1 GiB.",
+    )
+    waveform_cache_spill_path = Path.T(
+        optional=True,
+        help="Local directory to which waveforms evicted from the cache are "
+        "written, instead of being reprocessed on the next access.",
+    )
+    waveform_cache_spill_nbytes_max = Int.T(
+        optional=True,
+        help="Disk budget [bytes] for spilled waveforms. Default: unlimited.",
+    )
+    waveform_disk_cache_path = Path.T(
+        optional=True,
+        help="Directory for a persistent cache of restituted and projected "
+        "waveforms, shared between runs. Entries are keyed on the raw data "
+        "files, responses and processing parameters.",
+    )
+
+    prefetch_nthreads = Int.T(
+        default=4,
+        help="Number of threads used to process the observed waveforms of "
+        "all targets before the optimisation starts. Set to 0 to disable "
+        "prefetching.",
+    )
+
     kite_scene_paths = List.T(Path.T(), optional=True)
 
     gnss_campaign_paths = List.T(Path.T(), optional=True)
@@ -1256,7 +1925,14 @@ class DatasetConfig(HasPaths):
 
                 return p
 
-            ds = Dataset(event_or_group_name)
+            cache = WaveformCache(spill_dirname=fp(self.waveform_cache_spill_path))
+            cache.spill_nbytes_max = self.waveform_cache_spill_nbytes_max
+            if self.waveform_cache_nbytes_max is not None:
+                cache.nbytes_max = self.waveform_cache_nbytes_max
+
+            ds = Dataset(event_or_group_name, cache=cache)
+            if self.waveform_disk_cache_path:
+                ds.set_disk_cache(WaveformDiskCache(fp(self.waveform_disk_cache_path)))
             try:
                 ds.add_events(filename=fp(self.events_path))
 
@@ -1299,6 +1975,7 @@ class DatasetConfig(HasPaths):
                     self.apply_displaced_sampling_workaround
                 )
                 ds.extend_incomplete = self.extend_incomplete
+                ds.prefetch_nthreads = self.prefetch_nthreads
 
                 for picks_path in self.picks_paths:
                     ds.add_picks(filename=fp(picks_path))
@@ -1321,6 +1998,8 @@ class DatasetConfig(HasPaths):
 __all__ = """
     Dataset
     DatasetConfig
+    WaveformCache
+    WaveformDiskCache
     DatasetError
     InvalidObject
     NotFound
@@ -251,7 +251,8 @@ config path:    %s
                 ModelHistory(
                     self.get_problem(),
                     nchains=self.get_optimiser().nchains,
-                    path=meta.xjoin(self.get_rundir_path(), subset))
+                    path=meta.xjoin(self.get_rundir_path(), subset),
+                    mmap=True)
 
             self._histories[subset].ensure_bootstrap_misfits(
                 self.get_optimiser())
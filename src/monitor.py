@@ -83,6 +83,8 @@ class GrondMonitor(threading.Thread):
         self._iiter = 0
         self._iter_buffer = RingBuffer(20)
         self._tm = None
+        self._early_terminations = []
+        self._early_terminations_mtime = None
 
     def run(self):
         logger.info('Waiting to follow environment %s...' % self.rundir)
@@ -113,12 +115,28 @@ class GrondMonitor(threading.Thread):
             while True:
                 ii += 1
                 self.history.update()
+                self.update_early_terminations()
                 time.sleep(0.1)
                 if self.sig_terminate.is_set():
                     break
 
         logger.debug('Monitor thread exiting.')
 
+    def update_early_terminations(self):
+        fn = op.join(self.rundir, 'early_termination.yaml')
+        if not op.exists(fn):
+            return
+
+        mtime = op.getmtime(fn)
+        if mtime == self._early_terminations_mtime:
+            return
+
+        self._early_terminations_mtime = mtime
+        self._early_terminations = self.optimiser.load_early_terminations(
+            self.rundir)
+        if self.history.nmodels > 0:
+            self.extend()
+
     @property
     def runtime(self):
         return timedelta(seconds=round(time.time() - self.starttime))
@@ -185,6 +203,10 @@ class GrondMonitor(threading.Thread):
         if optimiser_status.extra_footer is not None:
             lnadd(optimiser_status.extra_footer)
 
+        for termination in self._early_terminations:
+            lnadd('Ended {t.phase} (phase {iphase}) early: {t.reason}'
+                  .format(t=termination, iphase=termination.iphase + 1))
+
         self._tm.show('\n'.join(lines))
 
     def terminate(self):
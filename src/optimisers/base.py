@@ -15,9 +15,12 @@ class BadProblem(GrondError):
 @has_get_plot_classes
 class Optimiser(Object):
 
-    def optimise(self, problem):
+    def optimise(self, problem, rundir=None, resume=False):
         raise NotImplementedError
 
+    def has_checkpoint(self, rundir):
+        return False
+
     @property
     def niterations(self):
         raise NotImplementedError
@@ -25,6 +28,9 @@ class Optimiser(Object):
     def get_status(self, history):
         pass
 
+    def load_early_terminations(self, rundir):
+        return []
+
     def init_bootstraps(self, problem):
         raise NotImplementedError
 
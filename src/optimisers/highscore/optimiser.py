@@ -3,15 +3,18 @@ import math
 import os.path as op
 import os
 import logging
+import pickle
 import time
 import numpy as num
 from collections import OrderedDict
+from scipy.special import ndtr, ndtri
 
-from pyrocko.guts import StringChoice, Int, Float, Object, List
+from pyrocko import guts
+from pyrocko.guts import StringChoice, Int, Float, Object, List, String, Bool
 from pyrocko.guts_array import Array
 
 from grond.meta import GrondError, Forbidden, has_get_plot_classes
-from grond.problems.base import ModelHistory
+from grond.problems.base import ModelHistory, FsyncPolicyChoice
 from grond.optimisers.base import (
     Optimiser,
     OptimiserConfig,
@@ -48,12 +51,55 @@ def excentricity_compensated_probabilities(xs, sbx, factor):
 
 def excentricity_compensated_choice(xs, sbx, factor, rstate):
     probabilities = excentricity_compensated_probabilities(xs, sbx, factor)
+    return choice_from_probabilities(probabilities, rstate)
+
+
+def choice_from_probabilities(probabilities, rstate):
     r = rstate.random_sample()
     ichoice = num.searchsorted(num.cumsum(probabilities), r)
-    ichoice = min(ichoice, xs.shape[0] - 1)
+    ichoice = min(ichoice, probabilities.size - 1)
     return ichoice
 
 
+def truncated_normal(mean, std, xmin, xmax, rstate):
+    """
+    Draw from normal distributions truncated to ``[xmin, xmax]``.
+
+    Samples are drawn directly by inverse-CDF, so no rejection is needed.
+    Arguments are broadcast against each other. Where *std* is zero, the
+    mean is returned.
+
+    :returns: tuple ``(x, mass)``, where *mass* is the probability of the
+        untruncated normal distribution to fall into ``[xmin, xmax]``
+    """
+
+    mean, std, xmin, xmax = num.broadcast_arrays(mean, std, xmin, xmax)
+
+    degenerate = std <= 0.0
+    std_safe = num.where(degenerate, 1.0, std)
+    a = (xmin - mean) / std_safe
+    b = (xmax - mean) / std_safe
+
+    # work in the lower tail, where the normal CDF is accurate
+    flip = a > 0.0
+    a, b = num.where(flip, -b, a), num.where(flip, -a, b)
+
+    cdf_a = ndtr(a)
+    cdf_b = ndtr(b)
+    mass = cdf_b - cdf_a
+
+    z = ndtri(cdf_a + rstate.uniform(size=mean.shape) * mass)
+    z = num.clip(z, a, b)
+    z = num.where(flip, -z, z)
+
+    x = num.where(degenerate, mean, mean + std_safe * z)
+    mass = num.where(
+        degenerate, num.logical_and(xmin <= mean, mean <= xmax).astype(float), mass
+    )
+
+    return x, mass
+
+
 def local_std(xs):
     ssbx = num.sort(xs, axis=0)
     dssbx = num.diff(ssbx, axis=0)
@@ -116,6 +162,11 @@ class SamplerPhase(Object):
         default=1000, help="Tries to find a valid preconstrained sample."
     )
     seed = Int.T(optional=True, help="Random state seed.")
+    batch_size = Int.T(
+        default=1,
+        help="Number of models proposed and evaluated together in each "
+        "optimiser step.",
+    )
 
     def __init__(self, *args, **kwargs):
         Object.__init__(self, *args, **kwargs)
@@ -130,13 +181,13 @@ class SamplerPhase(Object):
     def get_raw_sample(self, problem, iiter, chains):
         raise NotImplementedError
 
-    def get_sample(self, problem, iiter, chains):
+    def get_sample(self, problem, iiter, chains, **kwargs):
         assert 0 <= iiter < self.niterations
 
         ntries_preconstrain = 0
         for ntries_preconstrain in range(self.ntries_preconstrain_limit):
             try:
-                sample = self.get_raw_sample(problem, iiter, chains)
+                sample = self.get_raw_sample(problem, iiter, chains, **kwargs)
                 sample.preconstrain(problem)
                 return sample
 
@@ -148,6 +199,12 @@ class SamplerPhase(Object):
             % (self.ntries_preconstrain_limit)
         )
 
+    def get_samples(self, problem, iiter, chains, nsamples):
+        """Get block of samples for iterations ``iiter`` to
+        ``iiter + nsamples - 1`` of this phase."""
+
+        return [self.get_sample(problem, iiter + i, chains) for i in range(nsamples)]
+
 
 class InjectionSamplerPhase(SamplerPhase):
     xs_inject = Array.T(
@@ -208,24 +265,72 @@ class DirectedSamplerPhase(SamplerPhase):
         else:
             return s or 1.0
 
-    def get_raw_sample(self, problem, iiter, chains):
+    def get_samples(self, problem, iiter, chains, nsamples):
+        """Get block of samples, each one based on a different chain.
+
+        Chains are chosen in order of increasing acceptance, wrapping around
+        if more samples than chains are requested. With the ``normal``
+        sampler distribution, the proposals of the whole block are drawn at
+        once."""
+
+        ichains = num.argsort(chains.accept_sum, kind="stable")
+        ichain_choices = [ichains[i % ichains.size] for i in range(nsamples)]
+
+        if self.sampler_distribution != "normal":
+            return [
+                self.get_sample(
+                    problem, iiter + i, chains, ichain_choice=ichain_choices[i]
+                )
+                for i in range(nsamples)
+            ]
+
+        for i in range(nsamples):
+            assert 0 <= iiter + i < self.niterations
+
         rstate = self.get_rstate()
-        factor = self.get_scatter_scale_factor(iiter)
-        npar = problem.nparameters
-        pnames = problem.parameter_names
-        xbounds = problem.get_parameter_bounds()
+        choices = [
+            self.get_starting_point(chains, ichain_choice, rstate)
+            for ichain_choice in ichain_choices
+        ]
+
+        xs = self.draw_normal(
+            problem,
+            num.array([xchoice for (xchoice, _) in choices]),
+            num.array(
+                [
+                    self.get_scatter_scale_factor(iiter + i)
+                    * chains.standard_deviation_models(
+                        ichain_choice, self.standard_deviation_estimator
+                    )
+                    for i, ichain_choice in enumerate(ichain_choices)
+                ]
+            ),
+            rstate,
+        )
 
-        ilink_choice = None
-        ichain_choice = num.argmin(chains.accept_sum)
+        samples = []
+        for i, (ichain_choice, (_, ilink_choice)) in enumerate(
+            zip(ichain_choices, choices)
+        ):
+            sample = self.make_sample(chains, xs[i], ichain_choice, ilink_choice)
+            try:
+                sample.preconstrain(problem)
+            except Forbidden:
+                sample = self.get_sample(
+                    problem, iiter + i, chains, ichain_choice=ichain_choice
+                )
 
+            samples.append(sample)
+
+        return samples
+
+    def get_starting_point(self, chains, ichain_choice, rstate):
+        ilink_choice = None
         if self.starting_point == "excentricity_compensated":
-            models = chains.models(ichain_choice)
-            ilink_choice = excentricity_compensated_choice(
-                models,
-                chains.standard_deviation_models(
-                    ichain_choice, self.standard_deviation_estimator
+            ilink_choice = choice_from_probabilities(
+                chains.excentricity_compensated_probabilities(
+                    ichain_choice, self.standard_deviation_estimator, 2.0
                 ),
-                2.0,
                 rstate,
             )
 
@@ -241,44 +346,80 @@ class DirectedSamplerPhase(SamplerPhase):
         else:
             assert False, "invalid starting_point choice: %s" % (self.starting_point)
 
-        ntries_sample = 0
-        if self.sampler_distribution == "normal":
-            x = num.zeros(npar, dtype=num.float64)
-            sx = chains.standard_deviation_models(
-                ichain_choice, self.standard_deviation_estimator
+        return xchoice, ilink_choice
+
+    def draw_normal(self, problem, xchoices, sxs, rstate):
+        """Draw candidates from normal distributions truncated to the
+        parameter bounds.
+
+        Equivalent to redrawing each parameter until it falls inside the
+        bounds. After ``ntries_sample_limit`` failed tries, the parameter is
+        drawn from the uniform distribution instead. This fallback happens
+        with the same probability as with redrawing."""
+
+        pnames = problem.parameter_names
+        xbounds = problem.get_parameter_bounds()
+
+        xs, mass = truncated_normal(xchoices, sxs, xbounds[:, 0], xbounds[:, 1], rstate)
+
+        with num.errstate(divide="ignore"):
+            pfallback = num.exp((self.ntries_sample_limit + 2) * num.log1p(-mass))
+
+        fallback = rstate.uniform(size=xs.shape) < pfallback
+        for isample, ipar in zip(*num.nonzero(fallback)):
+            logger.warning(
+                "failed to produce a suitable "
+                "candidate sample from normal "
+                "distribution for parameter '%s'"
+                "- drawing from uniform instead." % pnames[ipar]
             )
+            xs[isample, ipar] = rstate.uniform(xbounds[ipar, 0], xbounds[ipar, 1])
+
+        return xs
+
+    def make_sample(self, chains, x, ichain_choice, ilink_choice):
+        imodel_base = None
+        if ilink_choice is not None:
+            imodel_base = chains.imodel(ichain_choice, ilink_choice)
+
+        return Sample(
+            model=x,
+            ichain_base=ichain_choice,
+            ilink_base=ilink_choice,
+            imodel_base=imodel_base,
+        )
 
-            for ipar in range(npar):
-                ntries = 0
-                while True:
-                    if sx[ipar] > 0.0:
-                        v = rstate.normal(xchoice[ipar], factor * sx[ipar])
-                    else:
-                        v = xchoice[ipar]
+    def get_raw_sample(self, problem, iiter, chains, ichain_choice=None):
+        rstate = self.get_rstate()
+        factor = self.get_scatter_scale_factor(iiter)
+        npar = problem.nparameters
+        pnames = problem.parameter_names
+        xbounds = problem.get_parameter_bounds()
 
-                    if xbounds[ipar, 0] <= v and v <= xbounds[ipar, 1]:
-                        break
+        if ichain_choice is None:
+            ichain_choice = num.argmin(chains.accept_sum)
 
-                    if ntries > self.ntries_sample_limit:
-                        logger.warning(
-                            "failed to produce a suitable "
-                            "candidate sample from normal "
-                            "distribution for parameter '%s'"
-                            "- drawing from uniform instead." % pnames[ipar]
-                        )
-                        v = rstate.uniform(xbounds[ipar, 0], xbounds[ipar, 1])
-                        break
+        xchoice, ilink_choice = self.get_starting_point(chains, ichain_choice, rstate)
 
-                    ntries += 1
+        ntries_sample = 0
+        if self.sampler_distribution == "normal":
+            sx = chains.standard_deviation_models(
+                ichain_choice, self.standard_deviation_estimator
+            )
 
-                x[ipar] = v
+            x = self.draw_normal(
+                problem,
+                xchoice[num.newaxis, :],
+                factor * sx[num.newaxis, :],
+                rstate,
+            )[0]
 
         elif self.sampler_distribution == "multivariate_normal":
             ok_mask_sum = num.zeros(npar, dtype=num.int)
             while True:
                 ntries_sample += 1
                 xcandi = rstate.multivariate_normal(
-                    xchoice, factor**2 * chains.cov(ichain_choice)
+                    xchoice, factor**2 * chains.covariance_models(ichain_choice)
                 )
 
                 ok_mask = num.logical_and(
@@ -303,16 +444,7 @@ class DirectedSamplerPhase(SamplerPhase):
 
             x = xcandi
 
-        imodel_base = None
-        if ilink_choice is not None:
-            imodel_base = chains.imodel(ichain_choice, ilink_choice)
-
-        return Sample(
-            model=x,
-            ichain_base=ichain_choice,
-            ilink_base=ilink_choice,
-            imodel_base=imodel_base,
-        )
+        return self.make_sample(chains, x, ichain_choice, ilink_choice)
 
 
 def make_bayesian_weights(nbootstrap, nmisfits, type="bayesian", rstate=None):
@@ -336,7 +468,61 @@ def make_bayesian_weights(nbootstrap, nmisfits, type="bayesian", rstate=None):
     return ws
 
 
+class ChainMoments(object):
+    """
+    Running first and second moments of the models in a chain.
+
+    The sums are taken relative to a fixed reference point *x0* to limit
+    cancellation. :py:meth:`update` adds and removes only the models that
+    joined or left the chain since the last update, unless that would be
+    more work than recomputing the sums from scratch.
+    """
+
+    def __init__(self, x0, nupdates_max):
+        self.x0 = x0
+        self.nupdates_max = nupdates_max
+        self.indices = num.zeros(0, dtype=int)
+        self.s1 = num.zeros(x0.size)
+        self.s2 = num.zeros((x0.size, x0.size))
+        self.nupdates = 0
+
+    @property
+    def n(self):
+        return self.indices.size
+
+    def update(self, models, indices):
+        indices = num.sort(indices)
+        added = num.setdiff1d(indices, self.indices, assume_unique=True)
+        removed = num.setdiff1d(self.indices, indices, assume_unique=True)
+
+        if (
+            2 * (added.size + removed.size) >= indices.size
+            or self.nupdates >= self.nupdates_max
+        ):
+            xs = models[indices] - self.x0
+            self.s1 = num.sum(xs, axis=0)
+            self.s2 = num.dot(xs.T, xs)
+            self.nupdates = 0
+
+        elif added.size or removed.size:
+            xa = models[added] - self.x0
+            xr = models[removed] - self.x0
+            self.s1 += num.sum(xa, axis=0) - num.sum(xr, axis=0)
+            self.s2 += num.dot(xa.T, xa) - num.dot(xr.T, xr)
+            self.nupdates += 1
+
+        self.indices = indices
+
+    def mean(self):
+        return self.x0 + self.s1 / self.n
+
+    def scatter(self):
+        return self.s2 - num.outer(self.s1, self.s1) / self.n
+
+
 class Chains(object):
+    nread_block = 128
+
     def __init__(self, problem, history, nchains, nlinks_cap):
         self.problem = problem
         self.history = history
@@ -350,6 +536,12 @@ class Chains(object):
         self.accept_sum = num.zeros(self.nchains, dtype=num.int)
         self._acceptance_history = num.zeros((self.nchains, 1024), dtype=num.bool)
 
+        # bumped whenever the membership of a chain changes
+        self._versions = num.zeros(self.nchains, dtype=int)
+        self._version_all = 0
+        self._stats = {}
+        self._moments = {}
+
         history.add_listener(self)
 
     def goto(self, n=None):
@@ -361,35 +553,117 @@ class Chains(object):
         assert self.nread <= n
 
         while self.nread < n:
-            nread = self.nread
-            gbms = self.history.bootstrap_misfits[nread, :]
+            nblock = min(n - self.nread, self.nread_block)
+            self._insert_block(
+                self.history.bootstrap_misfits[self.nread : self.nread + nblock, :].T
+            )
+
+    def _insert_block(self, gbms):
+        """
+        Insert block of models into all chains at once.
+
+        :param gbms: bootstrap misfits of the new models, indexed as
+            ``gbms[ichain, imodel]``
+
+        Gives the same result as inserting the models one by one, keeping
+        each chain sorted and dropping its worst member when the chain is
+        full. Ties are resolved in favour of the earlier model, NaN misfits
+        are treated as worse than any other value.
+        """
+        nchains, nblock = gbms.shape
+        nlinks = self.nlinks
+        nlinks_max = self.nlinks_cap - 1
+
+        def key(misfits):
+            return num.where(num.isnan(misfits), num.inf, misfits)
+
+        chains_m = self.chains_m[:, :nlinks]
+        chains_i = self.chains_i[:, :nlinks]
+        kold = key(chains_m)
+        knew = key(gbms)
+
+        # number of earlier models (old links and earlier block members)
+        # sorting before each new model, in every chain
+        nbefore = num.sum(kold[:, :, num.newaxis] <= knew[:, num.newaxis, :], axis=1)
+        nbefore += num.sum(
+            num.triu(knew[:, :, num.newaxis] <= knew[:, num.newaxis, :], k=1),
+            axis=1,
+        )
 
-            self.chains_m[:, self.nlinks] = gbms
-            self.chains_i[:, self.nlinks] = nread
-            nbootstrap = self.chains_m.shape[0]
+        full = nlinks + num.arange(nblock) >= nlinks_max
+        accept = num.logical_or(~full[num.newaxis, :], nbefore < nlinks_max)
+
+        merged_m = num.hstack((chains_m, gbms))
+        merged_i = num.hstack(
+            (
+                chains_i,
+                num.repeat(
+                    num.arange(self.nread, self.nread + nblock)[num.newaxis, :],
+                    nchains,
+                    axis=0,
+                ),
+            )
+        )
 
-            self.nlinks += 1
-            chains_m = self.chains_m
-            chains_i = self.chains_i
+        nlinks_new = min(nlinks + nblock, nlinks_max)
+        isort = num.argsort(key(merged_m), axis=1, kind="stable")[:, :nlinks_new]
 
-            for ichain in range(nbootstrap):
-                isort = num.argsort(chains_m[ichain, : self.nlinks])
-                chains_m[ichain, : self.nlinks] = chains_m[ichain, isort]
-                chains_i[ichain, : self.nlinks] = chains_i[ichain, isort]
+        self.chains_m[:, :nlinks_new] = num.take_along_axis(merged_m, isort, axis=1)
+        self.chains_i[:, :nlinks_new] = num.take_along_axis(merged_i, isort, axis=1)
+        self.nlinks = nlinks_new
 
-            if self.nlinks == self.nlinks_cap:
-                accept = (chains_i[:, self.nlinks_cap - 1] != nread).astype(num.bool)
-                self.nlinks -= 1
-            else:
-                accept = num.ones(self.nchains, dtype=num.bool)
+        changed = num.any(accept, axis=1)
+        self._versions += changed
+        self._version_all += int(num.any(changed))
 
-            self._append_acceptance(accept)
-            self.accept_sum += accept
-            self.nread += 1
+        self._append_acceptance(accept)
+        self.accept_sum += num.sum(accept, axis=1)
+        self.nread += nblock
 
     def load(self):
         return self.goto()
 
+    def get_state(self):
+        """Get the chains and their cached statistics for a checkpoint."""
+
+        return dict(
+            nread=self.nread,
+            nlinks=self.nlinks,
+            chains_m=self.chains_m[:, : self.nlinks],
+            chains_i=self.chains_i[:, : self.nlinks],
+            accept_sum=self.accept_sum,
+            acceptance_history=self.acceptance_history,
+            versions=self._versions,
+            version_all=self._version_all,
+            stats=self._stats,
+            moments=self._moments,
+        )
+
+    def set_state(self, state):
+        """Restore chains from a checkpoint taken with :py:meth:`get_state`.
+
+        The statistics caches are restored as well, so that sampling
+        continues exactly as if the run had not been interrupted.
+        """
+
+        nlinks = state["nlinks"]
+        assert state["chains_m"].shape == (self.nchains, nlinks)
+        assert nlinks < self.nlinks_cap
+
+        self.nread = state["nread"]
+        self.nlinks = nlinks
+        self.chains_m[:, :nlinks] = state["chains_m"]
+        self.chains_i[:, :nlinks] = state["chains_i"]
+        self.accept_sum[:] = state["accept_sum"]
+        self._acceptance_history = num.zeros(
+            (self.nchains, max(1024, nextpow2(self.nread))), dtype=num.bool
+        )
+        self._acceptance_history[:, : self.nread] = state["acceptance_history"]
+        self._versions[:] = state["versions"]
+        self._version_all = state["version_all"]
+        self._stats = state["stats"]
+        self._moments = state["moments"]
+
     def extend(self, ioffset, n, models, misfits, sampler_contexts):
         self.goto(ioffset + n)
 
@@ -415,9 +689,61 @@ class Chains(object):
         assert ilink < self.nlinks
         return self.chains_m[ichain, ilink]
 
+    def version(self, ichain=None):
+        """Get counter which changes whenever the membership of chain
+        *ichain* (or of any chain, if *ichain* is ``None``) changes."""
+
+        if ichain is None:
+            return self._version_all
+        else:
+            return self._versions[ichain]
+
+    def _get_stat(self, name, ichain, compute):
+        k = (name, ichain)
+        version = self.version(ichain)
+        if k not in self._stats or self._stats[k][0] != version:
+            self._stats[k] = (version, compute())
+
+        return self._stats[k][1]
+
+    def _get_moments(self, ichain):
+        if ichain not in self._moments:
+            xbounds = self.problem.get_parameter_bounds()
+            self._moments[ichain] = ChainMoments(
+                0.5 * (xbounds[:, 0] + xbounds[:, 1]), self.nlinks_cap
+            )
+
+        moments = self._moments[ichain]
+        moments.update(self.history.models, self.indices(ichain))
+        return moments
+
+    def _moments_all(self):
+        """Get count, sum and scatter over all chains, counting models which
+        are in several chains multiple times."""
+
+        n = 0
+        s1 = 0.0
+        s2 = 0.0
+        for ichain in range(self.nchains):
+            moments = self._get_moments(ichain)
+            n += moments.n
+            s1 = s1 + moments.s1
+            s2 = s2 + moments.s2
+
+        x0 = self._moments[0].x0
+        return n, x0 + s1 / n, s2 - num.outer(s1, s1) / n
+
     def mean_model(self, ichain=None):
-        xs = self.models(ichain)
-        return num.mean(xs, axis=0)
+
+        def compute():
+            if self.nlinks < 2:
+                return num.mean(self.models(ichain), axis=0)
+            elif ichain is None:
+                return self._moments_all()[1]
+            else:
+                return self._get_moments(ichain).mean()
+
+        return self._get_stat("mean", ichain, compute)
 
     def best_model(self, ichain=0):
         xs = self.models(ichain)
@@ -427,34 +753,172 @@ class Chains(object):
         return self.chains_m[ichain, 0]
 
     def standard_deviation_models(self, ichain, estimator):
+        if estimator == "standard_deviation_all_chains":
+            ichain = None
+
+        return self._get_stat(
+            estimator,
+            ichain,
+            lambda: self._standard_deviation_models(ichain, estimator),
+        )
+
+    def _standard_deviation_models(self, ichain, estimator):
         if estimator == "median_density_single_chain":
             xs = self.models(ichain)
             return local_std(xs)
+        elif self.nlinks < 2:
+            return num.std(self.models(ichain), axis=0)
         elif estimator == "standard_deviation_all_chains":
-            bxs = self.models()
-            return num.std(bxs, axis=0)
+            n, _, scatter = self._moments_all()
+            return num.sqrt(num.maximum(num.diag(scatter), 0.0) / n)
         elif estimator == "standard_deviation_single_chain":
-            xs = self.models(ichain)
-            return num.std(xs, axis=0)
+            moments = self._get_moments(ichain)
+            return num.sqrt(num.maximum(num.diag(moments.scatter()), 0.0) / moments.n)
         else:
             assert False, "invalid standard_deviation_estimator choice"
 
     def covariance_models(self, ichain):
-        xs = self.models(ichain)
-        return num.cov(xs.T)
+
+        def compute():
+            if self.nlinks < 2:
+                return num.cov(self.models(ichain).T)
+
+            moments = self._get_moments(ichain)
+            return moments.scatter() / (moments.n - 1)
+
+        return self._get_stat("covariance", ichain, compute)
+
+    def excentricity_compensated_probabilities(self, ichain, estimator, factor):
+        return self._get_stat(
+            ("excentricity_compensated_probabilities", estimator, factor),
+            ichain,
+            lambda: excentricity_compensated_probabilities(
+                self.models(ichain),
+                self.standard_deviation_models(ichain, estimator),
+                factor,
+            ),
+        )
 
     @property
     def acceptance_history(self):
         return self._acceptance_history[:, : self.nread]
 
     def _append_acceptance(self, acceptance):
-        if self.nread >= self._acceptance_history.shape[1]:
+        nblock = acceptance.shape[1]
+        if self.nread + nblock > self._acceptance_history.shape[1]:
             new_buf = num.zeros(
-                (self.nchains, nextpow2(self.nread + 1)), dtype=num.bool
+                (self.nchains, nextpow2(self.nread + nblock)), dtype=num.bool
             )
             new_buf[:, : self._acceptance_history.shape[1]] = self._acceptance_history
             self._acceptance_history = new_buf
-        self._acceptance_history[:, self.nread] = acceptance
+        self._acceptance_history[:, self.nread : self.nread + nblock] = acceptance
+
+
+class ConvergenceCriterion(Object):
+    """
+    Criterion to end a directed sampler phase early when the chains have
+    converged.
+
+    Every :py:gattr:`nwindow` iterations, the state of the chains is compared
+    to the state :py:gattr:`nwindow` iterations before. The phase is ended if
+    the acceptance rate, the improvement of the best misfits and the change
+    of the parameter spread are all below their limits.
+    """
+
+    nwindow = Int.T(
+        default=500,
+        help="Number of iterations between convergence checks, also the "
+        "window over which the acceptance rate is averaged.",
+    )
+    niterations_min = Int.T(
+        default=1000,
+        help="Minimum number of iterations of a phase before it can be ended "
+        "early.",
+    )
+    acceptance_rate_max = Float.T(
+        default=0.02,
+        help="Maximum rate of models accepted into any of the chains.",
+    )
+    misfit_improvement_max = Float.T(
+        default=0.001,
+        help="Maximum relative improvement of the best misfit of any of the "
+        "bootstrap chains.",
+    )
+    spread_change_max = Float.T(
+        default=0.05,
+        help="Maximum relative change of the standard deviation of any "
+        "parameter over all chains.",
+    )
+
+    def snapshot(self, chains):
+        """Get best misfits of all chains and parameter spread."""
+
+        return (
+            chains.chains_m[:, 0].copy(),
+            chains.standard_deviation_models(
+                None, "standard_deviation_all_chains"
+            ).copy(),
+        )
+
+    def measure(self, chains, snapshot_before, snapshot):
+        """
+        Get acceptance rate, relative misfit improvement and relative change
+        of the parameter spread between two snapshots.
+        """
+
+        best_before, std_before = snapshot_before
+        best, std = snapshot
+
+        acceptance_rate = float(num.mean(chains.acceptance_history[:, -self.nwindow :]))
+
+        with num.errstate(divide="ignore", invalid="ignore"):
+            misfit_improvement = (best_before - best) / num.abs(best_before)
+            spread_change = num.abs(std - std_before) / std_before
+
+        misfit_improvement[best == best_before] = 0.0
+        spread_change[std == std_before] = 0.0
+
+        def max_or_inf(values):
+            if not num.all(num.isfinite(values)):
+                return num.inf
+
+            return float(num.max(values))
+
+        return (
+            acceptance_rate,
+            max_or_inf(misfit_improvement),
+            max_or_inf(spread_change),
+        )
+
+    def is_converged(self, acceptance_rate, misfit_improvement, spread_change):
+        return (
+            acceptance_rate <= self.acceptance_rate_max
+            and misfit_improvement <= self.misfit_improvement_max
+            and spread_change <= self.spread_change_max
+        )
+
+
+class EarlyTermination(Object):
+    """Record of a sampler phase ended early by a convergence criterion."""
+
+    iphase = Int.T(help="Index of the sampler phase.")
+    phase = String.T(help="Type of the sampler phase.")
+    iiter_phase = Int.T(help="Number of iterations run in the phase.")
+    niterations_phase = Int.T(help="Configured number of iterations.")
+    acceptance_rate = Float.T()
+    misfit_improvement = Float.T()
+    spread_change = Float.T()
+    reason = String.T()
+
+
+def load_early_terminations(rundir):
+    """Load records of sampler phases ended early from a rundir."""
+
+    fn = op.join(rundir, "early_termination.yaml")
+    if not op.exists(fn):
+        return []
+
+    return guts.load_all(filename=fn)
 
 
 @has_get_plot_classes
@@ -466,6 +930,12 @@ class HighScoreOptimiser(Optimiser):
     nbootstrap = Int.T(default=100)
     bootstrap_type = BootstrapTypeChoice.T(default="bayesian")
     bootstrap_seed = Int.T(default=23)
+    history_flush_nmodels = Int.T(default=100)
+    history_flush_interval = Float.T(default=1.0)
+    history_fsync = FsyncPolicyChoice.T(default="never")
+    checkpoint_interval = Float.T(default=60.0)
+    convergence_criterion = ConvergenceCriterion.T(optional=True)
+    fast_bootstrap_misfits = Bool.T(default=False)
 
     SPARKS = "\u2581\u2582\u2583\u2584\u2585\u2586\u2587\u2588"
     ACCEPTANCE_AVG_LEN = 100
@@ -568,12 +1038,12 @@ class HighScoreOptimiser(Optimiser):
 
         assert False, "sample out of bounds"
 
-    def log_progress(self, problem, iiter, niter, phase, iiter_phase):
+    def log_progress(self, problem, iiter, niter, phase, iiter_phase, nsamples=1):
         t = time.time()
         if (
             self._tlog_last < t - 10.0
             or iiter_phase == 0
-            or iiter_phase == phase.niterations - 1
+            or iiter_phase + nsamples >= phase.niterations
         ):
             logger.info(
                 "%s at %i/%i (%s, %i/%i)"
@@ -589,64 +1059,302 @@ class HighScoreOptimiser(Optimiser):
 
             self._tlog_last = t
 
-    def optimise(self, problem, rundir=None):
+    def optimise(self, problem, rundir=None, resume=False):
+        checkpoint = None
         if rundir is not None:
-            self.dump(filename=op.join(rundir, "optimiser.yaml"))
+            if resume:
+                checkpoint = self.load_checkpoint(rundir)
+            else:
+                self.dump(filename=op.join(rundir, "optimiser.yaml"))
+
+        history = ModelHistory(
+            problem,
+            nchains=self.nchains,
+            path=rundir,
+            mode="w",
+            writer_config=dict(
+                flush_nmodels=self.history_flush_nmodels,
+                flush_interval=self.history_flush_interval,
+                fsync=self.history_fsync,
+            ),
+        )
+        try:
+            if checkpoint is not None:
+                history.resume(checkpoint["nmodels"])
+
+            self._optimise(problem, history, checkpoint)
+        finally:
+            history.close()
+
+        if rundir is not None and self.has_checkpoint(rundir):
+            os.unlink(op.join(rundir, "checkpoint"))
+
+    def has_checkpoint(self, rundir):
+        return op.exists(op.join(rundir, "checkpoint"))
 
-        history = ModelHistory(problem, nchains=self.nchains, path=rundir, mode="w")
+    def load_checkpoint(self, rundir):
+        fn = op.join(rundir, "checkpoint")
+        try:
+            with open(fn, "rb") as f:
+                checkpoint = pickle.load(f)
+
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            raise GrondError("Cannot load checkpoint %s: %s" % (fn, e))
+
+        phase_niterations = [phase.niterations for phase in self.sampler_phases]
+        if (
+            checkpoint["nchains"] != self.nchains
+            or checkpoint["phase_niterations"] != phase_niterations
+        ):
+            raise GrondError(
+                "Cannot resume from checkpoint %s: optimiser configuration has "
+                "changed." % fn
+            )
+
+        return checkpoint
+
+    def save_checkpoint(self, problem, history, chains, iiter, isbad_mask):
+        """
+        Save the state of the optimisation to the rundir.
+
+        The models in the history are flushed to disk first, so that the
+        checkpoint is consistent with the committed models of the rundir.
+        """
+
+        history.flush()
+
+        checkpoint = dict(
+            nmodels=history.nmodels,
+            iiter=iiter,
+            nchains=self.nchains,
+            phase_niterations=[phase.niterations for phase in self.sampler_phases],
+            rstates=[phase._rstate for phase in self.sampler_phases],
+            bootstrap_weights=self.get_bootstrap_weights(problem),
+            bootstrap_residuals=self.get_bootstrap_residuals(problem),
+            isbad_mask=isbad_mask,
+            chains=chains.get_state(),
+            convergence_snapshots=self._convergence_snapshots,
+            early_terminations=self._early_terminations,
+        )
+
+        fn = op.join(history.path, "checkpoint")
+        fn_temp = fn + ".temp"
+        with open(fn_temp, "wb") as f:
+            pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(fn_temp, fn)
+        self._tcheckpoint_last = time.time()
+
+    def restore_checkpoint(self, history, chains, checkpoint):
+        assert history.nmodels == checkpoint["nmodels"]
+
+        for phase, rstate in zip(self.sampler_phases, checkpoint["rstates"]):
+            phase._rstate = rstate
+
+        self._bootstrap_weights = checkpoint["bootstrap_weights"]
+        self._bootstrap_residuals = checkpoint["bootstrap_residuals"]
+        self._convergence_snapshots = checkpoint.get("convergence_snapshots", {})
+        self._early_terminations = checkpoint.get("early_terminations", [])
+
+        try:
+            chains.set_state(checkpoint["chains"])
+        except (KeyError, AssertionError):
+            logger.warning("Checkpoint has no usable chains, rebuilding them.")
+            chains.goto()
+
+        iiter = checkpoint.get("iiter", checkpoint["nmodels"])
+        logger.info("Resuming optimisation at iteration %i." % (iiter + 1))
+
+        return iiter, checkpoint["isbad_mask"]
+
+    def check_convergence(
+        self, problem, history, chains, iphase, phase, iiter_phase, nsamples
+    ):
+        """
+        Check if a directed phase should be ended early.
+
+        Called after iterations *iiter_phase* to ``iiter_phase + nsamples - 1``
+        of phase *iphase* have been added to the history. When the phase is
+        ended, the reason is recorded in the rundir.
+        """
+
+        criterion = self.convergence_criterion
+        iiter_phase_new = iiter_phase + nsamples
+        if (
+            criterion is None
+            or not isinstance(phase, DirectedSamplerPhase)
+            or iiter_phase_new >= phase.niterations
+            or iiter_phase_new // criterion.nwindow == iiter_phase // criterion.nwindow
+        ):
+            return False
+
+        snapshot = criterion.snapshot(chains)
+        snapshot_before = self._convergence_snapshots.get(iphase)
+        self._convergence_snapshots[iphase] = snapshot
+
+        if snapshot_before is None or iiter_phase_new < criterion.niterations_min:
+            return False
+
+        acceptance_rate, misfit_improvement, spread_change = criterion.measure(
+            chains, snapshot_before, snapshot
+        )
+
+        logger.debug(
+            "%s: convergence at iteration %i of %s: acceptance rate %g, best "
+            "misfit improvement %g, parameter spread change %g"
+            % (
+                problem.name,
+                iiter_phase_new,
+                phase.__class__.__name__,
+                acceptance_rate,
+                misfit_improvement,
+                spread_change,
+            )
+        )
+
+        if not criterion.is_converged(
+            acceptance_rate, misfit_improvement, spread_change
+        ):
+            return False
+
+        reason = (
+            "converged after %i of %i iterations: acceptance rate %.2g%%, "
+            "best misfit improvement %.2g%%, parameter spread change %.2g%% "
+            "over the last %i iterations"
+            % (
+                iiter_phase_new,
+                phase.niterations,
+                acceptance_rate * 100.0,
+                misfit_improvement * 100.0,
+                spread_change * 100.0,
+                criterion.nwindow,
+            )
+        )
+
+        logger.info(
+            "%s: ending %s early, %s."
+            % (problem.name, phase.__class__.__name__, reason)
+        )
+
+        self._early_terminations.append(
+            EarlyTermination(
+                iphase=iphase,
+                phase=phase.__class__.__name__,
+                iiter_phase=iiter_phase_new,
+                niterations_phase=phase.niterations,
+                acceptance_rate=acceptance_rate,
+                misfit_improvement=misfit_improvement,
+                spread_change=spread_change,
+                reason=reason,
+            )
+        )
+
+        if history.path is not None:
+            guts.dump_all(
+                self._early_terminations,
+                filename=op.join(history.path, "early_termination.yaml"),
+            )
+
+        return True
+
+    def load_early_terminations(self, rundir):
+        """Load records of sampler phases ended early from a rundir."""
+        return load_early_terminations(rundir)
+
+    def _optimise(self, problem, history, checkpoint=None):
         chains = self.chains(problem, history)
 
         niter = self.niterations
         isbad_mask = None
         self._tlog_last = 0
-        for iiter in range(niter):
+        self._tcheckpoint_last = time.time()
+        self._convergence_snapshots = {}
+        self._early_terminations = []
+        iiter = 0
+
+        if checkpoint is not None:
+            iiter, isbad_mask = self.restore_checkpoint(history, chains, checkpoint)
+
+        while iiter < niter:
             iphase, phase, iiter_phase = self.get_sampler_phase(iiter)
-            self.log_progress(problem, iiter, niter, phase, iiter_phase)
+            nsamples = min(phase.batch_size, phase.niterations - iiter_phase)
+            self.log_progress(problem, iiter, niter, phase, iiter_phase, nsamples)
+
+            samples = phase.get_samples(problem, iiter_phase, chains, nsamples)
+            for sample in samples:
+                sample.iphase = iphase
 
-            sample = phase.get_sample(problem, iiter_phase, chains)
-            sample.iphase = iphase
+            models = num.array([sample.model for sample in samples])
 
             if isbad_mask is not None and num.any(isbad_mask):
                 isok_mask = num.logical_not(isbad_mask)
             else:
                 isok_mask = None
 
-            misfits = problem.misfits(sample.model, mask=isok_mask)
+            if problem.target_dependants:
+                misfits, target_dependants = problem.misfits_many(
+                    models, mask=isok_mask, want_target_dependants=True
+                )
+            else:
+                misfits = problem.misfits_many(models, mask=isok_mask)
+                target_dependants = None
 
             bootstrap_misfits = problem.combine_misfits(
                 misfits,
                 extra_weights=self.get_bootstrap_weights(problem),
                 extra_residuals=self.get_bootstrap_residuals(problem),
+                exact=not self.fast_bootstrap_misfits,
             )
 
-            isbad_mask_new = num.isnan(misfits[:, 0])
-            if isbad_mask is not None and num.any(isbad_mask != isbad_mask_new):
-                errmess = [
-                    "problem %s: inconsistency in data availability"
-                    " at iteration %i" % (problem.name, iiter)
-                ]
+            for imodel in range(nsamples):
+                isbad_mask_new = num.isnan(misfits[imodel, :, 0])
+                if isbad_mask is not None and num.any(isbad_mask != isbad_mask_new):
+                    errmess = [
+                        "problem %s: inconsistency in data availability"
+                        " at iteration %i" % (problem.name, iiter + imodel)
+                    ]
 
-                for target, isbad_new, isbad in zip(
-                    problem.targets, isbad_mask_new, isbad_mask
-                ):
-                    if isbad_new != isbad:
-                        errmess.append(
-                            "  %s, %s -> %s" % (target.string_id(), isbad, isbad_new)
-                        )
+                    for target, isbad_new, isbad in zip(
+                        problem.targets, isbad_mask_new, isbad_mask
+                    ):
+                        if isbad_new != isbad:
+                            errmess.append(
+                                "  %s, %s -> %s"
+                                % (target.string_id(), isbad, isbad_new)
+                            )
 
-                raise BadProblem("\n".join(errmess))
+                    raise BadProblem("\n".join(errmess))
 
-            isbad_mask = isbad_mask_new
+                isbad_mask = isbad_mask_new
 
             if num.all(isbad_mask):
                 raise BadProblem(
                     "Problem %s: all target misfit values are NaN." % problem.name
                 )
 
-            history.append(
-                sample.model, misfits, bootstrap_misfits, sample.pack_context()
+            history.extend(
+                models,
+                misfits,
+                bootstrap_misfits,
+                num.array([sample.pack_context() for sample in samples]),
+                target_dependants=target_dependants,
             )
 
+            iiter += nsamples
+
+            if self.check_convergence(
+                problem, history, chains, iphase, phase, iiter_phase, nsamples
+            ):
+                iiter += phase.niterations - (iiter_phase + nsamples)
+
+            if (
+                history.path is not None
+                and self.checkpoint_interval > 0.0
+                and iiter < niter
+                and time.time() - self._tcheckpoint_last >= self.checkpoint_interval
+            ):
+                self.save_checkpoint(problem, history, chains, iiter, isbad_mask)
+
     @property
     def niterations(self):
         return sum([ph.niterations for ph in self.sampler_phases])
@@ -668,7 +1376,13 @@ class HighScoreOptimiser(Optimiser):
             arr[: data.size] = data
             return arr
 
+        # phases ended early shift the phase boundaries, prefer the phase
+        # recorded with the models
         phase = self.get_sampler_phase(history.nmodels - 1)[1]
+        if history.sampler_contexts is not None:
+            iphase = history.sampler_contexts[-1, 0]
+            if 0 <= iphase < len(self.sampler_phases):
+                phase = self.sampler_phases[iphase]
 
         bs_mean = colum_array(chains.mean_model(ichain=None))
         bs_std = colum_array(
@@ -762,12 +1476,48 @@ class HighScoreOptimiserConfig(OptimiserConfig):
         help="Number of bootstrap realisations to be tracked simultaneously in"
         " the optimisation.",
     )
+    history_flush_nmodels = Int.T(
+        default=100,
+        help="Write buffered models to the rundir after this many models.",
+    )
+    history_flush_interval = Float.T(
+        default=1.0,
+        help="Write buffered models to the rundir at least this often [s].",
+    )
+    history_fsync = FsyncPolicyChoice.T(
+        default="never",
+        help="When to sync the rundir data files to disk: ``'never'``, on "
+        "every ``'flush'`` or on ``'close'``.",
+    )
+    checkpoint_interval = Float.T(
+        default=60.0,
+        help="Save a checkpoint to the rundir at most this often [s], allowing "
+        "to resume an interrupted run with ``grond go --resume``. Set to 0 "
+        "to disable checkpoints.",
+    )
+    convergence_criterion = ConvergenceCriterion.T(
+        optional=True,
+        help="If set, end directed sampler phases early, once the chains have "
+        "converged.",
+    )
+    fast_bootstrap_misfits = Bool.T(
+        default=False,
+        help="Combine bootstrap misfits with matrix products when using the "
+        "L2 norm. Faster for many targets, but the misfits differ from the "
+        "default reduction by rounding, so runs are not bit-identical.",
+    )
 
     def get_optimiser(self):
         return HighScoreOptimiser(
             sampler_phases=list(self.sampler_phases),
             chain_length_factor=self.chain_length_factor,
             nbootstrap=self.nbootstrap,
+            history_flush_nmodels=self.history_flush_nmodels,
+            history_flush_interval=self.history_flush_interval,
+            history_fsync=self.history_fsync,
+            checkpoint_interval=self.checkpoint_interval,
+            convergence_criterion=self.convergence_criterion,
+            fast_bootstrap_misfits=self.fast_bootstrap_misfits,
         )
 
 
@@ -797,6 +1547,9 @@ __all__ = """
     UniformSamplerPhase
     DirectedSamplerPhase
     Chains
+    ConvergenceCriterion
+    EarlyTermination
     HighScoreOptimiserConfig
     HighScoreOptimiser
+    load_early_terminations
 """.split()
@@ -374,14 +374,25 @@ characteristics of the optimisation algorithm.
         axes.grid(alpha=.2)
         axes.yaxis.set_major_formatter(FuncFormatter(lambda v, p: '%d%%' % v))
 
+        iphases = None
+        if history.sampler_contexts is not None \
+                and num.all(history.sampler_contexts[:, 0] >= 0):
+            # phases may have been ended early
+            iphases = history.sampler_contexts[:, 0]
+
         iiter = 0
         bgcolors = [mpl_color('aluminium1'), mpl_color('aluminium2')]
         for iphase, phase in enumerate(optimiser.sampler_phases):
+            if iphases is not None:
+                niterations = int(num.sum(iphases == iphase))
+            else:
+                niterations = phase.niterations
+
             axes.axvspan(
-                iiter, iiter+phase.niterations,
+                iiter, iiter+niterations,
                 color=bgcolors[iphase % len(bgcolors)])
 
-            iiter += phase.niterations
+            iiter += niterations
 
         yield (
             PlotItem(
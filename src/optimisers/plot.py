@@ -101,6 +101,10 @@ corresponding misfit values.
         gms_softclip = gms_softclip[isort]
         models = models[isort, :]
 
+        target_dependants = history.target_dependants
+        if target_dependants is not None:
+            target_dependants = target_dependants[isort, :]
+
         iorder = num.empty_like(isort)
         iorder = num.arange(iorder.size)
 
@@ -199,7 +203,7 @@ corresponding misfit values.
 
                 item_fig = (item, fig)
 
-            par = problem.dependants[idep]
+            par = problem.combined[npar + idep]
             item_fig[0].attributes['parameters'].append(par.name)
 
             axes = fig.add_subplot(nfy, nfx, impl)
@@ -213,13 +217,17 @@ corresponding misfit values.
             axes.set_ylim(*fixlim(*par.scaled(bounds[npar + idep])))
             axes.set_xlim(0, history.nmodels)
 
-            ys = problem.make_dependant(models[ibest, :], par.name)
+            ys = problem.extract(
+                models[ibest, :], npar + idep,
+                target_dependants=(
+                    target_dependants[ibest, :]
+                    if target_dependants is not None else None))
             axes.scatter(
                 imodels[ibest], par.scaled(ys), s=msize, c=iorder[ibest],
                 edgecolors='none', cmap=cmap, alpha=alpha, rasterized=True)
 
             if self.show_reference:
-                y = problem.make_dependant(xref, par.name)
+                y = problem.extract(xref, npar + idep)
                 axes.axhline(par.scaled(y), color='black', alpha=0.3)
 
         impl = (npar + ndep) % (nfx * nfy) + 1
@@ -14,7 +14,7 @@ import os
 import time
 
 from pyrocko import gf, util, guts
-from pyrocko.guts import Object, String, List, Dict, Int
+from pyrocko.guts import Object, String, List, Dict, Int, StringChoice
 
 from grond.meta import (
     ADict,
@@ -29,10 +29,12 @@ from ..targets import (
     MisfitResult,
     MisfitTarget,
     TargetGroup,
+    TravelTimes,
     WaveformMisfitTarget,
     SatelliteMisfitTarget,
     GNSSCampaignMisfitTarget,
 )
+from ..targets.waveform.target import misfit_many
 
 from grond import stats
 
@@ -51,6 +53,360 @@ def nextpow2(i):
     return 2 ** int(math.ceil(math.log(i) / math.log(2.0)))
 
 
+def _event_number(name):
+    """
+    Get event number from a sub-source or target origin name.
+
+    Multi-event setups encode the event in the first digit after the first
+    underscore of the name (e.g. ``ev_1a``). Names not following this
+    convention are taken as their own event.
+    """
+    try:
+        return [int(c) for c in name.split("_")[1] if c.isdigit()][0]
+    except IndexError:
+        return name
+
+
+def _sum_statics(statics_list):
+    return dict((k, sum(s[k] for s in statics_list)) for k in statics_list[0])
+
+
+def _sum_subsource_statics(target, sources, components):
+    """
+    Sum static results of the sub-sources within the acquisition period of a
+    satellite target, for a batch of models at once.
+
+    :param target: satellite misfit target
+    :param sources: list of combined sources, one for each model
+    :param components: static results of the sub-sources, indexed as
+        ``components[imodel][isubsource]``
+    :returns: list with the summed statics for each model. Sub-sources for
+        which the modelling failed are left out of the sum. Only if all
+        sub-sources within the acquisition period failed, the first error is
+        returned for the model instead.
+    """
+    meta = target.scene.meta
+    times = num.array([[s.time for s in source.subsources] for source in sources])
+    overlaps = num.logical_and(meta.time_primary < times, times < meta.time_secondary)
+    errors = num.array(
+        [
+            [isinstance(result, gf.SeismosizerError) for result in results]
+            for results in components
+        ],
+        dtype=bool,
+    ).reshape(overlaps.shape)
+
+    contributing = num.logical_and(overlaps, ~errors)
+
+    summed = [None] * len(sources)
+    template = None
+    iok = []
+    for imodel, results in enumerate(components):
+        failed = num.flatnonzero(num.logical_and(overlaps[imodel], errors[imodel]))
+        if failed.size != 0 and not num.any(contributing[imodel]):
+            summed[imodel] = results[failed[0]]
+            continue
+
+        iok.append(imodel)
+        if template is None:
+            for result in results:
+                if not isinstance(result, gf.SeismosizerError):
+                    template = result.result
+                    break
+
+    if not iok:
+        return summed
+
+    if template is None:
+        for imodel in iok:
+            summed[imodel] = components[imodel][0]
+
+        return summed
+
+    contributing = contributing[iok]
+    sums = {}
+    for k, v in template.items():
+        stack = num.zeros((len(iok), contributing.shape[1]) + v.shape, dtype=v.dtype)
+        for i, imodel in enumerate(iok):
+            for isub in num.flatnonzero(contributing[i]):
+                stack[i, isub] = components[imodel][isub].result[k]
+
+        # sequential sum over the sub-sources, non-contributing ones add zero
+        sums[k] = num.sum(stack, axis=1)
+
+    for i, imodel in enumerate(iok):
+        summed[imodel] = dict((k, v[i]) for (k, v) in sums.items())
+
+    return summed
+
+
+def _cut_trace(tr, tmin_union, tmax_union, tmin, tmax, rate):
+    """
+    Cut trace modelled over a union time window to a sub-window.
+
+    Sample indices are rounded exactly as the engine does when it sets up the
+    modelling window of a target.
+    """
+    if None in (tmin, tmax) or (tmin, tmax) == (tmin_union, tmax_union):
+        return tr
+
+    i0 = int(math.floor(tmin * rate)) - int(math.floor(tmin_union * rate))
+    i1 = tr.data.size - (
+        int(math.ceil(tmax_union * rate)) - int(math.ceil(tmax * rate))
+    )
+
+    return gf.SeismosizerTrace(
+        codes=tr.codes,
+        data=tr.data[i0:i1],
+        deltat=tr.deltat,
+        tmin=tr.tmin + i0 * tr.deltat,
+    )
+
+
+class EvaluationPlan(object):
+    """
+    Static structure of the forward modelling of a problem.
+
+    Holds which modelling targets belong to which misfit target, which of
+    them are unique, from which source roles they are synthesised and where
+    their results go. This only depends on the targets, the target mask and
+    the layout of the source. It is therefore compiled once by
+    :py:meth:`Problem.get_evaluation_plan` and reused as long as the targets
+    hand out the same modelling targets. Only the time windows of the
+    modelling targets change from model to model.
+
+    :param problem: :py:class:`Problem` instance
+    :param targets: misfit targets to be modelled
+    :param mask: boolean mask of targets to be modelled, or ``None``
+    :param t2m: list with the modelling targets of each misfit target, as
+        returned by their ``prepare_modelling`` methods
+    :param source: source of a representative model
+    """
+
+    def __init__(self, problem, targets, mask, t2m, source):
+        self.key = self.make_key(targets, mask, t2m, source)
+
+        # keep references, so that the ids in the key stay valid
+        self.targets = targets
+        self.t2m = t2m
+
+        self.wtargets = [t for t in targets if isinstance(t, WaveformMisfitTarget)]
+
+        self.target_slices = []
+        modelling_targets = []
+        positions = []
+        for itarget, mtargets in enumerate(t2m):
+            if mask is None or mask[itarget]:
+                imt = len(modelling_targets)
+                self.target_slices.append(slice(imt, imt + len(mtargets)))
+                modelling_targets.extend(mtargets)
+                positions.extend((itarget, k) for k in range(len(mtargets)))
+            else:
+                self.target_slices.append(None)
+
+        u2m_map = {}
+        for imtarget, mtarget in enumerate(modelling_targets):
+            if mtarget not in u2m_map:
+                u2m_map[mtarget] = []
+
+            u2m_map[mtarget].append(imtarget)
+
+        self.umtargets = list(u2m_map.keys())
+        self.upositions = [positions[u2m_map[mt][0]] for mt in self.umtargets]
+
+        self.iu_of_slot = [None] * len(modelling_targets)
+        for iu, mtarget in enumerate(self.umtargets):
+            for imtarget in u2m_map[mtarget]:
+                self.iu_of_slot[imtarget] = iu
+
+        self.event_subsources = {}
+        if isinstance(source, gf.CombiSource):
+            nsubsources = len(source.subsources)
+            for isub, subsource in enumerate(source.subsources):
+                self.event_subsources.setdefault(
+                    _event_number(subsource.name), []
+                ).append(isub)
+        else:
+            nsubsources = None
+
+        self.uroles = [
+            problem._get_modelling_roles(mt, nsubsources) for mt in self.umtargets
+        ]
+
+        role_to_u = {}
+        for iu, roles in enumerate(self.uroles):
+            for role in roles:
+                role_to_u.setdefault(role, []).append(iu)
+
+        # roles sharing the same modelling targets go into a single engine
+        # request (the engine models all sources for all targets of a request)
+        groups = {}
+        for role, ius in role_to_u.items():
+            groups.setdefault(tuple(ius), []).append(role)
+
+        self.role_groups = [(roles, list(ius)) for (ius, roles) in groups.items()]
+
+        self.proxies = [problem._get_modelling_proxy(mt) for mt in self.umtargets]
+        self.is_misfit = [isinstance(mt, MisfitTarget) for mt in self.umtargets]
+        self.is_static = [isinstance(pr, gf.StaticTarget) for pr in self.proxies]
+        self.is_subsource_sum = [
+            self.is_misfit[iu] and self.is_static[iu] and roles[0][0] == "sub"
+            for (iu, roles) in enumerate(self.uroles)
+        ]
+
+    @staticmethod
+    def make_key(targets, mask, t2m, source):
+        key = (
+            tuple(id(target) for target in targets),
+            None if mask is None else num.asarray(mask, dtype=bool).tobytes(),
+            tuple(id(mt) for mtargets in t2m for mt in mtargets),
+            tuple(len(mtargets) for mtargets in t2m),
+        )
+
+        if isinstance(source, gf.CombiSource):
+            key += (tuple(s.name for s in source.subsources),)
+
+        return key
+
+    @property
+    def nunique(self):
+        return len(self.umtargets)
+
+    def get_role_source(self, source, role):
+        kind, value = role
+        if kind == "sub":
+            return source.subsources[value]
+
+        elif kind == "event":
+            return gf.CombiSource(
+                name=str(value),
+                subsources=[
+                    source.subsources[isub]
+                    for isub in self.event_subsources.get(value, [])
+                ],
+            )
+
+        return source
+
+    def get_modelling_results(self, itarget, results_unique):
+        """Get results for the modelling targets of a misfit target."""
+        return [
+            results_unique[iu] for iu in self.iu_of_slot[self.target_slices[itarget]]
+        ]
+
+
+class SubsourceParameterMap(object):
+    """
+    Index map from parameter vectors to the attributes of sub-sources.
+
+    Parameters of multi-source problems are named
+    ``<subsource name>.<parameter>``. The map is compiled once from these
+    names, so that the sub-source attributes of whole batches of models can
+    be taken from array slices. Attributes given relative to the base
+    sub-source are converted in a vectorised way.
+
+    :param base_source: :py:class:`pyrocko.gf.CombiSource` with the base
+        sub-sources
+    :param parameters: list of :py:class:`~grond.meta.Parameter` objects of
+        the problem
+    :param get_range: callable returning the :py:class:`pyrocko.gf.Range`
+        for a sub-source name and attribute
+    """
+
+    def __init__(self, base_source, parameters, get_range):
+        iparameters = dict((p.name, ip) for (ip, p) in enumerate(parameters))
+
+        self._subsources = list(base_source.subsources)
+        self._indices = []
+        self._attributes = []
+        for source in base_source.subsources:
+            prefix = source.name + "."
+            indices = dict(
+                (name[len(prefix) :], ip)
+                for (name, ip) in iparameters.items()
+                if name.startswith(prefix)
+            )
+
+            keys = [k for k in source.keys() if k in indices]
+            relative = num.array(
+                [get_range(source.name, k).relative for k in keys], dtype=object
+            )
+            self._indices.append(indices)
+            self._attributes.append(
+                (
+                    keys,
+                    num.array([indices[k] for k in keys], dtype=int),
+                    num.array([source[k] for k in keys], dtype=num.float64),
+                    relative == "add",
+                    relative == "mult",
+                )
+            )
+
+    @property
+    def nsubsources(self):
+        return len(self._indices)
+
+    def index(self, isub, name):
+        """Get index of a sub-source's parameter in the parameter vector."""
+        return self._indices[isub][name]
+
+    def indices(self, isub, names):
+        """Get indices of a sub-source's parameters in the parameter vector."""
+        return num.array([self._indices[isub][name] for name in names], dtype=int)
+
+    def get_attributes(self, xs, isub):
+        """
+        Get attributes of a sub-source for a batch of models.
+
+        :param xs: 2D array of models, indexed as ``xs[imodel, iparameter]``
+        :returns: ``(keys, values)``, names of the attributes of the
+            sub-source, which are given by parameters, and 2D array with
+            their absolute values, indexed as ``values[imodel, ikey]``
+        """
+        keys, iparameters, bases, add, mult = self._attributes[isub]
+        values = xs[:, iparameters]
+        values[:, add] += bases[add]
+        values[:, mult] *= bases[mult]
+        return keys, values
+
+    def pack_attributes(self, isub, source):
+        """
+        Get parameter values from the attributes of a sub-source.
+
+        Inverse of :py:meth:`get_attributes`: attributes with relative ranges
+        are given relative to the base sub-source.
+
+        :returns: dict with the parameter values by attribute name
+        """
+        keys, _, bases, add, mult = self._attributes[isub]
+        values = num.array([source[k] for k in keys], dtype=num.float64)
+        values[add] -= bases[add]
+        values[mult] /= bases[mult]
+        return dict(zip(keys, values.tolist()))
+
+    def clone_subsources(self, isub, updates):
+        """
+        Clone a base sub-source once for each dict of updated attributes.
+
+        Like :py:meth:`pyrocko.gf.Source.clone`, but the attributes of the
+        base sub-source are only collected once for the whole batch.
+        """
+        source = self._subsources[isub]
+        template = dict(source)
+        objects = [k for (k, v) in template.items() if isinstance(v, Object)]
+        clones = []
+        for update in updates:
+            d = dict(template)
+            for k in objects:
+                if k not in update:
+                    d[k] = template[k].clone()
+
+            d.update(update)
+            clones.append(source.__class__(**d))
+
+        return clones
+
+
 class ProblemConfig(Object):
     """
     Base class for config section defining the objective function setup.
@@ -101,6 +457,8 @@ class Problem(Object):
         self._target_weights = None
         self._engine = None
         self._family_mask = None
+        self._misfit_combiner = None
+        self._evaluation_plan = None
 
         if hasattr(self, "problem_waveform_parameters") and self.has_waveforms:
             self.problem_parameters = (
@@ -131,8 +489,14 @@ class Problem(Object):
     def copy(self):
         o = copy.copy(self)
         o._target_weights = None
+        o._misfit_combiner = None
+        o._evaluation_plan = None
         return o
 
+    def get_sources(self, xs):
+        """Get sources for a batch of models."""
+        return [self.get_source(x) for x in xs]
+
     def set_target_parameter_values(self, x):
         nprob = len(self.problem_parameters)
         for target in self.targets:
@@ -159,7 +523,13 @@ class Problem(Object):
         guts.dump(self, filename=fn)
 
     def dump_problem_data(
-        self, dirname, x, misfits, bootstraps=None, sampler_context=None
+        self,
+        dirname,
+        x,
+        misfits,
+        bootstraps=None,
+        sampler_context=None,
+        target_dependants=None,
     ):
         fn = op.join(dirname, "models")
         if not isinstance(x, num.ndarray):
@@ -181,6 +551,11 @@ class Problem(Object):
             with open(fn, "ab") as f:
                 num.array(sampler_context, dtype="<i8").tofile(f)
 
+        if target_dependants is not None:
+            fn = op.join(dirname, "target_dependants")
+            with open(fn, "ab") as f:
+                num.array(target_dependants, dtype="<f8").tofile(f)
+
     def name_to_index(self, name):
         pnames = [p.name for p in self.combined]
         return pnames.index(name)
@@ -192,6 +567,13 @@ class Problem(Object):
             target_parameters.extend(target.target_parameters)
         return self.problem_parameters + target_parameters
 
+    @property
+    def target_dependants(self):
+        target_dependants = []
+        for target in self.targets:
+            target_dependants.extend(target.target_dependants)
+        return target_dependants
+
     @property
     def parameter_names(self):
         return [p.name for p in self.combined]
@@ -229,15 +611,15 @@ class Problem(Object):
 
     @property
     def ndependants(self):
-        return len(self.dependants)
+        return len(self.dependants) + len(self.target_dependants)
 
     @property
     def ncombined(self):
-        return len(self.parameters) + len(self.dependants)
+        return len(self.parameters) + self.ndependants
 
     @property
     def combined(self):
-        return self.parameters + self.dependants
+        return self.parameters + self.dependants + self.target_dependants
 
     @property
     def satellite_targets(self):
@@ -265,6 +647,9 @@ class Problem(Object):
 
     def set_engine(self, engine):
         self._engine = engine
+        travel_times = TravelTimes(engine, self.targets)
+        for target in self.targets:
+            target.set_travel_times(travel_times)
 
     def get_engine(self):
         return self._engine
@@ -283,14 +668,83 @@ class Problem(Object):
     def preconstrain(self, x):
         return x
 
-    def extract(self, xs, i):
+    def extract(self, xs, i, target_dependants=None):
+        """
+        Get values of a parameter or dependant for a batch of models.
+
+        :param xs: models, indexed as ``xs[imodel, iparameter]``
+        :param i: index into :py:attr:`combined`
+        :param target_dependants: stored values of the target dependants of
+            the models, see :py:meth:`make_target_dependant`
+        """
         if xs.ndim == 1:
-            return self.extract(xs[num.newaxis, :], i)[0]
+            if target_dependants is not None:
+                target_dependants = target_dependants[num.newaxis, :]
+
+            return self.extract(xs[num.newaxis, :], i, target_dependants)[0]
 
         if i < self.nparameters:
             return xs[:, i]
+
+        idep = i - self.nparameters
+        if idep < len(self.dependants):
+            return self.make_dependant(xs, self.dependants[idep].name)
         else:
-            return self.make_dependant(xs, self.dependants[i - self.nparameters].name)
+            return self.make_target_dependant(
+                xs,
+                self.target_dependants[idep - len(self.dependants)].name,
+                target_dependants,
+            )
+
+    def make_target_dependant(self, xs, pname, target_dependants=None):
+        """
+        Get values of a target dependant for a batch of models.
+
+        Target dependants are nuisance parameters, which the targets solve
+        for when post-processing the forward modelling results. Their values
+        are stored in the rundir along with the models and are not recomputed
+        here. They must be given as *target_dependants*, the rows of
+        :py:attr:`ModelHistory.target_dependants` matching the models *xs*,
+        e.g. ``history.target_dependants[imodels]`` for
+        ``history.models[imodels]``. NaN is returned for models without
+        stored values.
+        """
+        if xs.ndim == 1:
+            if target_dependants is not None:
+                target_dependants = target_dependants[num.newaxis, :]
+
+            return self.make_target_dependant(
+                xs[num.newaxis, :], pname, target_dependants
+            )[0]
+
+        if target_dependants is None:
+            return num.full(xs.shape[0], num.nan)
+
+        idep = [p.name for p in self.target_dependants].index(pname)
+        return num.array(target_dependants[:, idep], dtype=num.float64)
+
+    def get_target_dependants(self, results_many):
+        """
+        Get values of the target dependants from misfit results.
+
+        Values are read from the equally named attributes of the results.
+
+        :param results_many: list with the list of target results for each
+            model, as returned by :py:meth:`evaluate_many`
+        :returns: 2D array indexed as ``values[imodel, itarget_dependant]``
+        """
+        values = num.full((len(results_many), len(self.target_dependants)), num.nan)
+        for imodel, results in enumerate(results_many):
+            idep = 0
+            for target, result in zip(self.targets, results):
+                for p in target.target_dependants:
+                    value = getattr(result, p.name_nogroups, None)
+                    if value is not None:
+                        values[imodel, idep] = value
+
+                    idep += 1
+
+        return values
 
     def get_target_weights(self):
         if self._target_weights is None:
@@ -364,8 +818,23 @@ class Problem(Object):
     def get_dependant_bounds(self):
         return num.zeros((0, 2))
 
+    def get_target_dependant_bounds(self):
+        out = []
+        for target in self.targets:
+            for p in target.target_dependants:
+                r = target.target_ranges[p.name_nogroups]
+                out.append((r.start, r.stop))
+
+        return num.array(out, dtype=num.float64).reshape((-1, 2))
+
     def get_combined_bounds(self):
-        return num.vstack((self.get_parameter_bounds(), self.get_dependant_bounds()))
+        return num.vstack(
+            (
+                self.get_parameter_bounds(),
+                self.get_dependant_bounds(),
+                self.get_target_dependant_bounds(),
+            )
+        )
 
     def raise_invalid_norm_exponent(self):
         raise GrondError("Invalid norm exponent: %f" % self.norm_exponent)
@@ -389,7 +858,12 @@ class Problem(Object):
             self.raise_invalid_norm_exponent()
 
     def combine_misfits(
-        self, misfits, extra_weights=None, extra_residuals=None, get_contributions=False
+        self,
+        misfits,
+        extra_weights=None,
+        extra_residuals=None,
+        get_contributions=False,
+        exact=True,
     ):
         """
         Combine misfit contributions (residuals) to global or bootstrap misfits
@@ -413,6 +887,10 @@ class Problem(Object):
         :param get_contributions: get the weighted and perturbed contributions
             (don't do the sum).
 
+        :param exact: if ``False``, bootstrap misfits with
+            ``norm_exponent == 2`` are reduced with matrix products, which is
+            faster but not bit-identical to the elementwise reduction.
+
         :returns: if no *extra_weights* or *extra_residuals* are given, a 1D
             array indexed as ``misfits[imodel]`` containing the global misfit
             for each model is returned, otherwise a 2D array
@@ -420,66 +898,21 @@ class Problem(Object):
             weighting/residual set is returned.
         """
 
-        exp, root = self.get_norm_functions()
-
-        if misfits.ndim == 2:
-            misfits = misfits[num.newaxis, :, :]
-            return self.combine_misfits(
-                misfits, extra_weights, extra_residuals, get_contributions
-            )[0, ...]
-
-        assert misfits.ndim == 3
-        assert extra_weights is None or extra_weights.ndim == 2
-        assert extra_residuals is None or extra_residuals.ndim == 2
-
-        if extra_weights is not None or extra_residuals is not None:
-            if extra_weights is not None:
-                w = (
-                    extra_weights[num.newaxis, :, :]
-                    * self.get_target_weights()[num.newaxis, num.newaxis, :]
-                    * self.inter_family_weights2(misfits[:, :, 1])[:, num.newaxis, :]
-                )
-            else:
-                w = 1.0
-
-            if extra_residuals is not None:
-                r = extra_residuals[num.newaxis, :, :]
-            else:
-                r = 0.0
-
-            if get_contributions:
-                return (
-                    exp(w * (misfits[:, num.newaxis, :, 0] + r))
-                    / num.nansum(exp(w * misfits[:, num.newaxis, :, 1]), axis=2)[
-                        :, :, num.newaxis
-                    ]
-                )
-
-            res = root(
-                num.nansum(exp(w * (misfits[:, num.newaxis, :, 0] + r)), axis=2)
-                / num.nansum(exp(w * (misfits[:, num.newaxis, :, 1])), axis=2)
-            )
-            assert res[res < 0].size == 0
-            return res
-        else:
-            w = self.get_target_weights()[num.newaxis, :] * self.inter_family_weights2(
-                misfits[:, :, 1]
-            )
-
-            r = self.get_target_weights()[num.newaxis, :] * self.inter_family_weights2(
-                misfits[:, :, 1]
-            )
+        return self.get_misfit_combiner().combine(
+            misfits, extra_weights, extra_residuals, get_contributions, exact
+        )
 
-            if get_contributions:
-                return (
-                    exp(w * misfits[:, :, 0])
-                    / num.nansum(exp(w * misfits[:, :, 1]), axis=1)[:, num.newaxis]
-                )
+    def get_misfit_combiner(self):
+        """
+        Get cached :py:class:`MisfitCombiner` for this problem.
+        """
+        if (
+            self._misfit_combiner is None
+            or self._misfit_combiner.target_weights is not self.get_target_weights()
+        ):
+            self._misfit_combiner = MisfitCombiner(self)
 
-            return root(
-                num.nansum(exp(w * misfits[:, :, 0]), axis=1)
-                / num.nansum(exp(w * misfits[:, :, 1]), axis=1)
-            )
+        return self._misfit_combiner
 
     def make_family_mask(self):
         family_names = set()
@@ -513,60 +946,118 @@ class Problem(Object):
         for target in targets:
             target.set_result_mode(result_mode)
 
-        modelling_targets = []
-        t2m_map = {}
-        for itarget, target in enumerate(targets):
-            t2m_map[target] = target.prepare_modelling(engine, source, targets)
-            if mask is None or mask[itarget]:
-                modelling_targets.extend(t2m_map[target])
+        t2m = [target.prepare_modelling(engine, source, targets) for target in targets]
+        plan = self.get_evaluation_plan(targets, mask, t2m, source)
 
-        u2m_map = {}
-        for imtarget, mtarget in enumerate(modelling_targets):
-            if mtarget not in u2m_map:
-                u2m_map[mtarget] = []
-
-            u2m_map[mtarget].append(imtarget)
-
-        modelling_targets_unique = list(u2m_map.keys())
-
-        resp = engine.process(source, modelling_targets_unique, nthreads=self.nthreads)
+        resp = engine.process(source, plan.umtargets, nthreads=self.nthreads)
         modelling_results_unique = list(resp.results_list[0])
 
-        # logger.warning("PARTS_0")
-        # logger.warning(resp.results_list[0][0].misfits[:2])
-        # logger.warning(resp.results_list[0][1].misfits[:2])
-
-        modelling_results = [None] * len(modelling_targets)
-
-        for mtarget, mresult in zip(modelling_targets_unique, modelling_results_unique):
-            for itarget in u2m_map[mtarget]:
-                modelling_results[itarget] = mresult
-
-        imt = 0
         results = []
         for itarget, target in enumerate(targets):
-            nmt_this = len(t2m_map[target])
-            if mask is None or mask[itarget]:
+            if plan.target_slices[itarget] is not None:
                 result = target.finalize_modelling(
                     engine,
                     source,
-                    t2m_map[target],
-                    modelling_results[imt : imt + nmt_this],
+                    t2m[itarget],
+                    plan.get_modelling_results(itarget, modelling_results_unique),
                 )
-
-                imt += nmt_this
             else:
                 result = gf.SeismosizerError("target was excluded from modelling")
 
             results.append(result)
         return results
 
+    def get_evaluation_plan(self, targets, mask, t2m, source):
+        """
+        Get compiled :py:class:`EvaluationPlan` for the given modelling setup.
+
+        The plan is cached and only recompiled when the targets, the mask or
+        the modelling targets handed out by the targets change.
+        """
+        plan = self._evaluation_plan
+        if plan is None or plan.key != EvaluationPlan.make_key(
+            targets, mask, t2m, source
+        ):
+            plan = self._evaluation_plan = EvaluationPlan(
+                self, targets, mask, t2m, source
+            )
+
+        return plan
+
+    def _process(self, engine, sources, targets):
+        """
+        Forward model a batch of sources at plain modelling targets.
+
+        :returns: results, indexed as ``results[isource][itarget]``
+        """
+        return engine.process(sources, targets, nthreads=self.nthreads).results_list
+
+    def _get_modelling_proxy(self, mtarget):
+        """
+        Get plain :py:mod:`pyrocko.gf` stand-in for a modelling target.
+
+        Misfit targets are handed to the engine as plain targets of their
+        modelling base class, so that the raw traces and statics of a whole
+        batch of sources can be post-processed model by model afterwards.
+        Proxies are held by the :py:class:`EvaluationPlan`, so that they are
+        released together with the plan.
+        """
+        if not isinstance(mtarget, MisfitTarget):
+            return mtarget
+
+        if isinstance(mtarget, gf.SatelliteTarget):
+            cls = gf.SatelliteTarget
+        elif isinstance(mtarget, gf.StaticTarget):
+            cls = gf.StaticTarget
+        else:
+            cls = gf.Target
+
+        d = dict((k, getattr(mtarget, k)) for k in cls.T.propnames)
+        return cls(**d)
+
+    def _get_modelling_roles(self, mtarget, nsubsources):
+        """
+        Get the source roles from which a modelling target is synthesised.
+
+        Satellite targets see the sum of all sub-sources (those outside of
+        the scene's acquisition period are masked later), waveform targets
+        see the sub-sources of their own event and everything else sees the
+        complete source.
+        """
+        if nsubsources is None:
+            return [("all", None)]
+
+        if isinstance(mtarget, SatelliteMisfitTarget):
+            return [("sub", isub) for isub in range(nsubsources)]
+
+        if isinstance(mtarget, WaveformMisfitTarget) and mtarget.origin_name:
+            return [("event", _event_number(mtarget.origin_name))]
+
+        return [("all", None)]
+
     def evaluate(self, x, mask=None, result_mode="full", targets=None):
-        source = self.get_source(x)
-        # logger.warning(source)
-        engine = self.get_engine()
+        return self.evaluate_many(
+            [x], mask=mask, result_mode=result_mode, targets=targets
+        )[0]
 
-        self.set_target_parameter_values(x)
+    def evaluate_many(self, xs, mask=None, result_mode="sparse", targets=None):
+        """
+        Forward model and post-process a batch of models.
+
+        All sources of the batch are handed to the engine in one go per
+        source role, so that Green's function lookups and source
+        discretisations are shared between the models. Waveforms are
+        modelled over the union of the per-model time windows and cut to the
+        window of each individual model before post-processing. Misfits of
+        waveform targets with ``batch_misfits`` enabled are computed for the
+        whole batch at once, with
+        :py:func:`~grond.targets.waveform.target.misfit_many`.
+
+        :param xs: 2D array of models, indexed as ``xs[imodel, iparameter]``
+        :returns: list with the list of target results for each model
+        """
+        xs = num.asarray(xs)
+        engine = self.get_engine()
 
         if mask is not None and targets is not None:
             raise ValueError("Mask cannot be defined with targets set.")
@@ -575,216 +1066,203 @@ class Problem(Object):
         for target in targets:
             target.set_result_mode(result_mode)
 
-        modelling_targets = []
-        t2m_map = {}
-        for itarget, target in enumerate(targets):
-            t2m_map[target] = target.prepare_modelling(engine, source, targets)
-            if mask is None or mask[itarget]:
-                modelling_targets.extend(t2m_map[target])
+        plan = None
+        sources = []
+        t2ms = []
+        windows = []
+        piggybacks = []
+        for source in self.get_sources(xs):
+            t2m = [
+                target.prepare_modelling(engine, source, targets) for target in targets
+            ]
 
-        u2m_map = {}
-        for imtarget, mtarget in enumerate(modelling_targets):
-            if mtarget not in u2m_map:
-                u2m_map[mtarget] = []
+            if plan is None:
+                plan = self.get_evaluation_plan(targets, mask, t2m, source)
+            else:
+                assert [len(mts) for mts in t2m] == [len(mts) for mts in plan.t2m]
+
+            sources.append(source)
+            t2ms.append(t2m)
+
+            # time windows of the unique modelling targets, set by
+            # prepare_modelling for this model
+            windows.append(
+                [
+                    (
+                        getattr(t2m[itarget][k], "tmin", None),
+                        getattr(t2m[itarget][k], "tmax", None),
+                    )
+                    for (itarget, k) in plan.upositions
+                ]
+            )
+            piggybacks.append([t.pop_piggyback_subtargets() for t in plan.wtargets])
+
+        for iu, proxy in enumerate(plan.proxies):
+            tmins, tmaxs = zip(*(window[iu] for window in windows))
+            if None not in tmins and None not in tmaxs:
+                proxy.tmin = min(tmins)
+                proxy.tmax = max(tmaxs)
+
+        raw = [dict() for _ in sources]
+        for roles, ius in plan.role_groups:
+            role_sources = [
+                plan.get_role_source(source, role)
+                for source in sources
+                for role in roles
+            ]
 
-            u2m_map[mtarget].append(imtarget)
+            results_list = self._process(
+                engine, role_sources, [plan.proxies[iu] for iu in ius]
+            )
 
-        modelling_targets_unique = list(u2m_map.keys())
+            for isource, results in enumerate(results_list):
+                imodel, irole = divmod(isource, len(roles))
+                for iu, result in zip(ius, results):
+                    raw[imodel][iu, roles[irole]] = result
+
+        subsource_statics = {}
+        for iu in range(plan.nunique):
+            if plan.is_subsource_sum[iu]:
+                subsource_statics[iu] = _sum_subsource_statics(
+                    plan.umtargets[iu],
+                    sources,
+                    [[r[iu, role] for role in plan.uroles[iu]] for r in raw],
+                )
 
-        # logger.warning(modelling_targets_unique)
-        order = [type(x) for x in modelling_targets_unique]
+        modelling_results_many = []
+        batched = []
+        for imodel, (x, source) in enumerate(zip(xs, sources)):
+            self.set_target_parameter_values(x)
+            for target, subtargets in zip(plan.wtargets, piggybacks[imodel]):
+                target.set_piggyback_subtargets(subtargets)
+
+            t2m = t2ms[imodel]
+            modelling_results_unique = []
+            for iu, (itarget, k) in enumerate(plan.upositions):
+                mtarget = t2m[itarget][k]
+                proxy = plan.proxies[iu]
+                roles = plan.uroles[iu]
+
+                if plan.is_subsource_sum[iu]:
+                    components = [subsource_statics[iu][imodel]]
+                else:
+                    components = [raw[imodel][iu, role] for role in roles]
 
-        sat_list = [
-            x for x in modelling_targets_unique if isinstance(x, SatelliteMisfitTarget)
-        ]
-        wave_list = [
-            x for x in modelling_targets_unique if isinstance(x, WaveformMisfitTarget)
-        ]
-        gnss_list = [
-            x
-            for x in modelling_targets_unique
-            if isinstance(x, GNSSCampaignMisfitTarget)
-        ]
-        resp_sat = None
-        resp_temp = [None] * len(source.subsources)
-        for issource, ssource in enumerate(source.subsources):
-            resp_temp[issource] = engine.process(
-                ssource, sat_list, nthreads=self.nthreads
-            )
+                if not plan.is_misfit[iu]:
+                    mresult = components[0]
 
-        bsource = None
-        tmp_bool = [False] * len(sat_list)
-
-        for itar, tar in enumerate(sat_list):
-            combine = False
-            for issource, ssource in enumerate(source.subsources):
-                if issource == bsource:
-                    combine = True if tmp_bool[itar] else False
-                    continue
-                if (
-                    tar.scene.meta.time_primary
-                    < ssource.time
-                    < tar.scene.meta.time_secondary
-                ):
-                    if resp_sat is None:
-                        resp_sat = resp_temp[issource]
-                        for i, k in enumerate(sat_list):
-                            tmp = resp_sat.results_list[0].pop(0)
-                            if (
-                                k.scene.meta.time_primary
-                                < ssource.time
-                                < k.scene.meta.time_secondary
-                            ):
-                                resp_sat.results_list[0].append(tmp)
-                                tmp_bool[i] = True
-                        bsource = issource
-                        combine = True
-
-                    elif combine == False:
-                        resp_sat.results_list[0].append(
-                            resp_temp[issource].results_list[0][itar]
-                        )
+                elif any(isinstance(c, gf.SeismosizerError) for c in components):
+                    mresult = [
+                        c for c in components if isinstance(c, gf.SeismosizerError)
+                    ][0]
 
-                        combine = True
+                else:
+                    if plan.is_subsource_sum[iu]:
+                        mraw = components[0]
+                        role_source = source
+                    elif plan.is_static[iu]:
+                        mraw = _sum_statics([c.result for c in components])
+                        role_source = source
                     else:
-                        if result_mode == "full":
-                            for key, value in (
-                                resp_temp[issource]
-                                .results_list[0][itar]
-                                .statics_syn.items()
-                            ):
-                                resp_sat.results_list[0][itar].statics_syn[key] += value
-                        resp_sat.results_list[0][itar].misfits[:, 0] += (
-                            resp_temp[issource].results_list[0][itar].misfits[:, 0]
-                        )
-                        resp_sat.results_list[0][itar].misfits[:, 0] -= (
-                            resp_temp[issource].results_list[0][itar].misfits[:, 1]
+                        tmin, tmax = windows[imodel][iu]
+                        mraw = _cut_trace(
+                            components[0].trace,
+                            proxy.tmin,
+                            proxy.tmax,
+                            tmin,
+                            tmax,
+                            proxy.sample_rate
+                            or engine.get_store(proxy.store_id).config.sample_rate,
                         )
 
+                        role_source = plan.get_role_source(source, roles[0])
+
+                    try:
+                        if (
+                            isinstance(mtarget, WaveformMisfitTarget)
+                            and mtarget.can_batch_misfit()
+                        ):
+                            # misfit is computed below, together with all
+                            # others of the batch
+                            batched.append(
+                                (
+                                    imodel,
+                                    iu,
+                                    mtarget,
+                                    mtarget.prepare_misfit(engine, role_source, mraw),
+                                )
+                            )
+                            mresult = None
+                        else:
+                            mresult = mtarget.post_process(engine, role_source, mraw)
+
+                    except gf.SeismosizerError as e:
+                        mresult = e
+
+                modelling_results_unique.append(mresult)
+
+            modelling_results_many.append(modelling_results_unique)
+
+        if batched:
+            imodels, ius, mtargets, prepared = zip(*batched)
+            for imodel, iu, mresult in zip(
+                imodels, ius, misfit_many(mtargets, prepared)
+            ):
+                modelling_results_many[imodel][iu] = mresult
+
+        results_many = []
+        for imodel, (x, source) in enumerate(zip(xs, sources)):
+            self.set_target_parameter_values(x)
+            t2m = t2ms[imodel]
+            modelling_results_unique = modelling_results_many[imodel]
+
+            results = []
+            for itarget, target in enumerate(targets):
+                if plan.target_slices[itarget] is not None:
+                    result = target.finalize_modelling(
+                        engine,
+                        source,
+                        t2m[itarget],
+                        plan.get_modelling_results(itarget, modelling_results_unique),
+                    )
                 else:
-                    pass
+                    result = gf.SeismosizerError("target was excluded from modelling")
 
-        resp_wave = [None] * len(wave_list)
+                results.append(result)
 
-        tmp_s = {}
-        for isource, ssource in enumerate(source.subsources):
-            ev_num = [int(x) for x in ssource.name.split("_")[1] if x.isdigit()]
-            if ev_num[0] not in tmp_s.keys():
-                tmp_s[ev_num[0]] = [ssource]
-            else:
-                tmp_s[ev_num[0]].append(ssource)
-
-        w_list = {}
-        sources = [None] * len(tmp_s.keys())
-        res = [None] * len(tmp_s.keys())
-        order_s = [None] * len(wave_list)
-        for ik, k in enumerate(tmp_s.keys()):
-            sources[ik] = gf.CombiSource(name=str(k), subsources=tmp_s[k])
-            w_list[str(k)] = []
-            for it, t in enumerate(wave_list):
-                ev_num = [int(x) for x in t.origin_name.split("_")[1] if x.isdigit()]
-                order_s[it] = ev_num
-                if k == ev_num[0]:
-                    w_list[str(k)].append(t)
-            res[ik] = engine.process(
-                sources[ik], w_list[str(k)], nthreads=self.nthreads
-            )
+            results_many.append(results)
 
-        # res = sum(res, [])
-        lis = [None] * len(wave_list)
+        return results_many
 
-        for ik, k in enumerate(order_s):
-            if k[0] == 1:
-                lis[ik] = res[0].results_list[0].pop(0)
-            else:
-                lis[ik] = res[1].results_list[0].pop(0)
-
-        # resp_wave = res[0]
-        resp_wave = lis
-        # for itar, tar in enumerate(wave_list):
-        #     ev_num = [int(x) for x in tar.origin_name.split("_")[1] if x.isdigit()]
-        #     tmp_source = []
-        #     for isource, ssource in enumerate(source.subsources):
-        #         if str(ev_num[0]) in ssource.name.split("_")[1]:
-        #             tmp_source.append(ssource)
-        #             wave_source = gf.CombiSource(
-        #                 name=tar.origin_name, subsources=tmp_source
-        #             )
-
-        #     res_wave = engine.process(wave_source, tar, nthreads=self.nthreads)
-        #     resp_wave[itar] = res_wave.results_list[0]
-
-        # resp_wave = engine.process(source, wave_list, nthreads=self.nthreads)
-        resp_gnss = engine.process(source, gnss_list, nthreads=self.nthreads)
-
-        # logger.warning(resp_wave.results_list)
-        # logger.warning(resp_wave)
-
-        resp = []
-
-        for t in order:
-            if t == SatelliteMisfitTarget:
-                if resp_sat.results_list:
-                    resp.append(resp_sat.results_list[0].pop(0))
-            elif t == WaveformMisfitTarget:
-                if resp_wave:
-                    resp.append(resp_wave.pop(0))
-            elif t == GNSSCampaignMisfitTarget:
-                if resp_gnss.results_list:
-                    resp.append(resp_gnss.results_list[0].pop(0))
-
-        # resp = engine.process(source, modelling_targets_unique, nthreads=self.nthreads)
-        # logger.warning(type(resp))
-
-        # modelling_results_unique = list(resp.results_list[0])
-        modelling_results_unique = resp
-        # logger.warning(num.shape(modelling_targets_unique))
-        # logger.warning(num.shape(modelling_results_unique))
-        # logger.warning(modelling_results_unique)
-        modelling_results = [None] * len(modelling_targets)
-
-        for mtarget, mresult in zip(modelling_targets_unique, modelling_results_unique):
-            for itarget in u2m_map[mtarget]:
-                modelling_results[itarget] = mresult
-
-        imt = 0
-        results = []
-        for itarget, target in enumerate(targets):
-            nmt_this = len(t2m_map[target])
-            if mask is None or mask[itarget]:
-                result = target.finalize_modelling(
-                    engine,
-                    source,
-                    t2m_map[target],
-                    modelling_results[imt : imt + nmt_this],
-                )
+    def misfits(self, x, mask=None):
+        return self.misfits_many([x], mask=mask)[0]
 
-                imt += nmt_this
-            else:
-                result = gf.SeismosizerError("target was excluded from modelling")
+    def misfits_many(self, xs, mask=None, want_target_dependants=False):
+        """
+        Get misfit and normalisation contributions for a batch of models.
+
+        :param xs: 2D array of models, indexed as ``xs[imodel, iparameter]``
+        :param want_target_dependants: if ``True``, also return the values
+            of the target dependants, see :py:meth:`get_target_dependants`
+        :returns: 3D array indexed as ``misfits[imodel, imisfit, 0|1]``, see
+            :py:meth:`combine_misfits`, or tuple ``(misfits,
+            target_dependants)``
+        """
+        results_many = self.evaluate_many(xs, mask=mask, result_mode="sparse")
+        misfits = num.full((len(results_many), self.nmisfits, 2), num.nan)
 
-            results.append(result)
+        for imodel, results in enumerate(results_many):
+            imisfit = 0
+            for target, result in zip(self.targets, results):
+                if isinstance(result, MisfitResult):
+                    misfits[imodel, imisfit : imisfit + target.nmisfits, :] = (
+                        result.misfits
+                    )
 
-        return results
+                imisfit += target.nmisfits
 
-    def misfits(self, x, mask=None):
-        results = self.evaluate(x, mask=mask, result_mode="sparse")
-        # logger.warning("MISFIT 1")
-        # logger.warning(results[0].misfits[:2])
-        # logger.warning(results[1].misfits[:2])
-        # results2 = self.evaluate2(x, mask=mask, result_mode="sparse")
-        # logger.warning("MISFIT 2")
-        # logger.warning(results2[0].misfits[:2])
-        # logger.warning(results[1].misfits[100:250] - results2[1].misfits[100:250])
-        # logger.warning(results2[1].misfits[:2])
-        misfits = num.full((self.nmisfits, 2), num.nan)
-
-        imisfit = 0
-        for target, result in zip(self.targets, results):
-            if isinstance(result, MisfitResult):
-                misfits[imisfit : imisfit + target.nmisfits, :] = result.misfits
-
-            imisfit += target.nmisfits
+        if want_target_dependants:
+            return misfits, self.get_target_dependants(results_many)
 
         return misfits
 
@@ -824,6 +1302,219 @@ class Problem(Object):
         )
 
 
+class MisfitCombiner(object):
+    """
+    Engine combining misfit contributions to global and bootstrap misfits.
+
+    The target weights and normalisation family masks of the problem are
+    computed once and reused for every call. Bootstrap misfits are reduced in
+    blocks of models and bootstrap chains, so that the full ``(nmodels,
+    nbootstrap, nmisfits)`` temporary is never allocated. The blocked
+    reduction gives the same results, bit by bit, as reducing everything at
+    once.
+
+    With ``exact=False`` and ``norm_exponent == 2``, the weighted squared
+    residuals are instead summed with matrix products. This is much faster
+    for problems with many misfits but differs from the elementwise
+    reduction by floating point rounding.
+    """
+
+    nelements_block = 2**21
+
+    def __init__(self, problem):
+        self.norm_exponent = problem.norm_exponent
+        self.exp, self.root = problem.get_norm_functions()
+        self.target_weights = problem.get_target_weights()
+
+        family, nfamilies = problem.get_family_mask()
+        self.family_masks = [family == ifamily for ifamily in range(nfamilies)]
+
+        self._extra_weights = None
+        self._weights_b = None
+        self._extra_residuals = None
+        self._residual_terms = None
+
+    def inter_family_weights(self, ns):
+        """
+        :param ns: 2D array with normalization factors ``ns[imodel, itarget]``
+        :returns: 2D array ``weights[imodel, itarget]``
+        """
+        exp, root = self.exp, self.root
+        ws = num.zeros(ns.shape)
+        for mask in self.family_masks:
+            ws[:, mask] = (1.0 / root(num.nansum(exp(ns[:, mask]), axis=1)))[
+                :, num.newaxis
+            ]
+
+        return ws
+
+    def get_bootstrap_target_weights(self, extra_weights):
+        """
+        Get product of bootstrap weights and target weights.
+
+        The product is cached for the most recently used *extra_weights*
+        array, which is not expected to be modified in place.
+        """
+        if extra_weights is not self._extra_weights:
+            self._weights_b = (
+                extra_weights[num.newaxis, :, :]
+                * self.target_weights[num.newaxis, num.newaxis, :]
+            )
+            self._extra_weights = extra_weights
+            self._extra_residuals = None
+
+        return self._weights_b
+
+    def combine(
+        self,
+        misfits,
+        extra_weights=None,
+        extra_residuals=None,
+        get_contributions=False,
+        exact=True,
+    ):
+        """
+        Combine misfit contributions, see :py:meth:`Problem.combine_misfits`.
+        """
+        if misfits.ndim == 2:
+            return self.combine(
+                misfits[num.newaxis, :, :],
+                extra_weights,
+                extra_residuals,
+                get_contributions,
+                exact,
+            )[0, ...]
+
+        assert misfits.ndim == 3
+        assert extra_weights is None or extra_weights.ndim == 2
+        assert extra_residuals is None or extra_residuals.ndim == 2
+
+        if extra_weights is None and extra_residuals is None:
+            return self._combine_global(misfits, get_contributions)
+
+        if (
+            not exact
+            and not get_contributions
+            and self.norm_exponent == 2
+            and extra_weights is not None
+        ):
+            res = self._combine_bootstrap_l2(misfits, extra_weights, extra_residuals)
+        else:
+            res = self._combine_bootstrap(
+                misfits, extra_weights, extra_residuals, get_contributions
+            )
+
+        if not get_contributions:
+            assert res[res < 0].size == 0
+
+        return res
+
+    def _combine_global(self, misfits, get_contributions):
+        exp, root = self.exp, self.root
+        w = self.target_weights[num.newaxis, :] * self.inter_family_weights(
+            misfits[:, :, 1]
+        )
+
+        if get_contributions:
+            return (
+                exp(w * misfits[:, :, 0])
+                / num.nansum(exp(w * misfits[:, :, 1]), axis=1)[:, num.newaxis]
+            )
+
+        return root(
+            num.nansum(exp(w * misfits[:, :, 0]), axis=1)
+            / num.nansum(exp(w * misfits[:, :, 1]), axis=1)
+        )
+
+    def _combine_bootstrap(
+        self, misfits, extra_weights, extra_residuals, get_contributions
+    ):
+        exp, root = self.exp, self.root
+        nmodels, nmisfits = misfits.shape[:2]
+
+        if extra_weights is not None:
+            wb = self.get_bootstrap_target_weights(extra_weights)
+            wf = self.inter_family_weights(misfits[:, :, 1])[:, num.newaxis, :]
+            nbootstrap = extra_weights.shape[0]
+        else:
+            nbootstrap = extra_residuals.shape[0]
+
+        if get_contributions:
+            res = num.empty((nmodels, nbootstrap, nmisfits))
+        else:
+            res = num.empty((nmodels, nbootstrap))
+
+        nblock_b = max(1, min(nbootstrap, self.nelements_block // max(1, nmisfits)))
+        nblock_m = max(1, self.nelements_block // max(1, nmisfits * nblock_b))
+
+        for imodel in range(0, nmodels, nblock_m):
+            ms = slice(imodel, imodel + nblock_m)
+            for ibootstrap in range(0, nbootstrap, nblock_b):
+                bs = slice(ibootstrap, ibootstrap + nblock_b)
+                if extra_weights is not None:
+                    w = wb[:, bs, :] * wf[ms]
+                else:
+                    w = 1.0
+
+                if extra_residuals is not None:
+                    r = extra_residuals[num.newaxis, bs, :]
+                else:
+                    r = 0.0
+
+                if get_contributions:
+                    res[ms, bs, :] = (
+                        exp(w * (misfits[ms, num.newaxis, :, 0] + r))
+                        / num.nansum(exp(w * misfits[ms, num.newaxis, :, 1]), axis=2)[
+                            :, :, num.newaxis
+                        ]
+                    )
+                else:
+                    res[ms, bs] = root(
+                        num.nansum(
+                            exp(w * (misfits[ms, num.newaxis, :, 0] + r)), axis=2
+                        )
+                        / num.nansum(exp(w * (misfits[ms, num.newaxis, :, 1])), axis=2)
+                    )
+
+        return res
+
+    def _get_residual_terms(self, extra_weights, extra_residuals):
+        a = self.get_bootstrap_target_weights(extra_weights)[0] ** 2
+        if extra_residuals is not self._extra_residuals:
+            if extra_residuals is not None:
+                ae = a * extra_residuals
+                self._residual_terms = (2.0 * ae, ae * extra_residuals)
+            else:
+                self._residual_terms = None
+
+            self._extra_residuals = extra_residuals
+
+        return a, self._residual_terms
+
+    def _combine_bootstrap_l2(self, misfits, extra_weights, extra_residuals):
+        a, residual_terms = self._get_residual_terms(extra_weights, extra_residuals)
+
+        f = self.inter_family_weights(misfits[:, :, 1]) ** 2
+        r = misfits[:, :, 0]
+        n = misfits[:, :, 1]
+
+        r_ok = num.isfinite(r)
+        fr = num.where(r_ok, f, 0.0)
+        r = num.where(r_ok, r, 0.0)
+        n_ok = num.isfinite(n)
+        fn = num.where(n_ok, f, 0.0)
+        n = num.where(n_ok, n, 0.0)
+
+        numer = num.dot(fr * r**2, a.T)
+        if residual_terms is not None:
+            ae2, ae_sqr = residual_terms
+            numer += num.dot(fr * r, ae2.T)
+            numer += num.dot(fr, ae_sqr.T)
+
+        denom = num.dot(fn * n**2, a.T)
+        return num.sqrt(num.maximum(numer, 0.0) / denom)
+
+
 class ProblemInfoNotAvailable(GrondError):
     pass
 
@@ -840,6 +1531,140 @@ class InvalidAttributeName(GrondError):
     pass
 
 
+class FsyncPolicyChoice(StringChoice):
+    choices = ["never", "flush", "close"]
+
+
+class ProblemDataWriter(object):
+    """
+    Append models to the data files of a rundir.
+
+    The data files are kept open and written in blocks. After each flush, the
+    number of completely written models is committed to the ``nmodels`` file
+    of the rundir, so that readers following the run never pick up partially
+    written models.
+
+    :param dirname: path to rundir
+    :param problem: :class:`grond.Problem` instance
+    :param flush_nmodels: flush after this many models have been buffered
+    :type flush_nmodels: int, optional
+    :param flush_interval: flush when the last flush is older than this [s]
+    :type flush_interval: float, optional
+    :param fsync: when to sync the data files to disk, ``'never'``, on every
+        ``'flush'`` or on ``'close'``
+    :type fsync: str, optional
+    """
+
+    def __init__(
+        self, dirname, problem, flush_nmodels=100, flush_interval=1.0, fsync="never"
+    ):
+        self.dirname = dirname
+        self.problem = problem
+        self.flush_nmodels = flush_nmodels
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+
+        self._files = {}
+        self._nmodels_buffered = 0
+        self._tflush = time.time()
+
+        if op.exists(op.join(dirname, "models")):
+            self.nmodels = get_nmodels(dirname, problem)
+        else:
+            self.nmodels = 0
+
+    def _write(self, name, data):
+        if name not in self._files:
+            self._files[name] = open(op.join(self.dirname, name), "ab")
+
+        self._files[name].write(data.tobytes())
+
+    def write(
+        self,
+        models,
+        misfits,
+        bootstraps=None,
+        sampler_contexts=None,
+        target_dependants=None,
+    ):
+        self._write("models", models.astype("<f8"))
+        self._write("misfits", misfits.astype("<f8"))
+
+        if bootstraps is not None:
+            self._write("bootstraps", bootstraps.astype("<f8"))
+
+        if sampler_contexts is not None:
+            self._write("choices", sampler_contexts.astype("<i8"))
+
+        if target_dependants is not None:
+            self._write("target_dependants", target_dependants.astype("<f8"))
+
+        self._nmodels_buffered += models.shape[0]
+
+        if (
+            self._nmodels_buffered >= self.flush_nmodels
+            or time.time() - self._tflush >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self, fsync=None):
+        if fsync is None:
+            fsync = self.fsync == "flush"
+
+        for f in self._files.values():
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+
+        self.nmodels += self._nmodels_buffered
+        self._nmodels_buffered = 0
+        self._tflush = time.time()
+
+        fn = op.join(self.dirname, "nmodels")
+        fn_temp = fn + ".temp"
+        with open(fn_temp, "wb") as f:
+            num.array([self.nmodels], dtype="<i8").tofile(f)
+
+        os.replace(fn_temp, fn)
+
+    def truncate(self, nmodels, nchains=None):
+        """
+        Drop all but the first *nmodels* models from the data files.
+
+        Used to continue an interrupted run from a checkpoint, discarding
+        models written after the checkpoint was taken.
+        """
+        self.flush()
+        for f in self._files.values():
+            f.close()
+
+        self._files = {}
+
+        nbytes_per_model = [
+            ("models", self.problem.nparameters * 8),
+            ("misfits", self.problem.nmisfits * 2 * 8),
+            ("choices", 4 * 8),
+            ("target_dependants", len(self.problem.target_dependants) * 8),
+        ]
+        if nchains is not None:
+            nbytes_per_model.append(("bootstraps", nchains * 8))
+
+        for name, nbytes in nbytes_per_model:
+            fn = op.join(self.dirname, name)
+            if op.exists(fn) and os.stat(fn).st_size > nmodels * nbytes:
+                os.truncate(fn, nmodels * nbytes)
+
+        self.nmodels = nmodels
+        self.flush()
+
+    def close(self):
+        self.flush(fsync=self.fsync in ("flush", "close"))
+        for f in self._files.values():
+            f.close()
+
+        self._files = {}
+
+
 class ModelHistory(object):
     """
     Write, read and follow sequences of models produced in an optimisation run.
@@ -849,26 +1674,48 @@ class ModelHistory(object):
     :type path: str, optional
     :param mode: open mode, 'r': read, 'w': write
     :type mode: str, optional
+    :param writer_config: extra arguments for the :py:class:`ProblemDataWriter`
+        used in write mode
+    :type writer_config: dict, optional
+    :param mmap: in read mode, wrap memory-mapped views on the data files
+        instead of copying them into memory
+    :type mmap: bool, optional
     """
 
     nmodels_capacity_min = 1024
 
-    def __init__(self, problem, nchains=None, path=None, mode="r"):
+    def __init__(
+        self,
+        problem,
+        nchains=None,
+        path=None,
+        mode="r",
+        writer_config=None,
+        mmap=False,
+    ):
         self.mode = mode
+        self.mmap = mmap
 
         self.problem = problem
         self.path = path
         self.nchains = nchains
 
+        self._writer = None
+        self._writer_config = writer_config if writer_config is not None else {}
+
         self._models_buffer = None
         self._misfits_buffer = None
         self._bootstraps_buffer = None
         self._sample_contexts_buffer = None
+        self._target_dependants_buffer = None
 
         self.models = None
         self.misfits = None
         self.bootstrap_misfits = None
         self.sampler_contexts = None
+        self.target_dependants = None
+
+        self._ntarget_dependants = len(problem.target_dependants)
 
         self.nmodels_capacity = self.nmodels_capacity_min
         self.listeners = []
@@ -920,12 +1767,14 @@ class ModelHistory(object):
         assert 0 <= nmodels_new <= self.nmodels
         self.models = self._models_buffer[:nmodels_new, :]
         self.misfits = self._misfits_buffer[:nmodels_new, :, :]
-        if self.nchains is not None:
-            self.bootstrap_misfits = self._bootstraps_buffer[:nmodels_new, :, :]  # noqa
+        if self.nchains is not None and self._bootstraps_buffer is not None:
+            self.bootstrap_misfits = self._bootstraps_buffer[:nmodels_new, :]
         if self._sample_contexts_buffer is not None:
             self.sampler_contexts = self._sample_contexts_buffer[
                 :nmodels_new, :
             ]  # noqa
+        if self._target_dependants_buffer is not None:
+            self.target_dependants = self._target_dependants_buffer[:nmodels_new, :]
 
     @property
     def nmodels_capacity(self):
@@ -969,11 +1818,28 @@ class ModelHistory(object):
                     bootstraps_buffer[:ncopy, :] = self._bootstraps_buffer[:ncopy, :]
                 self._bootstraps_buffer = bootstraps_buffer
 
+            if self._ntarget_dependants:
+                target_dependants_buffer = num.full(
+                    (nmodels_capacity_new, self._ntarget_dependants), num.nan
+                )
+                if self._target_dependants_buffer is not None:
+                    target_dependants_buffer[:ncopy, :] = (
+                        self._target_dependants_buffer[:ncopy, :]
+                    )
+                self._target_dependants_buffer = target_dependants_buffer
+
     def clear(self):
         self.nmodels = 0
         self.nmodels_capacity = self.nmodels_capacity_min
 
-    def extend(self, models, misfits, bootstrap_misfits=None, sampler_contexts=None):
+    def extend(
+        self,
+        models,
+        misfits,
+        bootstrap_misfits=None,
+        sampler_contexts=None,
+        target_dependants=None,
+    ):
         nmodels = self.nmodels
         n = models.shape[0]
 
@@ -996,18 +1862,74 @@ class ModelHistory(object):
             self._sample_contexts_buffer[nmodels : nmodels + n, :] = sampler_contexts
             self.sampler_contexts = self._sample_contexts_buffer[: nmodels + n, :]
 
+        if self._target_dependants_buffer is not None:
+            self._target_dependants_buffer[nmodels : nmodels + n, :] = (
+                target_dependants if target_dependants is not None else num.nan
+            )
+            self.target_dependants = self._target_dependants_buffer[: nmodels + n, :]
+
         if self.path and self.mode == "w":
-            for i in range(n):
-                self.problem.dump_problem_data(
-                    self.path,
-                    models[i, :],
-                    misfits[i, :, :],
-                    bootstrap_misfits[i, :] if bootstrap_misfits is not None else None,
-                    sampler_contexts[i, :] if sampler_contexts is not None else None,
+            if self._writer is None:
+                self._writer = ProblemDataWriter(
+                    self.path, self.problem, **self._writer_config
                 )
 
+            self._writer.write(
+                models, misfits, bootstrap_misfits, sampler_contexts, target_dependants
+            )
+
         self.emit("extend", nmodels, n, models, misfits, sampler_contexts)
 
+    def resume(self, nmodels):
+        """
+        Continue writing to the rundir of an interrupted run (write mode).
+
+        The first *nmodels* models are loaded from the rundir, any models
+        beyond are removed from its data files.
+        """
+        assert self.mode == "w" and self.nmodels == 0
+
+        self.verify_rundir(self.path)
+        models, misfits, bootstraps, sampler_contexts = load_problem_data(
+            self.path, self.problem, nchains=self.nchains
+        )
+        target_dependants = self._load_target_dependants(models.shape[0])
+
+        if models.shape[0] < nmodels:
+            raise ProblemDataNotAvailable(
+                "Cannot resume, only %i of %i models available (%s)."
+                % (models.shape[0], nmodels, self.path)
+            )
+
+        def head(data):
+            return data[:nmodels] if data is not None else None
+
+        self.mode = "r"
+        try:
+            self.extend(
+                head(models),
+                head(misfits),
+                head(bootstraps),
+                head(sampler_contexts),
+                head(target_dependants),
+            )
+        finally:
+            self.mode = "w"
+
+        self._writer = ProblemDataWriter(self.path, self.problem, **self._writer_config)
+        self._writer.truncate(nmodels, nchains=self.nchains)
+
+    def flush(self):
+        """Flush buffered models to the rundir (write mode)."""
+        if self._writer is not None:
+            self._writer.flush()
+
+    def close(self):
+        """Flush and close the data files of the rundir (write mode)."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
     def append(self, model, misfits, bootstrap_misfits=None, sampler_context=None):
         if bootstrap_misfits is not None:
             bootstrap_misfits = bootstrap_misfits[num.newaxis, :]
@@ -1026,9 +1948,63 @@ class ModelHistory(object):
         self.mode = "r"
         self.verify_rundir(self.path)
         models, misfits, bootstraps, sampler_contexts = load_problem_data(
-            self.path, self.problem, nchains=self.nchains
+            self.path, self.problem, nchains=self.nchains, mmap=self.mmap
+        )
+        target_dependants = self._load_target_dependants(
+            models.shape[0], mmap=self.mmap
+        )
+        if self.mmap:
+            self._wrap(models, misfits, bootstraps, sampler_contexts, target_dependants)
+        else:
+            self.extend(
+                models, misfits, bootstraps, sampler_contexts, target_dependants
+            )
+
+    def _load_target_dependants(self, nmodels, nmodels_skip=0, mmap=False):
+        """
+        Load stored target dependants of *nmodels* models from the rundir.
+
+        Missing values are filled with NaN, so that the rows match the models.
+        """
+        values = load_target_dependants(
+            self.path, self.problem, nmodels_skip=nmodels_skip, mmap=mmap
+        )
+        if values is None or values.shape[0] == nmodels:
+            return values
+
+        values_full = num.full((nmodels, self._ntarget_dependants), num.nan)
+        n = min(nmodels, values.shape[0])
+        values_full[:n, :] = values[:n, :]
+        return values_full
+
+    def _wrap(
+        self, models, misfits, bootstrap_misfits, sampler_contexts, target_dependants
+    ):
+        """Use memory-mapped data files as buffers, without copying."""
+
+        nmodels = self.nmodels
+        n = models.shape[0] - nmodels
+
+        self._models_buffer = models
+        self._misfits_buffer = misfits
+        self._bootstraps_buffer = bootstrap_misfits
+        self._sample_contexts_buffer = sampler_contexts
+        self._target_dependants_buffer = target_dependants
+
+        self.models = models
+        self.misfits = misfits
+        self.bootstrap_misfits = bootstrap_misfits
+        self.sampler_contexts = sampler_contexts
+        self.target_dependants = target_dependants
+
+        self.emit(
+            "extend",
+            nmodels,
+            n,
+            models[nmodels:],
+            misfits[nmodels:],
+            sampler_contexts[nmodels:] if sampler_contexts is not None else None,
         )
-        self.extend(models, misfits, bootstraps, sampler_contexts)
 
     def update(self):
         """Update history from path"""
@@ -1037,6 +2013,15 @@ class ModelHistory(object):
             return
 
         try:
+            if self.mmap:
+                data = load_problem_data(
+                    self.path, self.problem, nchains=self.nchains, mmap=True
+                )
+                self._wrap(
+                    *data, self._load_target_dependants(data[0].shape[0], mmap=True)
+                )
+                return
+
             (
                 new_models,
                 new_misfits,
@@ -1045,11 +2030,25 @@ class ModelHistory(object):
             ) = load_problem_data(
                 self.path, self.problem, nmodels_skip=self.nmodels, nchains=self.nchains
             )
+            new_target_dependants = self._load_target_dependants(
+                new_models.shape[0], nmodels_skip=self.nmodels
+            )
 
-        except ValueError:
+        except ProblemDataNotAvailable:
+            # new models have not been completely written yet
             return
 
-        self.extend(new_models, new_misfits, new_bootstraps, new_sampler_contexts)
+        except ValueError as e:
+            logger.warning("Cannot update model history from %s: %s" % (self.path, e))
+            return
+
+        self.extend(
+            new_models,
+            new_misfits,
+            new_bootstraps,
+            new_sampler_contexts,
+            new_target_dependants,
+        )
 
     def add_listener(self, listener):
         self.listeners.append(listener)
@@ -1168,13 +2167,23 @@ def get_nmodels(dirname, problem):
     with open(fn, "r") as f:
         nmodels2 = os.fstat(f.fileno()).st_size // (problem.nmisfits * 2 * 8)
 
-    return min(nmodels1, nmodels2)
+    nmodels = min(nmodels1, nmodels2)
+
+    fn = op.join(dirname, "nmodels")
+    if op.exists(fn):
+        with open(fn, "rb") as f:
+            nmodels_committed = num.fromfile(f, dtype="<i8", count=1)
+
+        if nmodels_committed.size == 1:
+            nmodels = min(nmodels, int(nmodels_committed[0]))
+
+    return nmodels
 
 
-def load_problem_info_and_data(dirname, subset=None, nchains=None):
+def load_problem_info_and_data(dirname, subset=None, nchains=None, mmap=False):
     problem = load_problem_info(dirname)
     models, misfits, bootstraps, sampler_contexts = load_problem_data(
-        xjoin(dirname, subset), problem, nchains=nchains
+        xjoin(dirname, subset), problem, nchains=nchains, mmap=mmap
     )
     return problem, models, misfits, bootstraps, sampler_contexts
 
@@ -1193,48 +2202,97 @@ def load_problem_info(dirname):
         raise ProblemInfoNotAvailable("No problem info available (%s)." % dirname)
 
 
-def load_problem_data(dirname, problem, nmodels_skip=0, nchains=None):
+def _read_array(fn, dtype, nskip, shape, mmap):
+    nitems = int(num.prod(shape[1:]))
+    offset = nskip * nitems * num.dtype(dtype).itemsize
+    if os.stat(fn).st_size < offset + shape[0] * nitems * num.dtype(dtype).itemsize:
+        # models are committed before all data files have been written
+        raise ProblemDataNotAvailable("Incomplete problem data file: %s" % fn)
+
+    if mmap and shape[0] > 0:
+        return num.memmap(fn, dtype=dtype, mode="r", offset=offset, shape=shape)
+
+    with open(fn, "rb") as f:
+        f.seek(offset)
+        data = num.fromfile(f, dtype=dtype, count=shape[0] * nitems)
+
+    if mmap:
+        return data.reshape(shape)
+    else:
+        return data.astype(num.dtype(dtype).type).reshape(shape)
+
+
+def load_target_dependants(dirname, problem, nmodels_skip=0, mmap=False):
+    """
+    Load the stored values of the target dependants of a rundir.
+
+    :returns: 2D array indexed as ``values[imodel, itarget_dependant]`` or
+        ``None``, if the problem has no target dependants or none are stored.
+        Values of models written without them are NaN.
+    """
+    fn = op.join(dirname, "target_dependants")
+    if not problem.target_dependants or not op.exists(fn):
+        return None
+
+    ndependants = len(problem.target_dependants)
+    nmodels = max(0, get_nmodels(dirname, problem) - nmodels_skip)
+    nmodels_stored = min(
+        nmodels,
+        max(0, os.stat(fn).st_size // (ndependants * 8) - nmodels_skip),
+    )
+    values = _read_array(fn, "<f8", nmodels_skip, (nmodels_stored, ndependants), mmap)
+    if nmodels_stored == nmodels:
+        return values
+
+    values_full = num.full((nmodels, ndependants), num.nan)
+    values_full[:nmodels_stored, :] = values
+    return values_full
+
+
+def load_problem_data(dirname, problem, nmodels_skip=0, nchains=None, mmap=False):
+    """
+    Load models, misfits, bootstrap misfits and sampler contexts of a rundir.
+
+    Stored values of target dependants are loaded separately, see
+    :py:func:`load_target_dependants`.
+
+    :param mmap: if ``True``, return read-only, little-endian
+        :py:class:`numpy.memmap` views on the data files instead of reading
+        them into memory
+    :type mmap: bool, optional
+    """
     try:
         nmodels = get_nmodels(dirname, problem) - nmodels_skip
 
-        fn = op.join(dirname, "models")
-        with open(fn, "r") as f:
-            f.seek(nmodels_skip * problem.nparameters * 8)
-            models = num.fromfile(
-                f, dtype="<f8", count=nmodels * problem.nparameters
-            ).astype(float)
-
-        models = models.reshape((nmodels, problem.nparameters))
+        models = _read_array(
+            op.join(dirname, "models"),
+            "<f8",
+            nmodels_skip,
+            (nmodels, problem.nparameters),
+            mmap,
+        )
 
-        fn = op.join(dirname, "misfits")
-        with open(fn, "r") as f:
-            f.seek(nmodels_skip * problem.nmisfits * 2 * 8)
-            misfits = num.fromfile(
-                f, dtype="<f8", count=nmodels * problem.nmisfits * 2
-            ).astype(float)
-        misfits = misfits.reshape((nmodels, problem.nmisfits, 2))
+        misfits = _read_array(
+            op.join(dirname, "misfits"),
+            "<f8",
+            nmodels_skip,
+            (nmodels, problem.nmisfits, 2),
+            mmap,
+        )
 
         bootstraps = None
         fn = op.join(dirname, "bootstraps")
         if op.exists(fn) and nchains is not None:
-            with open(fn, "r") as f:
-                f.seek(nmodels_skip * nchains * 8)
-                bootstraps = num.fromfile(
-                    f, dtype="<f8", count=nmodels * nchains
-                ).astype(float)
-
-            bootstraps = bootstraps.reshape((nmodels, nchains))
+            bootstraps = _read_array(
+                fn, "<f8", nmodels_skip, (nmodels, nchains), mmap
+            )
 
         sampler_contexts = None
         fn = op.join(dirname, "choices")
         if op.exists(fn):
-            with open(fn, "r") as f:
-                f.seek(nmodels_skip * 4 * 8)
-                sampler_contexts = num.fromfile(
-                    f, dtype="<i8", count=nmodels * 4
-                ).astype(int)
-
-            sampler_contexts = sampler_contexts.reshape((nmodels, 4))
+            sampler_contexts = _read_array(
+                fn, "<i8", nmodels_skip, (nmodels, 4), mmap
+            )
 
     except OSError as e:
         logger.debug(str(e))
@@ -1249,8 +2307,14 @@ __all__ = """
     ModelHistory
     ProblemInfoNotAvailable
     ProblemDataNotAvailable
+    ProblemDataWriter
+    MisfitCombiner
+    EvaluationPlan
+    SubsourceParameterMap
+    FsyncPolicyChoice
     load_problem_info
     load_problem_info_and_data
+    load_target_dependants
     InvalidAttributeName
     NoSuchAttribute
 """.split()
@@ -0,0 +1,410 @@
+"""
+Forward modelling of moment tensor sources through cached elementary
+responses.
+
+At a fixed location, the synthetics of a moment tensor source are linear in
+its six moment tensor components. The responses to the six elementary moment
+tensors are therefore computed once per source location and target and the
+synthetics of each model are assembled as weighted sums of them. Origin time
+and source time function are applied in the same way as the engine does, by
+integer sample shifts and post-stack convolution. The only approximation is
+that source locations are snapped to a grid: depths to the source depth
+spacing of the Green's function store and north and east shifts to a
+Cartesian grid with the store's distance spacing.
+"""
+
+import math
+import logging
+from collections import OrderedDict
+
+import numpy as num
+
+from pyrocko import gf
+
+guts_prefix = "grond"
+logger = logging.getLogger("grond.problems.cmt.linearity")
+
+
+def _point_sources(source):
+    if isinstance(source, gf.MTSource):
+        return [source]
+
+    if isinstance(source, gf.CombiSource) and all(
+        isinstance(subsource, gf.MTSource) for subsource in source.subsources
+    ):
+        return list(source.subsources)
+
+    return None
+
+
+def _stf_shifts(stf, deltat, time):
+    times, amplitudes = stf.discretize_t(deltat, time)
+    return num.round(times / deltat).astype(num.int64), amplitudes
+
+
+class MTLinearityCache(object):
+    """
+    Bounded LRU cache of elementary moment tensor responses.
+
+    Entries are kept per target and rounded source location. For waveform
+    targets, an entry holds the six elementary traces over a sample window,
+    which is widened and recomputed when a model needs samples outside of
+    it. For static targets, it holds the six elementary static results.
+    Least recently used entries are evicted when their summed size exceeds
+    *nbytes_max*.
+
+    Only plain :py:class:`pyrocko.gf.Target`,
+    :py:class:`pyrocko.gf.StaticTarget` and
+    :py:class:`pyrocko.gf.SatelliteTarget` targets on stores with a regular
+    distance-depth grid are handled, everything else is passed on to the
+    engine.
+    """
+
+    def __init__(self, nbytes_max=256 * 1024**2):
+        self.nbytes_max = nbytes_max
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._elementary_targets = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.nhits = 0
+        self.nmisses = 0
+        self.nevictions = 0
+
+    def get_stats(self):
+        return dict(
+            nhits=self.nhits,
+            nmisses=self.nmisses,
+            nevictions=self.nevictions,
+            nentries=len(self._entries),
+            nbytes=self._nbytes,
+        )
+
+    def clear(self):
+        self._entries.clear()
+        self._nbytes = 0
+        self._elementary_targets.clear()
+
+    def _get(self, k):
+        entry = self._entries.get(k, None)
+        if entry is not None:
+            self._entries.move_to_end(k)
+
+        return entry
+
+    def _put(self, k, entry):
+        if k in self._entries:
+            self._nbytes -= self._entries.pop(k)[-1]
+
+        self._entries[k] = entry
+        self._nbytes += entry[-1]
+        while self._nbytes > self.nbytes_max and len(self._entries) > 1:
+            _, entry_old = self._entries.popitem(last=False)
+            self._nbytes -= entry_old[-1]
+            self.nevictions += 1
+
+    def is_linear(self, engine, target):
+        """Check if the responses at a target can be assembled from cache."""
+        config = engine.get_store(target.store_id).config
+        if None in (
+            getattr(config, "distance_delta", None),
+            getattr(config, "source_depth_delta", None),
+        ):
+            return False
+
+        if type(target) is gf.Target:
+            return (
+                target.tmin is not None
+                and target.tmax is not None
+                and target.sample_rate in (None, config.sample_rate)
+            )
+
+        if type(target) in (gf.StaticTarget, gf.SatelliteTarget):
+            return target.tsnapshot is None
+
+        return False
+
+    def location_key(self, store, source):
+        """
+        Get location of a point source, snapped to a grid.
+
+        Depth is rounded to the source depth spacing of the store. North and
+        east shifts are rounded to multiples of the store's distance spacing,
+        i.e. to a Cartesian grid around the source's reference point. This is
+        not the distance grid of the store, which is indexed by
+        source-receiver distance, so that the lateral error of the source
+        location is up to half the distance spacing in each direction.
+        """
+        dx = store.config.distance_delta
+        dz = store.config.source_depth_delta
+        return (
+            store.config.id,
+            source.lat,
+            source.lon,
+            source.elevation,
+            dx * round(source.north_shift / dx),
+            dx * round(source.east_shift / dx),
+            dz * round(source.depth / dz),
+        )
+
+    def process(self, engine, sources, targets, nthreads=0):
+        """
+        Model sources at targets, like :py:meth:`pyrocko.gf.LocalEngine.process`.
+
+        :returns: results, indexed as ``results[isource][itarget]``, as in
+            the ``results_list`` of the engine's response
+        """
+        results_list = [[None] * len(targets) for _ in sources]
+
+        points = [_point_sources(source) for source in sources]
+        if None in points:
+            ilinear = []
+        else:
+            ilinear = [
+                itarget
+                for (itarget, target) in enumerate(targets)
+                if self.is_linear(engine, target)
+            ]
+
+        iother = sorted(set(range(len(targets))) - set(ilinear))
+        if iother:
+            resp = engine.process(
+                sources, [targets[itarget] for itarget in iother], nthreads=nthreads
+            )
+            for results_out, results in zip(results_list, resp.results_list):
+                for itarget, result in zip(iother, results):
+                    results_out[itarget] = result
+
+        if not ilinear:
+            return results_list
+
+        # sample windows of the elementary responses needed by the models
+        needs = {}
+        windows = {}
+        for itarget in ilinear:
+            target = targets[itarget]
+            store = engine.get_store(target.store_id)
+            if type(target) is gf.Target:
+                rate = store.config.sample_rate
+                windows[itarget] = (
+                    int(math.floor(target.tmin * rate)),
+                    int(math.ceil(target.tmax * rate)),
+                )
+
+            for subsources in points:
+                for subsource in subsources:
+                    lkey = self.location_key(store, subsource)
+                    need = None
+                    if itarget in windows:
+                        itmin, itmax = windows[itarget]
+                        ks, _ = _stf_shifts(
+                            subsource.effective_stf_pre(),
+                            store.config.deltat,
+                            subsource.time,
+                        )
+                        need = (itmin - int(ks.max()), itmax - int(ks.min()))
+
+                    k = (target, lkey)
+                    if k in needs and need is not None:
+                        need = (min(need[0], needs[k][0]), max(need[1], needs[k][1]))
+
+                    needs[k] = need
+
+        # entries are collected here, so that they cannot get lost to
+        # evictions while the results are assembled
+        current = {}
+        missing = {}
+        for (target, lkey), need in needs.items():
+            entry = self._get((target, lkey))
+            if entry is not None and (
+                need is None
+                or isinstance(entry[0], gf.SeismosizerError)
+                or (entry[0] <= need[0] and need[1] < entry[0] + entry[1].shape[1])
+            ):
+                self.nhits += 1
+                current[target, lkey] = entry
+                continue
+
+            self.nmisses += 1
+            if entry is not None and need is not None:
+                need = (
+                    min(need[0], entry[0]),
+                    max(need[1], entry[0] + entry[1].shape[1] - 1),
+                )
+
+            missing.setdefault(target, {})[lkey] = need
+
+        if missing:
+            current.update(self._compute_elementary(engine, missing, nthreads))
+
+        for itarget in ilinear:
+            target = targets[itarget]
+            store = engine.get_store(target.store_id)
+            for isource, (source, subsources) in enumerate(zip(sources, points)):
+                entries = [
+                    current[target, self.location_key(store, subsource)]
+                    for subsource in subsources
+                ]
+                errors = [
+                    entry[0]
+                    for entry in entries
+                    if isinstance(entry[0], gf.SeismosizerError)
+                ]
+                if errors:
+                    result = errors[0]
+                elif itarget in windows:
+                    result = self._assemble_dynamic(
+                        engine,
+                        store,
+                        source,
+                        subsources,
+                        target,
+                        windows[itarget],
+                        entries,
+                    )
+                else:
+                    result = self._assemble_static(
+                        engine, source, subsources, target, entries
+                    )
+
+                results_list[isource][itarget] = result
+
+        return results_list
+
+    def _get_elementary_target(self, target):
+        if target not in self._elementary_targets:
+            cls = type(target)
+            d = dict((k, getattr(target, k)) for k in cls.T.propnames)
+            self._elementary_targets[target] = cls(**d)
+
+        return self._elementary_targets[target]
+
+    def _compute_elementary(self, engine, missing, nthreads):
+        # one engine request per set of targets missing the same locations
+        groups = {}
+        for target, lneeds in missing.items():
+            groups.setdefault(tuple(sorted(lneeds)), []).append(target)
+
+        computed = {}
+        for lkeys, targets in groups.items():
+            computed.update(
+                self._compute_elementary_group(
+                    engine, lkeys, targets, missing, nthreads
+                )
+            )
+
+        return computed
+
+    def _compute_elementary_group(self, engine, lkeys, targets, missing, nthreads):
+        unit_sources = []
+        for lkey in lkeys:
+            _, lat, lon, elevation, north_shift, east_shift, depth = lkey
+            for m6 in num.eye(6):
+                unit_sources.append(
+                    gf.MTSource(
+                        lat=lat,
+                        lon=lon,
+                        elevation=elevation,
+                        north_shift=north_shift,
+                        east_shift=east_shift,
+                        depth=depth,
+                        time=0.0,
+                        m6=m6,
+                    )
+                )
+
+        elementary_targets = []
+        for target in targets:
+            etarget = self._get_elementary_target(target)
+            if type(target) is gf.Target:
+                store = engine.get_store(target.store_id)
+                lneeds = missing[target]
+                i0 = min(need[0] for need in lneeds.values())
+                i1 = max(need[1] for need in lneeds.values())
+
+                # margin, so that the window does not have to be widened
+                # for every small change of origin times
+                npad = (i1 - i0) // 2
+                deltat = store.config.deltat
+                etarget.tmin = (i0 - npad + 0.25) * deltat
+                etarget.tmax = (i1 + npad - 0.25) * deltat
+
+            elementary_targets.append(etarget)
+
+        resp = engine.process(unit_sources, elementary_targets, nthreads=nthreads)
+
+        computed = {}
+        for target, results in zip(targets, zip(*resp.results_list)):
+            for ilkey, lkey in enumerate(lkeys):
+                eresults = results[ilkey * 6 : ilkey * 6 + 6]
+                errors = [r for r in eresults if isinstance(r, gf.SeismosizerError)]
+                if errors:
+                    entry = (errors[0], 0)
+
+                elif type(target) is gf.Target:
+                    tr = eresults[0].trace
+                    traces = num.array([r.trace.data for r in eresults])
+                    entry = (
+                        int(round(tr.tmin / tr.deltat)),
+                        traces,
+                        traces.nbytes,
+                    )
+
+                else:
+                    statics = dict(
+                        (k, num.array([r.result[k] for r in eresults]))
+                        for k in eresults[0].result
+                    )
+                    entry = (statics, sum(v.nbytes for v in statics.values()))
+
+                computed[target, lkey] = entry
+                self._put((target, lkey), entry)
+
+        return computed
+
+    def _assemble_dynamic(
+        self, engine, store, source, subsources, target, window, entries
+    ):
+        deltat = store.config.deltat
+        itmin, itmax = window
+        n = itmax - itmin + 1
+        data = num.zeros(n)
+        for subsource, (i0, traces, _) in zip(subsources, entries):
+            trace = num.dot(subsource.m6, traces)
+            ks, amplitudes = _stf_shifts(
+                subsource.effective_stf_pre(), deltat, subsource.time
+            )
+            for k, amplitude in zip(ks, amplitudes):
+                j = itmin - k - i0
+                data += amplitude * trace[j : j + n]
+
+        # same post-stack source time function handling as in the engine
+        times, amplitudes = source.effective_stf_post().discretize_t(deltat, 0.0)
+
+        padded_data = num.empty(data.size + amplitudes.size, dtype=float)
+        padded_data[: data.size] = data
+        padded_data[data.size :] = data[-1]
+        data = num.convolve(amplitudes, padded_data)
+
+        tr = gf.SeismosizerTrace(
+            codes=target.codes,
+            data=data[: -amplitudes.size],
+            deltat=deltat,
+            tmin=itmin * deltat + times[0],
+        )
+
+        return target.post_process(engine, source, tr)
+
+    def _assemble_static(self, engine, source, subsources, target, entries):
+        statics = {}
+        for subsource, (elementary, _) in zip(subsources, entries):
+            for k, v in elementary.items():
+                statics[k] = statics.get(k, 0.0) + num.dot(subsource.m6, v)
+
+        return target.post_process(engine, source, statics)
+
+
+__all__ = """
+    MTLinearityCache
+""".split()
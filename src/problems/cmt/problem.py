@@ -14,7 +14,8 @@ from grond.meta import (
     has_get_plot_classes,
 )
 
-from ..base import Problem, ProblemConfig
+from ..base import Problem, ProblemConfig, SubsourceParameterMap
+from .linearity import MTLinearityCache
 
 
 def as_arr(mat_or_arr):
@@ -50,6 +51,15 @@ class CMTProblemConfig(ProblemConfig):
     mt_type = MTType.T(default="full")
     stf_type = STFType.T(default="HalfSinusoidSTF")
     nthreads = Int.T(default=1)
+    mt_linearity_cache_nbytes_max = Int.T(
+        optional=True,
+        help="If set, synthetics are assembled from cached responses to the "
+        "six elementary moment tensors. Source depths are then snapped to the "
+        "source depth spacing of the Green's function store and north and "
+        "east shifts to a Cartesian grid with the store's distance spacing, "
+        "so that lateral positions are off by up to half the distance "
+        "spacing. Memory budget [bytes] of the cache.",
+    )
 
     def get_problem(self, event_group, target_groups, targets):
         if len(event_group.get_events()) != 1:
@@ -80,6 +90,7 @@ class CMTProblemConfig(ProblemConfig):
             stf_type=self.stf_type,
             norm_exponent=self.norm_exponent,
             nthreads=self.nthreads,
+            mt_linearity_cache_nbytes_max=self.mt_linearity_cache_nbytes_max,
         )
 
         return problem
@@ -123,15 +134,29 @@ class CMTProblem(Problem):
     distance_min = Float.T(default=0.0)
     mt_type = MTType.T(default="full")
     stf_type = STFType.T(default="HalfSinusoidSTF")
+    mt_linearity_cache_nbytes_max = Int.T(optional=True)
 
     def __init__(self, **kwargs):
         Problem.__init__(self, **kwargs)
         self.deps_cache = {}
+        self._mt_linearity_cache = (
+            MTLinearityCache(nbytes_max=self.mt_linearity_cache_nbytes_max)
+            if self.mt_linearity_cache_nbytes_max is not None
+            else None
+        )
         self.problem_parameters = (
             self.problem_parameters + self.problem_parameters_stf[self.stf_type]
         )
         self._base_stf = STFType.base_stf(self.stf_type)
 
+    def _process(self, engine, sources, targets):
+        if self._mt_linearity_cache is None:
+            return Problem._process(self, engine, sources, targets)
+
+        return self._mt_linearity_cache.process(
+            engine, sources, targets, nthreads=self.nthreads
+        )
+
     def get_stf(self, d):
         d_stf = {}
         for p in self.problem_parameters_stf[self.stf_type]:
@@ -294,6 +319,15 @@ class MultiCMTProblemConfig(ProblemConfig):
     mt_type = MTType.T(default="full")
     stf_type = STFType.T(default="HalfSinusoidSTF")
     nthreads = Int.T(default=1)
+    mt_linearity_cache_nbytes_max = Int.T(
+        optional=True,
+        help="If set, synthetics are assembled from cached responses to the "
+        "six elementary moment tensors. Source depths are then snapped to the "
+        "source depth spacing of the Green's function store and north and "
+        "east shifts to a Cartesian grid with the store's distance spacing, "
+        "so that lateral positions are off by up to half the distance "
+        "spacing. Memory budget [bytes] of the cache.",
+    )
 
     def need_event_group(self):
         return True
@@ -322,6 +356,7 @@ class MultiCMTProblemConfig(ProblemConfig):
             stf_type=self.stf_type,
             norm_exponent=self.norm_exponent,
             nthreads=self.nthreads,
+            mt_linearity_cache_nbytes_max=self.mt_linearity_cache_nbytes_max,
         )
 
         return problem
@@ -362,13 +397,21 @@ class MultiCMTProblem(Problem):
         Parameter("rel_moment_clvd", label="$M_{0}^{CLVD}/M_{0}$"),
     ]
 
+    m6_names = ["rmnn", "rmee", "rmdd", "rmne", "rmnd", "rmed"]
+
     distance_min = Float.T(default=0.0)
     mt_type = MTType.T(default="full")
     stf_type = STFType.T(default="HalfSinusoidSTF")
+    mt_linearity_cache_nbytes_max = Int.T(optional=True)
 
     def __init__(self, **kwargs):
         Problem.__init__(self, **kwargs)
         self.deps_cache = {}
+        self._mt_linearity_cache = (
+            MTLinearityCache(nbytes_max=self.mt_linearity_cache_nbytes_max)
+            if self.mt_linearity_cache_nbytes_max is not None
+            else None
+        )
 
         parameters = []
         dependants = []
@@ -389,6 +432,7 @@ class MultiCMTProblem(Problem):
         self.nsubsources = len(self.base_source.subsources)
 
         self._base_stf = STFType.base_stf(self.stf_type)
+        self._parameter_map = None
 
         self.problem_parameters = parameters
         self.dependants = dependants
@@ -401,6 +445,14 @@ class MultiCMTProblem(Problem):
         except (IndexError, KeyError):
             raise GrondError("Invalid range key: %s" % k)
 
+    def _process(self, engine, sources, targets):
+        if self._mt_linearity_cache is None:
+            return Problem._process(self, engine, sources, targets)
+
+        return self._mt_linearity_cache.process(
+            engine, sources, targets, nthreads=self.nthreads
+        )
+
     def get_stf(self, subsource_name, d):
         d_stf = {}
         for p in self.problem_parameters_stf_single[self.stf_type]:
@@ -408,41 +460,48 @@ class MultiCMTProblem(Problem):
 
         return self._base_stf.clone(**d_stf)
 
-    def get_source(self, x):
-        d = self.get_parameter_dict(x)
-        subsources = []
-        for source in self.base_source.subsources:
-            n = source.name
-
-            rm6 = num.array(
-                [
-                    d[n + ".rmnn"],
-                    d[n + ".rmee"],
-                    d[n + ".rmdd"],
-                    d[n + ".rmne"],
-                    d[n + ".rmnd"],
-                    d[n + ".rmed"],
-                ],
-                dtype=num.float64,
+    def get_parameter_map(self):
+        if self._parameter_map is None:
+            self._parameter_map = SubsourceParameterMap(
+                self.base_source,
+                self.parameters,
+                lambda name, k: self.get_range(name + "." + k),
             )
 
-            m0 = mtm.magnitude_to_moment(d[n + ".magnitude"])
-            m6 = rm6 * m0
+        return self._parameter_map
 
-            p = {}
-            for k in source.keys():
-                if k in d:
-                    p[k] = float(
-                        self.get_range(n + "." + k).make_relative(
-                            source[k], d[n + "." + k]
-                        )
+    def get_source(self, x):
+        return self.get_sources(num.asarray(x)[num.newaxis, :])[0]
+
+    def get_sources(self, xs):
+        xs = num.asarray(xs, dtype=num.float64)
+        pmap = self.get_parameter_map()
+        stf_names = [p.name for p in self.problem_parameters_stf_single[self.stf_type]]
+
+        subsources_many = []
+        for isub in range(pmap.nsubsources):
+            rm6s = xs[:, pmap.indices(isub, self.m6_names)]
+            m0s = [
+                mtm.magnitude_to_moment(magnitude)
+                for magnitude in xs[:, pmap.index(isub, "magnitude")]
+            ]
+            stfs = xs[:, pmap.indices(isub, stf_names)].tolist()
+
+            updates = []
+            for rm6, m0, stf in zip(rm6s, m0s, stfs):
+                updates.append(
+                    dict(
+                        m6=rm6 * m0,
+                        stf=self._base_stf.clone(**dict(zip(stf_names, stf))),
                     )
+                )
 
-            csource = source.clone(m6=m6, stf=self.get_stf(n, d), **p)
-            subsources.append(csource)
+            subsources_many.append(pmap.clone_subsources(isub, updates))
 
-        source = self.base_source.clone(subsources=subsources)
-        return source
+        return [
+            self.base_source.clone(subsources=list(subsources))
+            for subsources in zip(*subsources_many)
+        ]
 
     def make_dependant(self, xs, pname):
         cache = self.deps_cache
@@ -498,18 +557,20 @@ class MultiCMTProblem(Problem):
         return [stf[p.name] for p in self.problem_parameters_stf_single[self.stf_type]]
 
     def pack(self, source):
+        pmap = self.get_parameter_map()
         xs = []
         for isub, subsource in enumerate(source.subsources):
             m6 = subsource.m6
             mt = subsource.pyrocko_moment_tensor()
             rm6 = m6 / mt.scalar_moment()
+            attributes = pmap.pack_attributes(isub, subsource)
             xs.append(
                 num.array(
                     [
-                        subsource.time - self.base_source.subsources[isub].time,
-                        subsource.north_shift,
-                        subsource.east_shift,
-                        subsource.depth,
+                        attributes["time"],
+                        attributes["north_shift"],
+                        attributes["east_shift"],
+                        attributes["depth"],
                         mt.moment_magnitude(),
                     ]
                     + rm6.tolist()
@@ -531,21 +592,11 @@ class MultiCMTProblem(Problem):
         return x.tolist()
 
     def preconstrain(self, x):
-        d = self.get_parameter_dict(x)
-        for source in self.base_source.subsources:
-            n = source.name
-
-            m6 = num.array(
-                [
-                    d[n + ".rmnn"],
-                    d[n + ".rmee"],
-                    d[n + ".rmdd"],
-                    d[n + ".rmne"],
-                    d[n + ".rmnd"],
-                    d[n + ".rmed"],
-                ],
-                dtype=num.float64,
-            )
+        x = num.array(x, dtype=num.float64)
+        pmap = self.get_parameter_map()
+        for isub in range(pmap.nsubsources):
+            im6 = pmap.indices(isub, self.m6_names)
+            m6 = x[im6]
 
             m9 = mtm.symmat6(*m6)
             if self.mt_type == "deviatoric":
@@ -560,24 +611,14 @@ class MultiCMTProblem(Problem):
             m0_unscaled = math.sqrt(num.sum(as_arr(m9) ** 2)) / math.sqrt(2.0)
 
             m9 /= m0_unscaled
-            m6 = mtm.to6(m9)
-
-            (
-                d[n + ".rmnn"],
-                d[n + ".rmee"],
-                d[n + ".rmdd"],
-                d[n + ".rmne"],
-                d[n + ".rmnd"],
-                d[n + ".rmed"],
-            ) = m6
-
-        x = self.get_parameter_array(d)
-
-        source = self.get_source(x)
-        for t in self.waveform_targets:
-            for subsource in source.subsources:
-                if t.distance_to(subsource) < self.distance_min:
-                    raise Forbidden()
+            x[im6] = mtm.to6(m9)
+
+        if self.distance_min > 0.0:
+            source = self.get_source(x)
+            for t in self.waveform_targets:
+                for subsource in source.subsources:
+                    if t.distance_to(subsource) < self.distance_min:
+                        raise Forbidden()
 
         return x
 
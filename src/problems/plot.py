@@ -127,10 +127,16 @@ parameter bounds and shows the model space of the optimsation. %s"""
         gms = gms[isort]
         models = models[isort, :]
 
+        target_dependants = history.target_dependants
+        if target_dependants is not None:
+            target_dependants = target_dependants[isort, :]
+
         if misfit_cutoff is not None:
             ibest = gms < misfit_cutoff
             gms = gms[ibest]
             models = models[ibest]
+            if target_dependants is not None:
+                target_dependants = target_dependants[ibest]
 
         nmodels = models.shape[0]
         kwargs = {}
@@ -147,7 +153,7 @@ parameter bounds and shows the model space of the optimsation. %s"""
 
         elif color_parameter in problem.parameter_names:
             ind = problem.name_to_index(color_parameter)
-            icolor = problem.extract(models, ind)
+            icolor = problem.extract(models, ind, target_dependants)
 
         elif color_parameter in history.attribute_names:
             icolor = history.get_attribute(color_parameter)[isort]
@@ -294,8 +300,8 @@ parameter bounds and shows the model space of the optimsation. %s"""
                         rotation=45.0,
                     )
 
-                fx = problem.extract(models, jpar)
-                fy = problem.extract(models, ipar)
+                fx = problem.extract(models, jpar, target_dependants)
+                fy = problem.extract(models, ipar, target_dependants)
 
                 axes.scatter(
                     xpar.scaled(fx),
@@ -417,10 +423,16 @@ Covaricance plots for Jointpar...hopefully ¯\_(ツ)_/¯%s"""
         gms = gms[isort]
         models = models[isort, :]
 
+        target_dependants = history.target_dependants
+        if target_dependants is not None:
+            target_dependants = target_dependants[isort, :]
+
         if misfit_cutoff is not None:
             ibest = gms < misfit_cutoff
             gms = gms[ibest]
             models = models[ibest]
+            if target_dependants is not None:
+                target_dependants = target_dependants[ibest]
 
         nmodels = models.shape[0]
         kwargs = {}
@@ -437,7 +449,7 @@ Covaricance plots for Jointpar...hopefully ¯\_(ツ)_/¯%s"""
 
         elif color_parameter in problem.parameter_names:
             ind = problem.name_to_index(color_parameter)
-            icolor = problem.extract(models, ind)
+            icolor = problem.extract(models, ind, target_dependants)
 
         elif color_parameter in history.attribute_names:
             icolor = history.get_attribute(color_parameter)[isort]
@@ -487,8 +499,8 @@ Covaricance plots for Jointpar...hopefully ¯\_(ツ)_/¯%s"""
             ypar = problem.combined[ipar]
             for jselected in range(iselected):
                 jpar = smap[jselected]
-                fx = problem.extract(models, jpar)
-                fy = problem.extract(models, ipar)
+                fx = problem.extract(models, jpar, target_dependants)
+                fy = problem.extract(models, ipar, target_dependants)
 
                 covars.append(num.corrcoef((fx, fy))[0, 1])
 
@@ -561,8 +573,8 @@ Covaricance plots for Jointpar...hopefully ¯\_(ツ)_/¯%s"""
                     )
 
                 covar = covars.pop(0)
-                fx = problem.extract(models, jpar)
-                fy = problem.extract(models, ipar)
+                fx = problem.extract(models, jpar, target_dependants)
+                fy = problem.extract(models, ipar, target_dependants)
 
                 covar = num.corrcoef((fx, fy))[0, 1]
 
@@ -676,12 +688,18 @@ space.
             problem.combined[smap[iselected]].name for iselected in range(nselected)
         ]
 
-        rstats = make_stats(problem, models, misfits, pnames=pnames)
+        rstats = make_stats(
+            problem,
+            models,
+            misfits,
+            pnames=pnames,
+            target_dependants=history.target_dependants,
+        )
 
         for iselected in range(nselected):
             ipar = smap[iselected]
             par = problem.combined[ipar]
-            vs = problem.extract(models, ipar)
+            vs = problem.extract(models, ipar, history.target_dependants)
             vmin, vmax = bounds[ipar]
 
             fig = plt.figure(figsize=figsize)
@@ -14,7 +14,7 @@ from grond.meta import (
     Forbidden,
 )
 
-from ..base import Problem, ProblemConfig
+from ..base import Problem, ProblemConfig, SubsourceParameterMap
 
 guts_prefix = "grond"
 logger = logging.getLogger("grond.problems.rectangular.problem")
@@ -221,6 +221,7 @@ class MultiRectangularProblem(Problem):
 
         self.problem_parameters = parameters
         self.dependants = dependants
+        self._parameter_map = None
 
     def get_range(self, k):
         try:
@@ -230,22 +231,36 @@ class MultiRectangularProblem(Problem):
         except (IndexError, KeyError):
             raise GrondError("Invalid range key: %s" % k)
 
+    def get_parameter_map(self):
+        if self._parameter_map is None:
+            self._parameter_map = SubsourceParameterMap(
+                self.base_source,
+                self.parameters,
+                lambda name, k: self.get_range("." + k),
+            )
+
+        return self._parameter_map
+
     def get_source(self, x):
-        d = self.get_parameter_dict(x)
-        subsources = []
-        for source in self.base_source.subsources:
-            n = source.name
-            p = {}
-            for k in source.keys():
-                if n + "." + k in d:
-                    p[k] = float(
-                        self.get_range("." + k).make_relative(source[k], d[n + "." + k])
-                    )
+        return self.get_sources(num.asarray(x)[num.newaxis, :])[0]
+
+    def get_sources(self, xs):
+        xs = num.asarray(xs, dtype=num.float64)
+        pmap = self.get_parameter_map()
+
+        subsources_many = []
+        for isub in range(pmap.nsubsources):
+            keys, values = pmap.get_attributes(xs, isub)
+            subsources_many.append(
+                pmap.clone_subsources(
+                    isub, [dict(zip(keys, vals)) for vals in values.tolist()]
+                )
+            )
 
-            csource = source.clone(**p)
-            subsources.append(csource)
-        source = self.base_source.clone(subsources=subsources)
-        return source
+        return [
+            self.base_source.clone(subsources=list(subsources))
+            for subsources in zip(*subsources_many)
+        ]
 
     def pack(self, source):
         xs = []
@@ -68,12 +68,15 @@ class MisfitTarget(Object):
     def __init__(self, **kwargs):
         Object.__init__(self, **kwargs)
         self.parameters = []
+        self.dependants = []
 
         self._ds = None
+        self._travel_times = None
         self._result_mode = "sparse"
 
         self._combined_weight = None
         self._target_parameters = None
+        self._target_dependants = None
         self._target_ranges = None
 
         self._combined_weight = None
@@ -88,6 +91,21 @@ class MisfitTarget(Object):
     def get_dataset(self):
         return self._ds
 
+    def set_travel_times(self, travel_times):
+        self._travel_times = travel_times
+
+    def get_travel_time(self, engine, timing, source):
+        """
+        Get travel time from *source* to the target.
+
+        Same as :py:meth:`pyrocko.gf.Store.t`, but served from the travel
+        time tables of the problem, if they have been set up.
+        """
+        if self._travel_times is not None and self._travel_times.engine is engine:
+            return self._travel_times.t(timing, source, self)
+
+        return engine.get_store(self.store_id).t(timing, source, self)
+
     def string_id(self):
         return str(self.path)
 
@@ -114,6 +132,14 @@ class MisfitTarget(Object):
                 p.set_groups([self.string_id()])
         return self._target_parameters
 
+    @property
+    def target_dependants(self):
+        if self._target_dependants is None:
+            self._target_dependants = copy.deepcopy(self.dependants)
+            for p in self._target_dependants:
+                p.set_groups([self.string_id()])
+        return self._target_dependants
+
     @property
     def target_ranges(self):
         return {}
@@ -154,6 +180,15 @@ class MisfitTarget(Object):
         nbootstraps = self.bootstrap_residuals.size // self.nmisfits
         return self.bootstrap_residuals.reshape(nbootstraps, self.nmisfits)
 
+    def get_waveform_queries(self, engine, source):
+        """
+        Get the observed waveforms needed to compute the misfit of a source.
+
+        :returns: list of ``(nslc, kwargs)`` pairs, where *kwargs* are the
+            arguments to :py:meth:`grond.dataset.Dataset.get_waveform`
+        """
+        return []
+
     def prepare_modelling(self, engine, source, targets):
         return []
 
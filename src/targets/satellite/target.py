@@ -2,7 +2,7 @@ import logging
 import numpy as num
 
 from pyrocko import gf
-from pyrocko.guts import String, Bool, Dict, List
+from pyrocko.guts import String, Bool, Dict, List, Float
 
 from grond.meta import Parameter, has_get_plot_classes
 from ..base import MisfitConfig, MisfitTarget, MisfitResult, TargetGroup
@@ -17,6 +17,13 @@ class SatelliteMisfitConfig(MisfitConfig):
     optimise_orbital_ramp = Bool.T(
         default=True, help="Switch to account for a linear orbital ramp or not"
     )
+    solve_orbital_ramp = Bool.T(
+        default=False,
+        help="Instead of sampling offset and ramp as parameters of the "
+        "problem, solve for their best fitting values by weighted linear "
+        "least squares for each forward model. They are then reported as "
+        "dependants of the problem.",
+    )
     ranges = Dict.T(
         String.T(),
         gf.Range.T(),
@@ -128,6 +135,11 @@ class SatelliteMisfitResult(gf.Result, MisfitResult):
     statics_obs = Dict.T(
         optional=True, help="Observed static displacement for a target."
     )
+    offset = Float.T(optional=True, help="Solved offset [m].")
+    ramp_north = Float.T(
+        optional=True, help="Solved gradient in north direction [m/m]."
+    )
+    ramp_east = Float.T(optional=True, help="Solved gradient in east direction [m/m].")
 
 
 @has_get_plot_classes
@@ -160,10 +172,14 @@ class SatelliteMisfitTarget(gf.SatelliteTarget, MisfitTarget):
         MisfitTarget.__init__(self, **kwargs)
         if not self.misfit_config.optimise_orbital_ramp:
             self.parameters = []
+        elif self.misfit_config.solve_orbital_ramp:
+            self.parameters = []
+            self.dependants = self.available_parameters
         else:
             self.parameters = self.available_parameters
 
         self.parameter_values = {}
+        self._orbital_ramp_solver = None
 
     @property
     def target_ranges(self):
@@ -183,6 +199,25 @@ class SatelliteMisfitTarget(gf.SatelliteTarget, MisfitTarget):
     def scene(self):
         return self._ds.get_kite_scene(self.scene_id)
 
+    def get_orbital_ramp_solver(self):
+        """
+        Get design matrix and weighted least squares solver of the ramp.
+
+        The columns of the design matrix correspond to the available
+        parameters, ``offset``, ``ramp_north`` and ``ramp_east``. The solver
+        maps residuals to the coefficients minimising the weighted L2 misfit.
+        """
+        if self._orbital_ramp_solver is None:
+            distances = self.scene.quadtree.leaf_center_distance
+            design = num.column_stack(
+                [num.ones(distances.shape[0]), distances[:, 1], distances[:, 0]]
+            )
+            weights = self.get_combined_weight()
+            solver = num.linalg.pinv(design * weights[:, num.newaxis]) * weights
+            self._orbital_ramp_solver = design, solver
+
+        return self._orbital_ramp_solver
+
     def post_process(self, engine, source, statics):
         """Applies the objective function.
 
@@ -197,16 +232,25 @@ class SatelliteMisfitTarget(gf.SatelliteTarget, MisfitTarget):
 
         obs = quadtree.leaf_medians
 
+        ramp = None
         if self.misfit_config.optimise_orbital_ramp:
-            stat_level = num.full_like(obs, self.parameter_values["offset"])
+            if self.misfit_config.solve_orbital_ramp:
+                design, solver = self.get_orbital_ramp_solver()
+                ramp = solver.dot(obs - statics["displacement.los"])
+                stat_level = design.dot(ramp)
+
+            else:
+                stat_level = num.full_like(obs, self.parameter_values["offset"])
+
+                stat_level += (
+                    quadtree.leaf_center_distance[:, 0]
+                    * self.parameter_values["ramp_east"]
+                )
+                stat_level += (
+                    quadtree.leaf_center_distance[:, 1]
+                    * self.parameter_values["ramp_north"]
+                )
 
-            stat_level += (
-                quadtree.leaf_center_distance[:, 0] * self.parameter_values["ramp_east"]
-            )
-            stat_level += (
-                quadtree.leaf_center_distance[:, 1]
-                * self.parameter_values["ramp_north"]
-            )
             statics["displacement.los"] += stat_level
 
         stat_syn = statics["displacement.los"]
@@ -222,6 +266,9 @@ class SatelliteMisfitTarget(gf.SatelliteTarget, MisfitTarget):
         mf = num.vstack([misfit_value, misfit_norm]).T
         result = SatelliteMisfitResult(misfits=mf)
 
+        if ramp is not None:
+            result.offset, result.ramp_north, result.ramp_east = map(float, ramp)
+
         if self._result_mode == "full":
             result.statics_syn = statics
             result.statics_obs = quadtree.leaf_medians
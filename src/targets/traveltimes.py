@@ -0,0 +1,247 @@
+"""
+Vectorised travel time evaluation for fixed receivers and moving sources.
+
+During an optimisation, the receivers are fixed while the sources move. A
+:py:class:`TravelTimeTable` evaluates a timing definition for all of its
+receivers at once, using vectorised distance computation and stored phase
+interpolation, and remembers the results for the most recent source
+locations. Per-target queries for the same source are then simple lookups.
+"""
+
+import logging
+from collections import OrderedDict
+
+import numpy as num
+
+from pyrocko import gf, orthodrome as od
+
+guts_prefix = "grond"
+logger = logging.getLogger("grond.targets.traveltimes")
+
+
+def _location_key(loc):
+    return (loc.lat, loc.lon, loc.north_shift, loc.east_shift, loc.depth)
+
+
+def _stored_phase_id(phase_def):
+    toks = phase_def.split(":", 1)
+    if len(toks) == 1:
+        return toks[0]
+    elif toks[0] == "stored":
+        return toks[1]
+    else:
+        return None
+
+
+class TravelTimeTable(object):
+    """
+    Travel times of one timing definition from a store to a set of receivers.
+
+    Results are the same as those of :py:meth:`pyrocko.gf.Store.t`. Timings
+    which are not made of stored phases only, as well as stores other than
+    :py:class:`pyrocko.gf.ConfigTypeA` and :py:class:`pyrocko.gf.ConfigTypeB`
+    ones, are passed on to :py:meth:`pyrocko.gf.Store.t` one by one.
+
+    :param store: :py:class:`pyrocko.gf.Store` instance
+    :param timing: :py:class:`pyrocko.gf.Timing` or its string definition
+    """
+
+    nsources_max = 16
+
+    def __init__(self, store, timing):
+        if not isinstance(timing, gf.Timing):
+            timing = gf.Timing(timing)
+
+        self.store = store
+        self.timing = timing
+
+        phase_ids = [_stored_phase_id(phase_def) for phase_def in timing.phase_defs]
+
+        self._phase_ids = phase_ids
+        self._vectorised = (
+            isinstance(store.config, (gf.ConfigTypeA, gf.ConfigTypeB))
+            and None not in phase_ids
+            and not (timing.offset_is == "slowness" and timing.offset != 0.0)
+        )
+
+        self._keys = []
+        self._ireceivers = {}
+        self._coordinates = None
+        self._times = OrderedDict()
+
+    def add_receivers(self, receivers):
+        for receiver in receivers:
+            k = _location_key(receiver)
+            if k not in self._ireceivers:
+                self._ireceivers[k] = len(self._keys)
+                self._keys.append((k, receiver.effective_latlon))
+                self._coordinates = None
+                self._times.clear()
+
+    def _get_coordinates(self):
+        if self._coordinates is None:
+            self._coordinates = dict(
+                (name, num.array(values, dtype=float))
+                for (name, values) in zip(
+                    ("lats", "lons", "north_shifts", "east_shifts", "depths"),
+                    zip(*[k for (k, _) in self._keys]),
+                )
+            )
+
+            self._coordinates["effective_latlons"] = num.array(
+                [latlon for (_, latlon) in self._keys], dtype=float
+            )
+
+        return self._coordinates
+
+    def _get_distances(self, source):
+        c = self._get_coordinates()
+        same = num.logical_and(c["lats"] == source.lat, c["lons"] == source.lon)
+
+        distances = num.empty(same.size)
+        distances[same] = num.sqrt(
+            (source.north_shift - c["north_shifts"][same]) ** 2
+            + (source.east_shift - c["east_shifts"][same]) ** 2
+        )
+
+        other = num.logical_not(same)
+        if num.any(other):
+            slat, slon = source.effective_latlon
+            latlons = c["effective_latlons"][other]
+            distances[other] = od.distance_accurate50m_numpy(
+                slat, slon, latlons[:, 0], latlons[:, 1]
+            )
+
+        return distances
+
+    def _compute(self, source):
+        n = len(self._keys)
+        distances = self._get_distances(source)
+        if isinstance(self.store.config, gf.ConfigTypeA):
+            args = num.column_stack([num.full(n, source.depth), distances])
+        else:
+            args = num.column_stack(
+                [
+                    self._get_coordinates()["depths"],
+                    num.full(n, source.depth),
+                    distances,
+                ]
+            )
+
+        timing = self.timing
+        out_of_bounds = num.zeros(n, dtype=bool)
+        if not timing.phase_defs:
+            return num.full(n, timing.offset), out_of_bounds
+
+        times = num.full(n, num.nan)
+        for phase_id in self._phase_ids:
+            sptree = self.store.get_stored_phase(phase_id)
+            inside = num.all(
+                num.logical_and(
+                    sptree.xbounds[:, 0] <= args, args <= sptree.xbounds[:, 1]
+                ),
+                axis=1,
+            )
+            out_of_bounds |= num.logical_not(inside)
+
+            times_phase = num.full(n, num.nan)
+            if num.any(inside):
+                times_phase[inside] = sptree.interpolate_many(args[inside])
+
+            if timing.select == "first":
+                times = num.fmin(times, times_phase)
+            elif timing.select == "last":
+                times = num.fmax(times, times_phase)
+            else:
+                times = num.where(num.isnan(times), times_phase, times)
+
+        if timing.offset_is == "percent":
+            times = times * (1.0 + timing.offset / 100.0)
+        else:
+            times = times + timing.offset
+
+        return times, out_of_bounds
+
+    def get_times(self, source):
+        """
+        Get travel times to all receivers, in the order they were added.
+
+        :returns: ``(times, out_of_bounds)``, where undefined times are NaN
+            and *out_of_bounds* flags receivers outside of the stored tables
+        """
+        k = _location_key(source)
+        if k not in self._times:
+            self._times[k] = self._compute(source)
+            while len(self._times) > self.nsources_max:
+                self._times.popitem(last=False)
+        else:
+            self._times.move_to_end(k)
+
+        return self._times[k]
+
+    def t(self, source, receiver):
+        """
+        Get travel time from *source* to *receiver*.
+
+        Like :py:meth:`pyrocko.gf.Store.t`, ``None`` is returned if the
+        timing is undefined and :py:exc:`pyrocko.gf.OutOfBounds` is raised if
+        the geometry is not covered by the stored tables.
+        """
+        if not self._vectorised:
+            return self.store.t(self.timing, source, receiver)
+
+        k = _location_key(receiver)
+        if k not in self._ireceivers:
+            self.add_receivers([receiver])
+
+        i = self._ireceivers[k]
+        times, out_of_bounds = self.get_times(source)
+        if out_of_bounds[i]:
+            raise gf.OutOfBounds(
+                self.store.config.make_indexing_args1(source, receiver)
+            )
+
+        if num.isnan(times[i]):
+            return None
+
+        return float(times[i])
+
+
+class TravelTimes(object):
+    """
+    Travel time tables of a problem's targets, by store and timing.
+
+    Tables are created on first use and hold the locations of all receivers
+    given here which use the respective store.
+
+    :param engine: :py:class:`pyrocko.gf.LocalEngine` instance
+    :param receivers: targets or other location objects with a ``store_id``
+    """
+
+    def __init__(self, engine, receivers=()):
+        self.engine = engine
+        self._receivers = list(receivers)
+        self._tables = {}
+
+    def get_table(self, store_id, timing):
+        k = (store_id, str(timing))
+        if k not in self._tables:
+            table = TravelTimeTable(self.engine.get_store(store_id), timing)
+            table.add_receivers(
+                receiver
+                for receiver in self._receivers
+                if getattr(receiver, "store_id", None) == store_id
+            )
+            self._tables[k] = table
+
+        return self._tables[k]
+
+    def t(self, timing, source, receiver):
+        """Get travel time, like :py:meth:`pyrocko.gf.Store.t`."""
+        return self.get_table(receiver.store_id, timing).t(source, receiver)
+
+
+__all__ = """
+    TravelTimeTable
+    TravelTimes
+""".split()
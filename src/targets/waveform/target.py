@@ -78,6 +78,14 @@ class WaveformMisfitConfig(MisfitConfig):
         "``autoshift_penalty_max * normalization_factor * tautoshift**2 "
         "/ tautoshift_max**2``",
     )
+    batch_misfits = Bool.T(
+        default=False,
+        help="If set, misfits of targets in the time, envelope, absolute and "
+        "(log) frequency domains, without autoshift, are computed together "
+        "for all such targets and models of an evaluation, using stacked "
+        "arrays. Only applies when no processed traces are requested for "
+        "plotting.",
+    )
 
     ranges = {}
 
@@ -288,10 +296,22 @@ class WaveformMisfitTarget(gf.Target, MisfitTarget):
 
     can_bootstrap_weights = True
 
+    nprocessed_obs_cache_max = 16
+    nsynthetic_filters_max = 4
+    batched_domains = (
+        "time_domain",
+        "envelope",
+        "absolute",
+        "frequency_domain",
+        "log_frequency_domain",
+    )
+
     def __init__(self, **kwargs):
         gf.Target.__init__(self, **kwargs)
         MisfitTarget.__init__(self, **kwargs)
         self._piggyback_subtargets = []
+        self._processed_obs_cache = {}
+        self._synthetic_filters = {}
 
     def string_id(self):
         return ".".join(x for x in (self.path,) + self.codes)
@@ -329,10 +349,9 @@ class WaveformMisfitTarget(gf.Target, MisfitTarget):
         return self._combined_weight
 
     def get_taper_params(self, engine, source):
-        store = engine.get_store(self.store_id)
         config = self.misfit_config
-        tmin_fit = source.time + store.t(config.tmin, source, self)
-        tmax_fit = source.time + store.t(config.tmax, source, self)
+        tmin_fit = source.time + self.get_travel_time(engine, config.tmin, source)
+        tmax_fit = source.time + self.get_travel_time(engine, config.tmax, source)
         if config.fmin > 0.0:
             tfade = 1.0 / config.fmin
         else:
@@ -348,6 +367,120 @@ class WaveformMisfitTarget(gf.Target, MisfitTarget):
     def get_backazimuth_for_waveform(self):
         return backazimuth_for_waveform(self.azimuth, self.codes)
 
+    def set_dataset(self, ds):
+        MisfitTarget.set_dataset(self, ds)
+        self._processed_obs_cache = {}
+
+    def get_processed_obs(self, tr_obs, taper, domain, obs_key):
+        """
+        Get tapered and transformed observed trace and spectrum.
+
+        Results are memoised by *obs_key*, which must identify the observed
+        trace, together with the taper and *domain*. The taper corners are
+        used as exact floats in the key, so the memo is only reused for
+        identical tapers, e.g. for models sharing origin time and location.
+        Only the most recent ``nprocessed_obs_cache_max`` entries are kept.
+        """
+        k = obs_key + (taper.a, taper.b, taper.c, taper.d, domain)
+        cache = self._processed_obs_cache
+        if k not in cache:
+            tmin, tmax = taper.time_span()
+            cache[k] = _process(tr_obs, tmin, tmax, taper, domain)
+            while len(cache) > self.nprocessed_obs_cache_max:
+                del cache[next(iter(cache))]
+
+        return cache[k]
+
+    def get_synthetic_filter(self, ndata, deltat, tfade):
+        """
+        Get the filter applied to synthetic traces of a given length.
+
+        Returns the FFT length, the time domain fade taper, the tapered
+        spectral response for the target's frequency limits and quantity, and
+        a work buffer of the FFT length. Filters are kept for the most recent
+        ``nsynthetic_filters_max`` trace lengths.
+        """
+        k = (ndata, deltat, tfade)
+        filters = self._synthetic_filters
+        if k not in filters:
+            config = self.misfit_config
+            if config.quantity == "displacement":
+                syn_resp = None
+            elif config.quantity == "velocity":
+                syn_resp = trace.DifferentiationResponse(1)
+            elif config.quantity == "acceleration":
+                syn_resp = trace.DifferentiationResponse(2)
+            else:
+                raise GrondError("Unsupported quantity: %s" % config.quantity)
+
+            freqlimits = self.get_freqlimits()
+            ntrans = trace.nextpow2(ndata * 1.2)
+            deltaf = 1.0 / (deltat * ntrans)
+            nfreqs = ntrans // 2 + 1
+            transfer = num.ones(nfreqs, dtype=complex)
+            if syn_resp is not None:
+                hi = trace.snapper(nfreqs, deltaf)
+                kmin, kmax = hi(freqlimits[0]), hi(freqlimits[3])
+                transfer[kmin:kmax] = syn_resp.evaluate(num.arange(kmin, kmax) * deltaf)
+
+            coeffs = trace.costaper(*freqlimits, nfreqs, deltaf) * transfer
+            coeffs[0] = 0.0
+
+            taper = trace.costaper(
+                0.0, tfade, deltat * (ndata - 1) - tfade, deltat * ndata, ndata, deltat
+            )
+
+            filters[k] = (ntrans, taper, coeffs, num.zeros(ntrans))
+            while len(filters) > self.nsynthetic_filters_max:
+                del filters[next(iter(filters))]
+
+        return filters[k]
+
+    def filter_synthetic(self, tr_syn, tmin, tmax, tfade):
+        """
+        Extend, filter and cut a synthetic trace in place.
+
+        Equivalent to extending the trace to *tmin* - *tmax*, applying
+        :py:meth:`pyrocko.trace.Trace.transfer` with the target's frequency
+        limits and quantity and fade time *tfade*, and cutting the result back
+        to *tmin* - *tmax*, but with the filter taken from
+        :py:meth:`get_synthetic_filter`.
+        """
+        tr_syn.extend(tmin, tmax, fillmethod="repeat")
+        if tr_syn.tmax - tr_syn.tmin <= tfade * 2.0:
+            raise trace.TraceTooShort(
+                "Trace %s.%s.%s.%s too short for fading length setting. "
+                "trace length = %g, fading length = %g"
+                % (tr_syn.nslc_id + (tr_syn.tmax - tr_syn.tmin, tfade))
+            )
+
+        data = tr_syn.ydata
+        ndata = data.size
+        ntrans, taper, coeffs, data_pad = self.get_synthetic_filter(
+            ndata, tr_syn.deltat, tfade
+        )
+
+        data_pad[:ndata] = data
+        data_pad[:ndata] -= data.mean()
+        data_pad[:ndata] *= taper
+        data_pad[ndata:] = 0.0
+
+        fdata = num.fft.rfft(data_pad)
+        fdata *= coeffs
+        tr_syn.set_ydata(num.fft.irfft(fdata, ntrans)[:ndata])
+
+        try:
+            tr_syn.chop(tr_syn.tmin + tfade, tr_syn.tmax - tfade)
+        except trace.NoData:
+            raise trace.TraceTooShort(
+                "Trace %s.%s.%s.%s too short for fading length setting. "
+                "trace length = %g, fading length = %g"
+                % (tr_syn.nslc_id + (tr_syn.tmax - tr_syn.tmin, tfade))
+            )
+
+        tr_syn.chop(tmin, tmax)
+        return tr_syn
+
     @property
     def backazimuth(self):
         return self.azimuth - 180.0
@@ -369,8 +502,9 @@ class WaveformMisfitTarget(gf.Target, MisfitTarget):
         ds = self.get_dataset()
 
         if config.pick_synthetic_traveltime and config.pick_phasename:
-            store = engine.get_store(self.store_id)
-            tsyn = source.time + store.t(config.pick_synthetic_traveltime, source, self)
+            tsyn = source.time + self.get_travel_time(
+                engine, config.pick_synthetic_traveltime, source
+            )
 
             marker = ds.get_pick(source.name, self.codes[:3], config.pick_phasename)
 
@@ -390,7 +524,93 @@ class WaveformMisfitTarget(gf.Target, MisfitTarget):
 
         return tmin_obs, tmax_obs
 
+    def get_waveform_kwargs(self, tmin_fit, tmax_fit, tfade, tobs_shift, deltat):
+        config = self.misfit_config
+        return dict(
+            quantity=config.quantity,
+            tinc_cache=1.0 / (config.fmin or 0.1 * config.fmax),
+            tmin=tmin_fit + tobs_shift - tfade,
+            tmax=tmax_fit + tobs_shift + tfade,
+            tfade=tfade,
+            freqlimits=self.get_freqlimits(),
+            deltat=deltat,
+            cache=True,
+            backazimuth=self.get_backazimuth_for_waveform(),
+        )
+
+    def get_waveform_queries(self, engine, source):
+        origin = self.get_origin_source(source)
+        tmin_fit, tmax_fit, tfade, _ = self.get_taper_params(engine, origin)
+
+        tobs, tsyn = self.get_pick_shift(engine, origin)
+        if None not in (tobs, tsyn):
+            tobs_shift = tobs - tsyn
+        else:
+            tobs_shift = 0.0
+
+        if self.sample_rate is not None:
+            deltat = 1.0 / self.sample_rate
+        else:
+            deltat = engine.get_store(self.store_id).config.deltat
+
+        return [
+            (
+                self.codes,
+                self.get_waveform_kwargs(tmin_fit, tmax_fit, tfade, tobs_shift, deltat),
+            )
+        ]
+
+    def can_batch_misfit(self):
+        """
+        Check if the misfit can be computed with :py:func:`misfit_many`.
+        """
+        config = self.misfit_config
+        return (
+            config.batch_misfits
+            and self._result_mode == "sparse"
+            and config.domain in self.batched_domains
+            and config.tautoshift_max == 0.0
+            and not self._piggyback_subtargets
+        )
+
     def post_process(self, engine, source, tr_syn):
+        config = self.misfit_config
+
+        tr_obs, tr_syn, taper, processed_obs, tobs_shift, tsyn = self.prepare_misfit(
+            engine, source, tr_syn
+        )
+
+        mr = misfit(
+            tr_obs,
+            tr_syn,
+            taper=taper,
+            domain=config.domain,
+            exponent=config.norm_exponent,
+            flip=self.flip_norm,
+            result_mode=self._result_mode,
+            tautoshift_max=config.tautoshift_max,
+            autoshift_penalty_max=config.autoshift_penalty_max,
+            subtargets=self._piggyback_subtargets,
+            processed_obs=processed_obs,
+        )
+
+        self._piggyback_subtargets = []
+
+        mr.tobs_shift = float(tobs_shift)
+        mr.tsyn_pick = float_or_none(tsyn)
+
+        return mr
+
+    def prepare_misfit(self, engine, source, tr_syn):
+        """
+        Get the inputs of the misfit calculation for a synthetic trace.
+
+        :returns: tuple ``(tr_obs, tr_syn, taper, processed_obs, tobs_shift,
+            tsyn)`` with the observed and the filtered synthetic trace, the
+            taper, the processed observed trace and spectrum (only in
+            ``'sparse'`` result mode, ``None`` otherwise), the time shift
+            applied to the observations and the synthetic pick time
+        """
         origin = self.get_origin_source(source)
 
         tr_syn = tr_syn.pyrocko_trace()
@@ -409,27 +629,10 @@ class WaveformMisfitTarget(gf.Target, MisfitTarget):
         else:
             tobs_shift = 0.0
 
-        tr_syn.extend(
-            tmin_fit - tfade * 2.0, tmax_fit + tfade * 2.0, fillmethod="repeat"
+        tr_syn = self.filter_synthetic(
+            tr_syn, tmin_fit - tfade * 2.0, tmax_fit + tfade * 2.0, tfade
         )
 
-        freqlimits = self.get_freqlimits()
-
-        if config.quantity == "displacement":
-            syn_resp = None
-        elif config.quantity == "velocity":
-            syn_resp = trace.DifferentiationResponse(1)
-        elif config.quantity == "acceleration":
-            syn_resp = trace.DifferentiationResponse(2)
-        else:
-            GrondError("Unsupported quantity: %s" % config.quantity)
-
-        tr_syn = tr_syn.transfer(
-            freqlimits=freqlimits, tfade=tfade, transfer_function=syn_resp
-        )
-
-        tr_syn.chop(tmin_fit - 2 * tfade, tmax_fit + 2 * tfade)
-
         tmin_obs, tmax_obs = self.get_cutout_timespan(
             tmin_fit + tobs_shift, tmax_fit + tobs_shift, tfade
         )
@@ -437,42 +640,37 @@ class WaveformMisfitTarget(gf.Target, MisfitTarget):
         try:
             tr_obs = ds.get_waveform(
                 nslc,
-                quantity=config.quantity,
-                tinc_cache=1.0 / (config.fmin or 0.1 * config.fmax),
-                tmin=tmin_fit + tobs_shift - tfade,
-                tmax=tmax_fit + tobs_shift + tfade,
-                tfade=tfade,
-                freqlimits=freqlimits,
-                deltat=tr_syn.deltat,
-                cache=True,
-                backazimuth=self.get_backazimuth_for_waveform(),
+                **self.get_waveform_kwargs(
+                    tmin_fit, tmax_fit, tfade, tobs_shift, tr_syn.deltat
+                )
             )
 
             if tobs_shift != 0.0:
                 tr_obs = tr_obs.copy()
                 tr_obs.shift(-tobs_shift)
 
-            mr = misfit(
-                tr_obs,
-                tr_syn,
-                taper=trace.CosTaper(
-                    tmin_fit - tfade_taper, tmin_fit, tmax_fit, tmax_fit + tfade_taper
-                ),
-                domain=config.domain,
-                exponent=config.norm_exponent,
-                flip=self.flip_norm,
-                result_mode=self._result_mode,
-                tautoshift_max=config.tautoshift_max,
-                autoshift_penalty_max=config.autoshift_penalty_max,
-                subtargets=self._piggyback_subtargets,
+            taper = trace.CosTaper(
+                tmin_fit - tfade_taper, tmin_fit, tmax_fit, tmax_fit + tfade_taper
             )
 
-            self._piggyback_subtargets = []
-
-            mr.tobs_shift = float(tobs_shift)
-            mr.tsyn_pick = float_or_none(tsyn)
-
-            return mr
+            if self._result_mode == "sparse":
+                processed_obs = self.get_processed_obs(
+                    tr_obs,
+                    taper,
+                    config.domain,
+                    (
+                        tmin_obs,
+                        tmax_obs,
+                        tobs_shift,
+                        tr_obs.tmin,
+                        tr_obs.data_len(),
+                        tr_obs.deltat,
+                    ),
+                )
+            else:
+                processed_obs = None
+
+            return tr_obs, tr_syn, taper, processed_obs, tobs_shift, tsyn
 
         except NotFound as e:
             logger.debug(str(e))
@@ -498,6 +696,106 @@ class WaveformMisfitTarget(gf.Target, MisfitTarget):
     def add_piggyback_subtarget(self, subtarget):
         self._piggyback_subtargets.append(subtarget)
 
+    def pop_piggyback_subtargets(self):
+        subtargets = self._piggyback_subtargets
+        self._piggyback_subtargets = []
+        return subtargets
+
+    def set_piggyback_subtargets(self, subtargets):
+        self._piggyback_subtargets = list(subtargets)
+
+
+def _shift_cut(a, b, ishift):
+    if ishift < 0:
+        return a[-ishift:], b[:ishift]
+    elif ishift > 0:
+        return a[:-ishift], b[ishift:]
+    else:
+        return a, b
+
+
+def _autoshift_lx_norms(a, b, nshift_max, exponent, nelements_block=2**16):
+    """
+    Get Lx norms of *a* against *b* for all shifts up to +/- *nshift_max*.
+
+    Equivalent to calling :py:func:`pyrocko.trace.Lx_norm` on the shifted
+    cuts from :py:func:`_shift_cut` for every shift in ``range(-nshift_max,
+    nshift_max + 1)``. For ``exponent == 2``, the cross terms are computed at
+    once by FFT cross-correlation and the energies from cumulative sums.
+    Shifts within rounding error of the minimum are then re-evaluated
+    directly. For other exponents, the shifted cuts are evaluated in blocks
+    of strided sliding windows.
+
+    :returns: tuple ``(ms, ns)`` of arrays indexed by
+        ``ishift + nshift_max``
+    """
+
+    nsamples = a.size
+    assert b.size == nsamples and 0 <= nshift_max < nsamples
+
+    ishifts = num.arange(-nshift_max, nshift_max + 1)
+    ipos = num.maximum(ishifts, 0)
+    ineg = num.minimum(ishifts, 0)
+
+    if exponent == 2:
+        nfft = trace.nextpow2(nsamples + nshift_max)
+        cc = num.fft.irfft(
+            num.conj(num.fft.rfft(a, nfft)) * num.fft.rfft(b, nfft), nfft
+        )[ishifts]
+
+        ea = num.concatenate(([0.0], num.cumsum(a**2)))
+        eb = num.concatenate(([0.0], num.cumsum(b**2)))
+        ea = ea[nsamples - ipos] - ea[-ineg]
+        eb = eb[nsamples + ineg] - eb[ipos]
+
+        ms = ea + eb - 2.0 * cc
+        ns = num.sqrt(eb)
+
+        tolerance = 1e-10 * num.max(ea + eb)
+        for i in num.nonzero(ms <= num.min(ms) + tolerance)[0]:
+            ms[i], ns[i] = trace.Lx_norm(*_shift_cut(a, b, ishifts[i]), norm=2)
+            ms[i] **= 2
+
+        return num.sqrt(num.maximum(ms, 0.0)), ns
+
+    # windows[i, j] = b[j + ishifts[i]], zero where out of range
+    b_padded = num.zeros(nsamples + 2 * nshift_max)
+    b_padded[nshift_max : nshift_max + nsamples] = b
+    windows = num.lib.stride_tricks.as_strided(
+        b_padded,
+        shape=(ishifts.size, nsamples),
+        strides=(b_padded.strides[0], b_padded.strides[0]),
+        writeable=False,
+    )
+
+    ms = num.empty(ishifts.size)
+    nblock = max(1, nelements_block // nsamples)
+    for i in range(0, ishifts.size, nblock):
+        if exponent == 1:
+            ms[i : i + nblock] = num.sum(num.abs(windows[i : i + nblock] - a), axis=1)
+        else:
+            ms[i : i + nblock] = num.sum(
+                num.abs(windows[i : i + nblock] - a) ** exponent, axis=1
+            )
+
+    if exponent == 1:
+        ca = num.concatenate(([0.0], num.cumsum(num.abs(a))))
+        cb = num.concatenate(([0.0], num.cumsum(num.abs(b))))
+    else:
+        ca = num.concatenate(([0.0], num.cumsum(num.abs(a) ** exponent)))
+        cb = num.concatenate(([0.0], num.cumsum(num.abs(b) ** exponent)))
+
+    # remove contributions of a where b is out of range
+    ms -= ca[nsamples] - ca[nsamples - ipos] + ca[-ineg]
+    num.maximum(ms, 0.0, out=ms)
+    ns = cb[nsamples + ineg] - cb[ipos]
+
+    if exponent != 1:
+        ms **= 1.0 / exponent
+        ns **= 1.0 / exponent
+
+    return ms, ns
+
 
 def misfit(
     tr_obs,
@@ -510,6 +808,7 @@ def misfit(
     flip,
     result_mode="sparse",
     subtargets=[],
+    processed_obs=None,
 ):
     """
     Calculate misfit between observed and synthetic trace.
@@ -530,6 +829,10 @@ tautoshift**2 / tautoshift_max**2``
         computed against *tr_syn* rather than *tr_obs*
     :param result_mode: ``'full'``, include traces and spectra or ``'sparse'``,
         include only misfit and normalization factor in result
+    :param processed_obs: if given, tuple with the already tapered and
+        transformed observed trace and spectrum, as returned by
+        :py:meth:`WaveformMisfitTarget.get_processed_obs`, which are then
+        used instead of processing *tr_obs*. They are not modified.
 
     :returns: object of type :py:class:`WaveformMisfitResult`
     """
@@ -538,7 +841,11 @@ tautoshift**2 / tautoshift_max**2``
     deltat = tr_obs.deltat
     tmin, tmax = taper.time_span()
 
-    tr_proc_obs, trspec_proc_obs = _process(tr_obs, tmin, tmax, taper, domain)
+    if processed_obs is None:
+        tr_proc_obs, trspec_proc_obs = _process(tr_obs, tmin, tmax, taper, domain)
+    else:
+        tr_proc_obs, trspec_proc_obs = processed_obs
+
     tr_proc_syn, trspec_proc_syn = _process(tr_syn, tmin, tmax, taper, domain)
 
     piggyback_results = []
@@ -562,26 +869,12 @@ tautoshift**2 / tautoshift_max**2``
         if nshift_max == 0:
             m, n = trace.Lx_norm(a, b, norm=exponent)
         else:
-            mns = []
-            for ishift in range(-nshift_max, nshift_max + 1):
-                if ishift < 0:
-                    a_cut = a[-ishift:]
-                    b_cut = b[:ishift]
-                elif ishift == 0:
-                    a_cut = a
-                    b_cut = b
-                elif ishift > 0:
-                    a_cut = a[:-ishift]
-                    b_cut = b[ishift:]
-
-                mns.append(trace.Lx_norm(a_cut, b_cut, norm=exponent))
-
-            ms, ns = num.array(mns).T
+            ms, _ = _autoshift_lx_norms(a, b, nshift_max, exponent)
 
             iarg = num.argmin(ms)
             tshift = (iarg - nshift_max) * deltat
 
-            m, n = ms[iarg], ns[iarg]
+            m, n = trace.Lx_norm(*_shift_cut(a, b, iarg - nshift_max), norm=exponent)
             m += autoshift_penalty_max * n * tshift**2 / tautoshift_max**2
 
     elif domain == "cc_max_norm":
@@ -698,6 +991,208 @@ def _process(tr, tmin, tmax, taper, domain):
     return tr_proc, trspec_proc
 
 
+def _stack_padded(arrays, ncols, edges=False, ishifts=None):
+    """
+    Stack 1D arrays into rows of a 2D array with *ncols* columns.
+
+    Rows are padded with zeros or, if *edges* is set, with their first and
+    last values. Row ``i`` starts at element ``-ishifts[i]`` of its array.
+    """
+    sizes = num.array([a.size for a in arrays])
+    offsets = num.concatenate(([0], num.cumsum(sizes)[:-1]))
+    if ishifts is None:
+        ishifts = num.zeros(sizes.size, dtype=int)
+
+    j = num.arange(ncols)[num.newaxis, :] - ishifts[:, num.newaxis]
+    flat = num.concatenate(arrays)
+    stacked = flat[
+        offsets[:, num.newaxis] + num.clip(j, 0, sizes[:, num.newaxis] - 1)
+    ].astype(num.float64)
+
+    if not edges:
+        stacked[j >= sizes[:, num.newaxis]] = 0.0
+
+    return stacked
+
+
+def _costaper_many(tapers, x0s, dx, sizes, ncols):
+    """
+    Get weights of cosine tapers, as applied by :py:class:`pyrocko.trace.Taper`.
+
+    Row ``i`` holds the weights of ``tapers[i]`` for ``sizes[i]`` samples
+    starting at ``x0s[i]``, columns beyond are zero.
+    """
+    abcd = num.array([(t.a, t.b, t.c, t.d) for t in tapers], dtype=float)
+    xs = abcd - x0s[:, num.newaxis]
+    ja, jb, jc, jd = num.clip(
+        num.ceil(xs / dx).astype(int), 0, sizes[:, num.newaxis]
+    ).T[:, :, num.newaxis]
+    a, b, c, d = (x[:, num.newaxis] for x in abcd.T)
+    xa, xc = xs[:, 0, num.newaxis], xs[:, 2, num.newaxis]
+
+    j = num.arange(ncols)[num.newaxis, :]
+    weights = num.zeros((len(tapers), ncols))
+    weights[num.logical_and(jb <= j, j < jc)] = 1.0
+
+    mask = num.logical_and(ja <= j, j < jb)
+    if num.any(mask):
+        weights[mask] = 0.5 - 0.5 * num.cos((dx * j - xa) / (b - a) * num.pi)[mask]
+
+    mask = num.logical_and(jc <= j, j < jd)
+    if num.any(mask):
+        weights[mask] = 0.5 + 0.5 * num.cos((dx * j - xc) / (d - c) * num.pi)[mask]
+
+    return weights
+
+
+def _hilbert_many(x):
+    """Hilbert transform of the rows of *x*, as :py:func:`pyrocko.trace.hilbert`."""
+    n = x.shape[1]
+    h = num.zeros(n)
+    if n % 2 == 0:
+        h[0] = h[n // 2] = 1
+        h[1 : n // 2] = 2
+    else:
+        h[0] = 1
+        h[1 : (n + 1) // 2] = 2
+
+    return num.fft.ifft(num.fft.fft(x, n, axis=1) * h, axis=1)
+
+
+def _lx_norms_many(u, v, norm):
+    """Row-wise :py:func:`pyrocko.trace.Lx_norm` of 2D arrays."""
+    if norm == 1:
+        return (num.sum(num.abs(v - u), axis=1), num.sum(num.abs(v), axis=1))
+
+    elif norm == 2:
+        return (
+            num.sqrt(num.sum((v - u) ** 2, axis=1)),
+            num.sqrt(num.sum(v**2, axis=1)),
+        )
+
+    else:
+        return (
+            num.power(num.sum(num.abs(num.power(v - u, norm)), axis=1), 1.0 / norm),
+            num.power(num.sum(num.abs(num.power(v, norm)), axis=1), 1.0 / norm),
+        )
+
+
+def _process_many(trs, tapers, domain, ncols):
+    """
+    Batched version of :py:func:`_process` for traces of equal sampling rate.
+
+    :returns: 2D array with the processed traces as rows, padded with zeros
+        to *ncols* columns, or their spectra for the frequency domains, in
+        which case *ncols* is the FFT length
+    """
+    deltat = trs[0].deltat
+    spans = num.array([taper.time_span() for taper in tapers])
+    itmin_frame = num.floor(spans[:, 0] / deltat).astype(int)
+    nframe = num.ceil(spans[:, 1] / deltat).astype(int) - itmin_frame + 1
+    itmin_tr = num.round(num.array([tr.tmin for tr in trs]) / deltat).astype(int)
+
+    # extended and extracted as by _extend_extract, then tapered
+    data = _stack_padded(
+        [tr.ydata for tr in trs], ncols, edges=True, ishifts=itmin_tr - itmin_frame
+    )
+    data *= _costaper_many(tapers, itmin_frame * deltat, deltat, nframe, ncols)
+
+    if domain == "envelope":
+        return num.abs(_hilbert_many(data))
+
+    elif domain == "absolute":
+        return num.abs(data)
+
+    elif domain in ("frequency_domain", "log_frequency_domain"):
+        return num.fft.rfft(data, axis=1)
+
+    return data
+
+
+def misfit_many(targets, prepared):
+    """
+    Calculate sparse misfit results of many waveform targets at once.
+
+    Batched counterpart of :py:func:`misfit`, for targets which
+    :py:meth:`WaveformMisfitTarget.can_batch_misfit`. Targets sharing sampling
+    rate, domain and norm exponent are processed together, with the traces
+    stacked into 2D arrays. For the envelope domain, traces are additionally
+    grouped by length and for the frequency domains by FFT length. Results
+    agree with those of :py:func:`misfit` up to rounding errors.
+
+    :param targets: list of :py:class:`WaveformMisfitTarget` objects
+    :param prepared: list of the tuples returned by
+        :py:meth:`WaveformMisfitTarget.prepare_misfit` for each target
+    :returns: list of :py:class:`WaveformMisfitResult` objects
+    """
+
+    groups = {}
+    for i, (target, (tr_obs, tr_syn, taper, _, _, _)) in enumerate(
+        zip(targets, prepared)
+    ):
+        trace.assert_same_sampling_rate(tr_obs, tr_syn)
+        config = target.misfit_config
+        deltat = tr_syn.deltat
+        tmin, tmax = taper.time_span()
+        nframe = int(math.ceil(tmax / deltat)) - int(math.floor(tmin / deltat)) + 1
+        if config.domain == "envelope":
+            ncols = nframe
+        elif config.domain in ("frequency_domain", "log_frequency_domain"):
+            ncols = trace.nextpow2(nframe)
+        else:
+            ncols = None
+
+        k = (deltat, config.domain, config.norm_exponent, ncols)
+        groups.setdefault(k, ([], []))
+        groups[k][0].append(i)
+        groups[k][1].append(nframe)
+
+    misfits = num.empty((len(targets), 2))
+    for (deltat, domain, exponent, ncols), (indices, nframes) in groups.items():
+        if ncols is None:
+            ncols = max(nframes)
+
+        a = _process_many(
+            [prepared[i][1] for i in indices],
+            [prepared[i][2] for i in indices],
+            domain,
+            ncols,
+        )
+
+        if domain in ("frequency_domain", "log_frequency_domain"):
+            b = num.array([prepared[i][3][1].ydata for i in indices])
+        else:
+            b = _stack_padded([prepared[i][3][0].ydata for i in indices], ncols)
+
+        flips = num.array([targets[i].flip_norm for i in indices])
+        if num.any(flips):
+            a, b = (
+                num.where(flips[:, num.newaxis], b, a),
+                num.where(flips[:, num.newaxis], a, b),
+            )
+
+        if domain in ("frequency_domain", "log_frequency_domain"):
+            a = num.abs(a)
+            b = num.abs(b)
+
+        if domain == "log_frequency_domain":
+            eps = (num.mean(a, axis=1) + num.mean(b, axis=1)) * 1e-7
+            eps[eps == 0.0] = 1e-7
+            a = num.log(a + eps[:, num.newaxis])
+            b = num.log(b + eps[:, num.newaxis])
+
+        misfits[indices, 0], misfits[indices, 1] = _lx_norms_many(a, b, exponent)
+
+    results = []
+    for (m, n), (_, _, _, _, tobs_shift, tsyn) in zip(misfits, prepared):
+        result = WaveformMisfitResult(misfits=num.array([[m, n]], dtype=num.float64))
+        result.tobs_shift = float(tobs_shift)
+        result.tsyn_pick = float_or_none(tsyn)
+        results.append(result)
+
+    return results
+
+
 def backazimuth_for_waveform(azimuth, nslc):
     if nslc[-1] == "R":
         backazimuth = azimuth + 180.0
@@ -119,7 +119,8 @@ class FeatureMeasure(Object):
             dataset=None,
             trs=None,
             extra_responses=[],
-            debug=False):
+            debug=False,
+            travel_times=None):
 
         from ..waveform import target as base
 
@@ -131,8 +132,14 @@ class FeatureMeasure(Object):
 
             store = engine.get_store(target.store_id)
 
-            tmin = source.time + store.t(self.timing_tmin, source, target)
-            tmax = source.time + store.t(self.timing_tmax, source, target)
+            if travel_times is not None:
+                tmin = source.time + travel_times.t(
+                    self.timing_tmin, source, target)
+                tmax = source.time + travel_times.t(
+                    self.timing_tmax, source, target)
+            else:
+                tmin = source.time + store.t(self.timing_tmin, source, target)
+                tmax = source.time + store.t(self.timing_tmax, source, target)
 
             if self.fmin is not None and self.fmax is not None:
                 freqlimits = [
@@ -204,14 +204,16 @@ class PhaseRatioTarget(gf.Location, MisfitTarget):
                 amp_obs, _ = measure.evaluate(
                     engine, source,
                     modelling_targets[imt:imt+nmt_this],
-                    dataset=ds)
+                    dataset=ds,
+                    travel_times=self._travel_times)
 
                 amp_syn, _ = measure.evaluate(
                     engine, source,
                     modelling_targets[imt:imt+nmt_this],
                     trs=[r.trace.pyrocko_trace()
                          for r
-                         in modelling_results[imt:imt+nmt_this]])
+                         in modelling_results[imt:imt+nmt_this]],
+                    travel_times=self._travel_times)
 
                 amps.append((amp_obs, amp_syn))
 
@@ -108,7 +108,7 @@ class ToyProblem(Problem):
             * num.mean(num.abs(self._obs_distances))
         return misfits
 
-    def misfits_many(self, xs):
+    def misfits_many(self, xs, mask=None):
         self._setup_modelling()
         distances = num.sqrt(
             num.sum(
@@ -129,7 +129,7 @@ class ToyProblem(Problem):
         return num.array([
             base_source.north, base_source.east, base_source.depth])
 
-    def extract(self, xs, i):
+    def extract(self, xs, i, target_dependants=None):
         if xs.ndim == 1:
             return self.extract(xs[num.newaxis, :], i)[0]
 
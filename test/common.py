@@ -120,6 +120,37 @@ def get_playground_dir():
     return playground_dir
 
 
+def get_ahfullgreen_store_superdir(store_id='ahfullgreen_test'):
+    '''
+    Build a small analytical full-space Green's function store.
+
+    The store is built once, with travel time tables, in the playground
+    directory. Returns the directory containing it.
+    '''
+    from pyrocko import gf
+    from pyrocko.fomosto import ahfullgreen
+
+    superdir = op.abspath(op.join(get_playground_dir(), 'gf_stores'))
+    store_dir = op.join(superdir, store_id)
+    if not op.exists(store_dir):
+        store_dir_temp = store_dir + '.temp'
+        if op.exists(store_dir_temp):
+            shutil.rmtree(store_dir_temp)
+
+        util.ensuredirs(store_dir_temp)
+        ahfullgreen.init(store_dir_temp, None, config_params=dict(
+            id=store_id,
+            sample_rate=5.,
+            distance_max=20e3,
+            source_depth_max=10e3))
+
+        ahfullgreen.build(store_dir_temp, nworkers=1)
+        gf.Store(store_dir_temp).make_travel_time_tables()
+        os.rename(store_dir_temp, store_dir)
+
+    return superdir
+
+
 def get_rundir_paths(config_path, event_names):
     env = Environment([config_path] + event_names)
     conf = env.get_config()
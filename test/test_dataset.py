@@ -0,0 +1,319 @@
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as num
+from pyrocko import trace, io, model, gf
+from pyrocko.io import stationxml as fs
+
+from grond.dataset import Dataset, NotFound, WaveformCache, WaveformDiskCache
+
+
+def test_waveform_cache():
+    tempdir = tempfile.mkdtemp(prefix='grond-test-')
+    try:
+        nbytes = 1000 * 8 + WaveformCache.nbytes_overhead
+        cache = WaveformCache(nbytes_max=3*nbytes, spill_dirname=tempdir)
+
+        trs = [
+            trace.Trace(
+                '', 'STA%i' % i, '', 'Z', deltat=1.0,
+                ydata=num.arange(1000.) + i)
+            for i in range(5)]
+
+        for i, tr in enumerate(trs):
+            cache['k', i] = tr
+
+        stats = cache.get_stats()
+        assert stats['nentries'] == 3
+        assert stats['nbytes'] <= 3*nbytes
+        assert stats['nentries_spilled'] == 2
+        assert len(cache) == 5
+
+        # least recently used entry comes back from disk
+        assert num.all(cache['k', 0].ydata == trs[0].ydata)
+        assert cache.nspill_hits == 1
+        assert cache.get(('k', 5)) is None
+        assert cache.nmisses == 1
+
+        cache.clear()
+        assert len(cache) == 0
+        assert os.listdir(tempdir) == []
+
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def test_waveform_disk_cache():
+    tempdir = tempfile.mkdtemp(prefix='grond-test-')
+    try:
+        cache = WaveformDiskCache(tempdir)
+        trs = [
+            trace.Trace(
+                'XX', 'STA', '', cha, tmin=1e9, deltat=0.5,
+                ydata=num.random.normal(size=100))
+            for cha in 'RTZ']
+
+        key = 'a3f0' * 10
+        assert cache.get(key) is None
+        cache.put(key, trs)
+
+        trs_cached = cache.get(key)
+        assert cache.nhits == 1 and cache.nmisses == 1
+        for tr, tr_cached in zip(trs, trs_cached):
+            assert tr.nslc_id == tr_cached.nslc_id
+            assert tr.tmin == tr_cached.tmin
+            assert tr.deltat == tr_cached.deltat
+            assert num.all(tr.ydata == tr_cached.ydata)
+
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def test_waveform_index():
+    tempdir = tempfile.mkdtemp(prefix='grond-test-')
+    try:
+        trs = []
+        for sta in ['STA1', 'STA2']:
+            for cha in 'ENZ':
+                for tmin, n in [(0., 1000), (520., 1000), (1020., 400)]:
+                    trs.append(trace.Trace(
+                        'XX', sta, '', cha, tmin=tmin, deltat=0.5,
+                        ydata=num.random.normal(size=n)))
+
+        for i in range(0, len(trs), 4):
+            io.save(trs[i:i+4], os.path.join(tempdir, 'data-%i.mseed' % i))
+
+        ds = Dataset()
+        ds.add_waveforms([tempdir])
+
+        for tmin, tmax in [(100., 400.), (400., 1100.), (1100., 2000.)]:
+            for want_incomplete in [False, True]:
+                trs_pile = ds.pile.all(
+                    tmin=tmin, tmax=tmax, tpad=10.,
+                    trace_selector=lambda tr: tr.nslc_id == (
+                        'XX', 'STA2', '', 'N'),
+                    want_incomplete=want_incomplete)
+
+                trs_index = ds._chop_waveforms(
+                    ('XX', 'STA2', '', 'N'), tmin, tmax, 10.,
+                    want_incomplete)
+
+                assert len(trs_pile) == len(trs_index)
+                for tr_pile, tr_index in zip(trs_pile, trs_index):
+                    assert tr_pile.tmin == tr_index.tmin
+                    assert num.all(tr_pile.ydata == tr_index.ydata)
+
+        trs = ds._get_waveform_headers(
+            ds._get_waveform_nslcs(('XX', 'STA1', '')), 0., 100.)
+
+        assert sorted(set(tr.channel for tr in trs)) == ['E', 'N', 'Z']
+        assert ds._get_waveform_nslcs(('XX', 'STA1', '')) == [
+            ('XX', 'STA1', '', c) for c in 'ENZ']
+        assert ds._get_waveform_nslcs(('XX', 'STA3', '')) == []
+
+        # files not containing the channel must never be visited
+        def fail(*args, **kwargs):
+            assert False
+
+        nslc = ('XX', 'STA1', '', 'Z')
+        nunrelated = 0
+        for file in ds.pile.iter_files():
+            if nslc not in set(tr.nslc_id for tr in file.iter_traces()):
+                file.load_data = file.iter_traces = fail
+                nunrelated += 1
+
+        ds.pile.relevant = fail
+        assert nunrelated > 0
+        for want_incomplete in [False, True]:
+            trs_index = ds._chop_waveforms(nslc, 600., 900., 10., want_incomplete)
+            assert trs_index
+            assert all(tr.nslc_id == nslc for tr in trs_index)
+
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def make_stationxml(sta, constant, channels=('BHZ',)):
+    resp = fs.Response.from_pyrocko_pz_response(
+        trace.PoleZeroResponse(constant=constant),
+        input_unit='M', output_unit='COUNTS')
+
+    channel_list = [
+        fs.Channel(
+            code=cha, location_code='', start_date=0.,
+            latitude=fs.Latitude(0.), longitude=fs.Longitude(0.),
+            elevation=fs.Distance(0.), depth=fs.Distance(0.),
+            sample_rate=fs.SampleRate(value=1.0), response=resp)
+        for cha in channels]
+
+    station = fs.Station(
+        code=sta, start_date=0., latitude=fs.Latitude(0.),
+        longitude=fs.Longitude(0.), elevation=fs.Distance(0.),
+        channel_list=channel_list)
+
+    return fs.FDSNStationXML(
+        source='test',
+        network_list=[fs.Network(code='XX', station_list=[station])])
+
+
+def test_response_index():
+    tempdir = tempfile.mkdtemp(prefix='grond-test-')
+    try:
+        fns = []
+        for sta, constant in [('STA1', 1.0), ('STA2', 2.0), ('STA1', 3.0)]:
+            fns.append(os.path.join(tempdir, '%s-%g.xml' % (sta, constant)))
+            make_stationxml(sta, constant).dump_xml(filename=fns[-1])
+
+        ds = Dataset()
+        ds.add_responses(stationxml_filenames=fns[:2])
+
+        tr = trace.Trace(
+            'XX', 'STA1', '', 'BHZ', tmin=100., deltat=1.0,
+            ydata=num.zeros(100))
+
+        resp = ds.get_response(tr)
+        assert resp.evaluate(num.array([1.0]))[0] == 1.0
+        assert ds.get_response(tr) is resp
+
+        # the memo is keyed by the spanning epochs, not the trace times
+        for tmin in num.linspace(200., 1e6, 50):
+            tr_shifted = tr.copy()
+            tr_shifted.shift(tmin - tr.tmin)
+            assert ds.get_response(tr_shifted) is resp
+
+        assert len(ds._response_cache) == 1
+
+        resp_vel = ds.get_response(tr, quantity='velocity')
+        assert resp_vel is not resp
+        assert ds.get_response(tr, quantity='velocity') is resp_vel
+
+        tr_missing = tr.copy()
+        tr_missing.set_station('STA3')
+        for _ in range(2):
+            try:
+                ds.get_response(tr_missing)
+                assert False
+            except NotFound as e:
+                assert e.reason.startswith('No response found')
+
+        # adding responses invalidates the memoised ones
+        ds.add_responses(stationxml_filenames=fns[2:])
+        try:
+            ds.get_response(tr)
+            assert False
+        except NotFound as e:
+            assert e.reason.startswith('Multiple responses found')
+
+    finally:
+        shutil.rmtree(tempdir)
+
+
+class FakeTarget(object):
+    def __init__(self, nslc, error=None):
+        self.nslc = nslc
+        self.error = error
+
+    def string_id(self):
+        return '.'.join(self.nslc)
+
+    def get_waveform_queries(self, engine, source):
+        if self.error is not None:
+            raise self.error
+
+        return [(self.nslc, dict(
+            quantity='displacement',
+            tinc_cache=10.,
+            tmin=500.,
+            tmax=900.,
+            tfade=20.,
+            freqlimits=(0.01, 0.02, 0.2, 0.3),
+            deltat=1.0,
+            cache=True,
+            backazimuth=None))]
+
+
+def test_prefetch():
+    tempdir = tempfile.mkdtemp(prefix='grond-test-')
+    try:
+        fns = []
+        trs = []
+        stations = []
+        for sta in ['STA1', 'STA2']:
+            fns.append(os.path.join(tempdir, '%s.xml' % sta))
+            make_stationxml(
+                sta, 1.0, ('BHE', 'BHN', 'BHZ')).dump_xml(filename=fns[-1])
+
+            for cha in 'ENZ':
+                trs.append(trace.Trace(
+                    'XX', sta, '', 'BH' + cha, tmin=0., deltat=1.0,
+                    ydata=num.random.normal(size=2000)))
+
+            stations.append(model.Station(
+                'XX', sta, '', lat=0., lon=0., channels=[
+                    model.Channel('BHE', azimuth=90., dip=0.),
+                    model.Channel('BHN', azimuth=0., dip=0.),
+                    model.Channel('BHZ', azimuth=0., dip=-90.)]))
+
+        io.save(trs, os.path.join(tempdir, 'data.mseed'))
+
+        ds = Dataset()
+        ds.add_waveforms([tempdir])
+        ds.add_responses(stationxml_filenames=fns)
+        ds.add_stations(stations=stations)
+
+        targets = [
+            FakeTarget(('XX', sta, '', cha))
+            for sta in ['STA1', 'STA2']
+            for cha in 'ENZ']
+
+        targets_missing = [
+            FakeTarget(('XX', 'STA3', '', 'Z')),
+            FakeTarget(('XX', 'STA2', '', 'Z'), error=gf.OutOfBounds()),
+            FakeTarget(('XX', 'STA2', '', 'Z'), error=gf.SeismosizerError())]
+
+        assert ds.prefetch(targets + targets_missing, None, None, 2) == 3
+
+        stats = ds.get_cache_stats()
+        assert stats['nentries'] >= len(targets)
+
+        for target in targets:
+            (nslc, kwargs), = target.get_waveform_queries(None, None)
+            ds.get_waveform(nslc, **kwargs)
+
+        stats_after = ds.get_cache_stats()
+        assert stats_after['nmisses'] == stats['nmisses']
+        assert stats_after['nhits'] - stats['nhits'] == len(targets)
+
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def test_waveform_cache_threads():
+    nbytes = 100 * 8 + WaveformCache.nbytes_overhead
+    cache = WaveformCache(nbytes_max=20*nbytes)
+    nkeys = 50
+    trs = [
+        trace.Trace(
+            '', 'STA%i' % i, '', 'Z', deltat=1.0,
+            ydata=num.arange(100.) + i)
+        for i in range(nkeys)]
+
+    def work(seed):
+        rstate = num.random.RandomState(seed)
+        for _ in range(2000):
+            i = rstate.randint(nkeys)
+            tr = cache.get(('k', i))
+            if tr is None:
+                cache['k', i] = trs[i]
+            else:
+                assert tr is trs[i]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(work, range(8)))
+
+    stats = cache.get_stats()
+    assert stats['nbytes'] <= 20*nbytes
+    assert stats['nbytes'] == stats['nentries'] * nbytes
+    assert stats['nhits'] + stats['nmisses'] == 8 * 2000
@@ -2,6 +2,9 @@ from __future__ import absolute_import
 
 import glob
 
+import numpy as num
+from numpy.testing import assert_almost_equal as assert_ae
+
 from .common import grond, run_in_project
 from grond import config
 
@@ -47,3 +50,273 @@ def test_starting_point():
         project_dir='example_regional_cmt_full_starting_point',
         event_name='gfz2018pmjk',
         config_path='config/regional_cmt_ampspec.gronf')
+
+
+class FakeProblem(object):
+    def __init__(self, xbounds, xmin_allowed=None):
+        self.xbounds = num.array(xbounds, dtype=float)
+        self.xmin_allowed = xmin_allowed
+
+    @property
+    def nparameters(self):
+        return self.xbounds.shape[0]
+
+    @property
+    def parameter_names(self):
+        return ['p%i' % i for i in range(self.nparameters)]
+
+    def get_parameter_bounds(self):
+        return self.xbounds
+
+    def preconstrain(self, x):
+        from grond.meta import Forbidden
+        if self.xmin_allowed is not None and x[0] < self.xmin_allowed:
+            raise Forbidden()
+
+        return x
+
+
+class FakeChains(object):
+    def __init__(self, means, stds):
+        self.means = num.array(means, dtype=float)
+        self.stds = num.array(stds, dtype=float)
+        self.accept_sum = num.arange(self.means.shape[0])
+
+    def mean_model(self, ichain):
+        return self.means[ichain]
+
+    def standard_deviation_models(self, ichain, estimator):
+        return self.stds[ichain]
+
+
+def truncnorm_cdf(mean, std, xmin, xmax):
+    from scipy import stats
+    a, b = (xmin - mean) / std, (xmax - mean) / std
+    return stats.truncnorm(a, b, loc=mean, scale=std).cdf
+
+
+def test_truncated_normal():
+    from scipy import stats
+    from grond.optimisers.highscore.optimiser import truncated_normal
+
+    rstate = num.random.RandomState(11)
+    n = 10000
+    for mean, std, xmin, xmax in [
+            (0., 1., -1., 1.),
+            (0., 1., -10., 0.5),
+            (2., 0.5, -1., 1.),
+            (-2., 0.5, -1., 1.),
+            (0., 1., 5., 7.),
+            (0., 1., -7., -5.),
+            (0., 100., -1., 1.)]:
+
+        xs, mass = truncated_normal(
+            num.full(n, mean), std, xmin, xmax, rstate)
+
+        assert num.all((xmin <= xs) & (xs <= xmax))
+        assert_ae(mass, stats.norm.cdf(xmax, mean, std)
+                  - stats.norm.cdf(xmin, mean, std))
+
+        assert stats.kstest(
+            xs, truncnorm_cdf(mean, std, xmin, xmax)).pvalue > 1e-3
+
+    xs, mass = truncated_normal(
+        num.array([0., 2.]), 0., -1., 1., rstate)
+
+    assert_ae(xs, [0., 2.])
+    assert_ae(mass, [1., 0.])
+
+
+def test_draw_normal():
+    from scipy import stats
+    from grond.optimisers.highscore.optimiser import DirectedSamplerPhase
+
+    n = 10000
+    problem = FakeProblem([[-1., 1.], [0., 1.], [1., 2.]])
+    phase = DirectedSamplerPhase(niterations=n, ntries_sample_limit=2)
+
+    rstate = num.random.RandomState(13)
+    means = num.array([0., 0.5, 0.])
+    stds = num.array([1., 0.1, 1.])
+    xs = phase.draw_normal(
+        problem, num.tile(means, (n, 1)), num.tile(stds, (n, 1)), rstate)
+
+    for ipar, (xmin, xmax) in enumerate(problem.xbounds):
+        mean, std = means[ipar], stds[ipar]
+
+        # fallback to uniform after ntries_sample_limit + 2 failed tries
+        mass = stats.norm.cdf(xmax, mean, std) \
+            - stats.norm.cdf(xmin, mean, std)
+
+        pfallback = (1.0 - mass)**(phase.ntries_sample_limit + 2)
+        if ipar == 2:
+            assert 0.1 < pfallback < 0.9
+
+        cdf_normal = truncnorm_cdf(mean, std, xmin, xmax)
+        cdf_uniform = stats.uniform(xmin, xmax - xmin).cdf
+
+        def cdf(x):
+            return (1.0 - pfallback) * cdf_normal(x) \
+                + pfallback * cdf_uniform(x)
+
+        assert num.all((xmin <= xs[:, ipar]) & (xs[:, ipar] <= xmax))
+        assert stats.kstest(xs[:, ipar], cdf).pvalue > 1e-3
+
+
+def test_directed_get_samples():
+    from scipy import stats
+    from grond.optimisers.highscore.optimiser import DirectedSamplerPhase
+
+    n = 4000
+    chains = FakeChains([[0., 0.5], [0.5, 0.9]], [[1., 0.1], [0.5, 0.2]])
+
+    # candidates failing preconstrain are redrawn one by one
+    for xmin_allowed in (None, 0.):
+        problem = FakeProblem(
+            [[-1., 1.], [0., 1.]], xmin_allowed=xmin_allowed)
+
+        phase = DirectedSamplerPhase(
+            niterations=2*n, scatter_scale=2.0, starting_point='mean',
+            seed=17)
+
+        samples = phase.get_samples(problem, 0, chains, 2*n)
+
+        for ichain in range(2):
+            xs = num.array([
+                sample.model for sample in samples
+                if sample.ichain_base == ichain])
+
+            assert xs.shape == (n, problem.nparameters)
+            for ipar, (xmin, xmax) in enumerate(problem.xbounds):
+                if ipar == 0 and xmin_allowed is not None:
+                    xmin = xmin_allowed
+
+                cdf = truncnorm_cdf(
+                    chains.means[ichain, ipar],
+                    2.0 * chains.stds[ichain, ipar],
+                    xmin, xmax)
+
+                assert stats.kstest(xs[:, ipar], cdf).pvalue > 1e-3
+
+
+class FakeHistory(object):
+    def __init__(self, models, bootstrap_misfits):
+        self.models = models
+        self.bootstrap_misfits = bootstrap_misfits
+        self.nmodels = models.shape[0]
+
+    def add_listener(self, listener):
+        pass
+
+
+def insert_sequential(gbms, nlinks_cap):
+    '''
+    Insert models into the chains one by one, as Chains did before
+    ingesting blocks of models.
+    '''
+
+    nmodels, nchains = gbms.shape
+    chains_m = num.zeros((nchains, nlinks_cap))
+    chains_i = num.zeros((nchains, nlinks_cap), dtype=int)
+    accepts = num.zeros((nchains, nmodels), dtype=bool)
+    nlinks = 0
+    for imodel in range(nmodels):
+        chains_m[:, nlinks] = gbms[imodel, :]
+        chains_i[:, nlinks] = imodel
+        nlinks += 1
+        for ichain in range(nchains):
+            m = chains_m[ichain, :nlinks]
+            isort = num.argsort(
+                num.where(num.isnan(m), num.inf, m), kind='stable')
+
+            chains_m[ichain, :nlinks] = chains_m[ichain, isort]
+            chains_i[ichain, :nlinks] = chains_i[ichain, isort]
+
+        if nlinks == nlinks_cap:
+            accepts[:, imodel] = chains_i[:, nlinks_cap-1] != imodel
+            nlinks -= 1
+        else:
+            accepts[:, imodel] = True
+
+    return chains_m[:, :nlinks], chains_i[:, :nlinks], accepts
+
+
+def test_chains_insert_block():
+    from grond.optimisers.highscore.optimiser import Chains
+
+    rstate = num.random.RandomState(19)
+    nmodels, nchains, nlinks_cap = 500, 5, 40
+
+    # coarse misfit values to produce ties
+    gbms = rstate.randint(0, 30, size=(nmodels, nchains)) / 10.
+    gbms[rstate.uniform(size=gbms.shape) < 0.02] = num.nan
+    history = FakeHistory(num.zeros((nmodels, 1)), gbms)
+
+    chains_m_ref, chains_i_ref, accepts_ref = insert_sequential(
+        gbms, nlinks_cap)
+
+    for nread_block in (1, 7, 128):
+        chains = Chains(None, history, nchains, nlinks_cap)
+        chains.nread_block = nread_block
+        for n in (3, 50, 51, 200, nmodels):
+            chains.goto(n)
+
+        assert chains.nread == nmodels
+        assert chains.nlinks == chains_m_ref.shape[1]
+        num.testing.assert_equal(
+            chains.chains_m[:, :chains.nlinks], chains_m_ref)
+        num.testing.assert_equal(
+            chains.chains_i[:, :chains.nlinks], chains_i_ref)
+        num.testing.assert_equal(chains.acceptance_history, accepts_ref)
+        num.testing.assert_equal(
+            chains.accept_sum, num.sum(accepts_ref, axis=1))
+
+
+def test_chains_moments():
+    from grond.optimisers.highscore.optimiser import Chains
+
+    rstate = num.random.RandomState(21)
+    nmodels, nchains, nlinks_cap = 1000, 4, 30
+    problem = FakeProblem([[1e3, 1e3 + 10.], [-1., 1.], [0., 1e-3]])
+
+    xbounds = problem.xbounds
+    models = rstate.uniform(
+        xbounds[:, 0], xbounds[:, 1], size=(nmodels, problem.nparameters))
+
+    # misfits decreasing on average, so that chains keep changing
+    gbms = rstate.uniform(size=(nmodels, nchains)) \
+        * num.linspace(1., 0.1, nmodels)[:, num.newaxis]
+
+    history = FakeHistory(models, gbms)
+    chains = Chains(problem, history, nchains, nlinks_cap)
+
+    for n in list(range(1, 10)) + list(range(10, nmodels + 1, 5)):
+        chains.goto(n)
+
+        for ichain in list(range(nchains)) + [None]:
+            xs = chains.models(ichain)
+            if chains.nlinks < 2:
+                continue
+
+            for _ in range(2):
+                assert_allclose(
+                    chains.mean_model(ichain), num.mean(xs, axis=0))
+
+                if ichain is None:
+                    assert_allclose(
+                        chains.standard_deviation_models(
+                            0, 'standard_deviation_all_chains'),
+                        num.std(xs, axis=0))
+                else:
+                    assert_allclose(
+                        chains.standard_deviation_models(
+                            ichain, 'standard_deviation_single_chain'),
+                        num.std(xs, axis=0))
+
+                    assert_allclose(
+                        chains.covariance_models(ichain), num.cov(xs.T))
+
+
+def assert_allclose(a, b):
+    num.testing.assert_allclose(
+        a, b, rtol=1e-8, atol=1e-8 * num.max(num.abs(b)))
@@ -1,11 +1,23 @@
 from __future__ import print_function
+import os
+import shutil
+import tempfile
 import nose.tools as t
 
 import numpy as num
 
+from . import common
 from numpy.testing import assert_almost_equal as assert_ae
 from pyrocko import gf
-from grond.toy import scenario, ToyProblem
+from pyrocko.guts import List, Object
+from grond.meta import Parameter
+from grond.toy import scenario, ToyProblem, ToyTarget
+from grond.problems.base import (
+    Problem, ProblemDataWriter, ModelHistory, load_problem_data,
+    load_problem_info, get_nmodels)
+from grond.optimisers.highscore.optimiser import (
+    HighScoreOptimiser, UniformSamplerPhase, DirectedSamplerPhase,
+    ConvergenceCriterion)
 
 
 def test_combine_misfits():
@@ -78,3 +90,1404 @@ def test_combine_misfits():
         assert_ae(gm_2_contrib[1, :], gm_contrib)
         assert_ae(gms_2_contrib[ix, 0, :], gm_contrib)
         assert_ae(gms_2_contrib[ix, 1, :], gm_contrib)
+
+
+def test_misfit_combiner():
+    source, targets = scenario('wellposed', 'lownoise')
+    for itarget, target in enumerate(targets):
+        target.normalisation_family = 'family%i' % (itarget % 3)
+
+    p = ToyProblem(
+        name='toy_problem',
+        ranges={},
+        base_source=source,
+        targets=targets)
+
+    rstate = num.random.RandomState(23)
+    misfitss = rstate.uniform(0.1, 2., size=(50, p.nmisfits, 2))
+    misfitss[3, 4, :] = num.nan
+    bweights = rstate.uniform(0., 2., size=(7, p.nmisfits))
+    bresiduals = rstate.normal(0., 0.3, size=(7, p.nmisfits))
+
+    kwargs = dict(extra_weights=bweights, extra_residuals=bresiduals)
+    gms = p.combine_misfits(misfitss, **kwargs)
+    gms_contrib = p.combine_misfits(misfitss, get_contributions=True, **kwargs)
+    gms_fast = p.combine_misfits(misfitss, exact=False, **kwargs)
+
+    assert num.all(num.isfinite(gms))
+    num.testing.assert_allclose(gms_fast, gms, rtol=1e-12)
+
+    combiner = p.get_misfit_combiner()
+    nelements_block = combiner.nelements_block
+    try:
+        # force blocked reduction over models and bootstrap chains
+        combiner.nelements_block = 3 * p.nmisfits
+        assert num.array_equal(p.combine_misfits(misfitss, **kwargs), gms)
+        assert num.array_equal(
+            p.combine_misfits(misfitss, get_contributions=True, **kwargs),
+            gms_contrib, equal_nan=True)
+    finally:
+        combiner.nelements_block = nelements_block
+
+    pc = p.copy()
+    assert pc.get_misfit_combiner() is not combiner
+
+
+def test_problem_data_writer():
+    source, targets = scenario('wellposed', 'noisefree')
+
+    p = ToyProblem(
+        name='toy_problem',
+        ranges={
+            'north': gf.Range(start=-10., stop=10.),
+            'east': gf.Range(start=-10., stop=10.),
+            'depth': gf.Range(start=0., stop=10.)},
+        base_source=source,
+        targets=targets)
+
+    nchains = 3
+    xs = num.random.uniform(0., 10., size=(25, p.nparameters))
+    misfits = p.misfits_many(xs)
+    bootstraps = num.random.uniform(size=(xs.shape[0], nchains))
+    contexts = num.zeros((xs.shape[0], 4), dtype=int)
+
+    rundir = tempfile.mkdtemp(prefix='grond-test-')
+    try:
+        writer = ProblemDataWriter(
+            rundir, p, flush_nmodels=10, flush_interval=1e9)
+
+        for i in range(0, 15, 5):
+            writer.write(
+                xs[i:i+5], misfits[i:i+5], bootstraps[i:i+5],
+                contexts[i:i+5])
+
+        # only completely flushed blocks are visible to readers
+        assert get_nmodels(rundir, p) == 10
+
+        writer.write(xs[15:], misfits[15:], bootstraps[15:], contexts[15:])
+        writer.close()
+
+        assert get_nmodels(rundir, p) == xs.shape[0]
+
+        xs2, misfits2, bootstraps2, contexts2 = load_problem_data(
+            rundir, p, nchains=nchains)
+
+        assert_ae(xs2, xs)
+        assert_ae(misfits2, misfits)
+        assert_ae(bootstraps2, bootstraps)
+        assert_ae(contexts2, contexts)
+
+        xs3, misfits3, bootstraps3, contexts3 = load_problem_data(
+            rundir, p, nchains=nchains, mmap=True)
+
+        for a, b in [(xs3, xs2), (misfits3, misfits2),
+                     (bootstraps3, bootstraps2), (contexts3, contexts2)]:
+            assert isinstance(a, num.memmap)
+            assert not a.flags.writeable
+            t.assert_equal(a.shape, b.shape)
+            assert num.all(a == b)
+
+        history = ModelHistory(p, nchains=nchains, path=rundir, mmap=True)
+        t.assert_equal(history.nmodels, xs.shape[0])
+        assert isinstance(history.models, num.memmap)
+        assert num.all(history.misfits == misfits2)
+
+    finally:
+        shutil.rmtree(rundir)
+
+
+def test_model_history_update_incomplete():
+    source, targets = scenario('wellposed', 'noisefree')
+
+    p = ToyProblem(
+        name='toy_problem',
+        ranges={
+            'north': gf.Range(start=-10., stop=10.),
+            'east': gf.Range(start=-10., stop=10.),
+            'depth': gf.Range(start=0., stop=10.)},
+        base_source=source,
+        targets=targets)
+
+    nchains = 3
+    xs = num.random.uniform(0., 10., size=(20, p.nparameters))
+    misfits = p.misfits_many(xs)
+    bootstraps = num.random.uniform(size=(xs.shape[0], nchains))
+    contexts = num.zeros((xs.shape[0], 4), dtype=int)
+
+    rundir = tempfile.mkdtemp(prefix='grond-test-')
+    try:
+        writer = ProblemDataWriter(rundir, p)
+        writer.write(xs[:10], misfits[:10], bootstraps[:10], contexts[:10])
+        writer.flush()
+
+        histories = [
+            ModelHistory(p, nchains=nchains, path=rundir, mmap=mmap)
+            for mmap in (False, True)]
+
+        writer.write(xs[10:], misfits[10:], bootstraps[10:], contexts[10:])
+        writer.close()
+
+        # bootstraps of the last model not written yet
+        fn = os.path.join(rundir, 'bootstraps')
+        with open(fn, 'rb') as f:
+            data = f.read()
+
+        with open(fn, 'wb') as f:
+            f.write(data[:-8])
+
+        for history in histories:
+            history.update()
+            t.assert_equal(history.nmodels, 10)
+
+        with open(fn, 'wb') as f:
+            f.write(data)
+
+        for history in histories:
+            history.update()
+            t.assert_equal(history.nmodels, xs.shape[0])
+            assert_ae(history.bootstrap_misfits, bootstraps)
+
+    finally:
+        shutil.rmtree(rundir)
+
+
+class Interrupted(Exception):
+    pass
+
+
+class InterruptedToyProblem(ToyProblem):
+
+    nmodels_interrupt = None
+
+    def misfits_many(self, xs, mask=None):
+        if self.nmodels_interrupt is not None:
+            self.nmodels_interrupt -= xs.shape[0]
+            if self.nmodels_interrupt < 0:
+                raise Interrupted()
+
+        return ToyProblem.misfits_many(self, xs, mask=mask)
+
+
+def test_optimiser_resume():
+    source, targets = scenario('wellposed', 'noisefree')
+
+    def optimise(rundir, nmodels_interrupt=None, resume=False):
+        p = InterruptedToyProblem(
+            name='toy_problem',
+            ranges={
+                'north': gf.Range(start=-10., stop=10.),
+                'east': gf.Range(start=-10., stop=10.),
+                'depth': gf.Range(start=0., stop=10.)},
+            base_source=source,
+            targets=targets)
+
+        p.nmodels_interrupt = nmodels_interrupt
+
+        optimiser = HighScoreOptimiser(
+            sampler_phases=[
+                UniformSamplerPhase(niterations=50, seed=1),
+                DirectedSamplerPhase(niterations=150, seed=2, batch_size=4)],
+            nbootstrap=10,
+            checkpoint_interval=1e-9)
+
+        optimiser.optimise(p, rundir=rundir, resume=resume)
+        return p, optimiser
+
+    rundir1 = tempfile.mkdtemp(prefix='grond-test-')
+    rundir2 = tempfile.mkdtemp(prefix='grond-test-')
+    try:
+        p, optimiser = optimise(rundir1)
+        xs1, misfits1, bootstraps1, _ = load_problem_data(
+            rundir1, p, nchains=optimiser.nchains)
+
+        with t.assert_raises(Interrupted):
+            optimise(rundir2, nmodels_interrupt=121)
+
+        assert optimiser.has_checkpoint(rundir2)
+        t.assert_equal(get_nmodels(rundir2, p), 118)
+
+        optimise(rundir2, resume=True)
+        assert not optimiser.has_checkpoint(rundir2)
+
+        xs2, misfits2, bootstraps2, _ = load_problem_data(
+            rundir2, p, nchains=optimiser.nchains)
+
+        assert num.all(xs1 == xs2)
+        assert num.all(misfits1 == misfits2)
+        assert num.all(bootstraps1 == bootstraps2)
+
+    finally:
+        shutil.rmtree(rundir1)
+        shutil.rmtree(rundir2)
+
+
+class DependantToyTarget(ToyTarget):
+
+    def __init__(self, **kwargs):
+        ToyTarget.__init__(self, **kwargs)
+        self.dependants = [Parameter('distance', 'm')]
+
+
+class DependantToyProblem(ToyProblem):
+
+    targets = List.T(DependantToyTarget.T())
+
+    def get_distances(self, xs):
+        self._setup_modelling()
+        return num.sqrt(num.sum(
+            (xs[:, num.newaxis, :] - self._xtargets[num.newaxis, :])**2,
+            axis=2))
+
+    def misfits_many(self, xs, mask=None, want_target_dependants=False):
+        misfits = ToyProblem.misfits_many(self, xs, mask=mask)
+        if want_target_dependants:
+            return misfits, self.get_distances(xs)
+
+        return misfits
+
+    def extract(self, xs, i, target_dependants=None):
+        return Problem.extract(self, xs, i, target_dependants)
+
+
+def test_target_dependants_stored():
+    source, targets = scenario('wellposed', 'noisefree')
+    targets = [
+        DependantToyTarget(
+            **dict((k, getattr(target, k)) for k in ToyTarget.T.propnames))
+        for target in targets]
+
+    p = DependantToyProblem(
+        name='toy_problem',
+        ranges={
+            'north': gf.Range(start=-10., stop=10.),
+            'east': gf.Range(start=-10., stop=10.),
+            'depth': gf.Range(start=0., stop=10.)},
+        base_source=source,
+        targets=targets)
+
+    optimiser = HighScoreOptimiser(
+        sampler_phases=[UniformSamplerPhase(niterations=50, seed=1)],
+        nbootstrap=10)
+
+    rundir = tempfile.mkdtemp(prefix='grond-test-')
+    try:
+        p.dump_problem_info(rundir)
+        optimiser.optimise(p, rundir=rundir)
+
+        p2 = load_problem_info(rundir)
+        for mmap in (False, True):
+            history = ModelHistory(p2, path=rundir, mmap=mmap)
+            distances = p.get_distances(history.models)
+            num.testing.assert_equal(history.target_dependants, distances)
+            for itarget, param in enumerate(p2.target_dependants):
+                i = p2.name_to_index(param.name)
+                assert num.all(
+                    p2.extract(
+                        history.models, i, history.target_dependants)
+                    == distances[:, itarget])
+
+        # values are looked up by model index, not model values
+        imodels = num.array([3, 1, 4])
+        assert num.all(
+            p2.extract(
+                history.models[imodels] + 1e-9, i,
+                history.target_dependants[imodels])
+            == distances[imodels, -1])
+
+        # values of models without stored values are not forward modelled
+        assert num.isnan(p2.extract(history.models[0], i))
+
+        # resumed histories carry the values of the models already written
+        history = ModelHistory(p2, nchains=10, path=rundir, mode='w')
+        history.resume(20)
+        num.testing.assert_equal(
+            history.target_dependants, distances[:20])
+
+        history.extend(
+            history.models[:5], history.misfits[:5],
+            history.bootstrap_misfits[:5], history.sampler_contexts[:5],
+            target_dependants=distances[:5] + 1.0)
+        num.testing.assert_equal(
+            history.target_dependants[20:], distances[:5] + 1.0)
+        history.close()
+
+        history = ModelHistory(p2, path=rundir)
+        assert history.nmodels == 25
+        num.testing.assert_equal(
+            history.target_dependants[20:], distances[:5] + 1.0)
+
+    finally:
+        shutil.rmtree(rundir)
+
+
+def test_optimiser_convergence():
+    source, targets = scenario('wellposed', 'noisefree')
+
+    p = ToyProblem(
+        name='toy_problem',
+        ranges={
+            'north': gf.Range(start=-10., stop=10.),
+            'east': gf.Range(start=-10., stop=10.),
+            'depth': gf.Range(start=0., stop=10.)},
+        base_source=source,
+        targets=targets)
+
+    optimiser = HighScoreOptimiser(
+        sampler_phases=[
+            UniformSamplerPhase(niterations=100, seed=1),
+            DirectedSamplerPhase(niterations=20000, seed=2),
+            DirectedSamplerPhase(niterations=100, seed=3)],
+        nbootstrap=10,
+        convergence_criterion=ConvergenceCriterion(
+            nwindow=200, niterations_min=400))
+
+    rundir = tempfile.mkdtemp(prefix='grond-test-')
+    try:
+        optimiser.optimise(p, rundir=rundir)
+
+        _, _, _, contexts = load_problem_data(
+            rundir, p, nchains=optimiser.nchains)
+
+        nmodels_phases = num.bincount(contexts[:, 0])
+        t.assert_equal(nmodels_phases[0], 100)
+        assert nmodels_phases[1] < 20000
+        t.assert_equal(nmodels_phases[2], 100)
+
+        terminations = optimiser.load_early_terminations(rundir)
+        t.assert_equal(len(terminations), 1)
+        t.assert_equal(terminations[0].iphase, 1)
+        t.assert_equal(terminations[0].iiter_phase, nmodels_phases[1])
+
+    finally:
+        shutil.rmtree(rundir)
+
+
+class FakeQuadtree(object):
+    def __init__(self, leaf_center_distance, leaf_medians):
+        self.leaf_center_distance = leaf_center_distance
+        self.leaf_medians = leaf_medians
+
+
+class FakeScene(object):
+    def __init__(self, quadtree):
+        self.quadtree = quadtree
+
+
+class FakeDataset(object):
+    def __init__(self, scene):
+        self.scene = scene
+
+    def get_kite_scene(self, scene_id):
+        return self.scene
+
+
+def test_satellite_orbital_ramp_solve():
+    from grond.targets.satellite.target import (
+        SatelliteMisfitTarget, SatelliteMisfitConfig)
+
+    rstate = num.random.RandomState(23)
+    n = 50
+    distances = rstate.uniform(-20000., 20000., (n, 2))
+    syn = rstate.normal(size=n) * 0.01
+    offset, ramp_north, ramp_east = 0.1, 2e-6, -3e-6
+    obs = syn + offset + distances[:, 1] * ramp_north \
+        + distances[:, 0] * ramp_east
+
+    target = SatelliteMisfitTarget(
+        scene_id='scene',
+        path='insar',
+        lats=num.zeros(n),
+        lons=num.zeros(n),
+        north_shifts=distances[:, 1],
+        east_shifts=distances[:, 0],
+        theta=num.zeros(n),
+        phi=num.zeros(n),
+        misfit_config=SatelliteMisfitConfig(solve_orbital_ramp=True))
+
+    target.set_dataset(FakeDataset(FakeScene(FakeQuadtree(distances, obs))))
+
+    assert target.target_parameters == []
+    assert [p.name for p in target.target_dependants] == [
+        'insar.scene.offset', 'insar.scene.ramp_north',
+        'insar.scene.ramp_east']
+
+    result = target.post_process(None, None, {'displacement.los': syn.copy()})
+
+    assert_ae(result.offset, offset)
+    assert_ae(result.ramp_north / ramp_north, 1.0)
+    assert_ae(result.ramp_east / ramp_east, 1.0)
+    assert_ae(result.misfits[:, 0], 0.0)
+
+
+def test_waveform_misfit_many():
+    from pyrocko import trace
+    from grond.targets.waveform.target import (
+        WaveformMisfitTarget, WaveformMisfitConfig, misfit, misfit_many,
+        _process)
+
+    rstate = num.random.RandomState(42)
+    deltat = 0.5
+
+    targets = []
+    prepared = []
+    for domain in WaveformMisfitTarget.batched_domains:
+        for exponent in (1, 2, 3):
+            for i in range(4):
+                target = WaveformMisfitTarget(
+                    codes=('', 'S%i' % i, '', 'Z'),
+                    path='wf',
+                    flip_norm=(i == 2),
+                    misfit_config=WaveformMisfitConfig(
+                        fmax=0.2,
+                        domain=domain,
+                        norm_exponent=exponent,
+                        batch_misfits=True))
+
+                target.set_result_mode('sparse')
+                assert target.can_batch_misfit()
+
+                tmin_fit = rstate.uniform(10., 20.)
+                tmax_fit = tmin_fit + rstate.uniform(20., 60.)
+                taper = trace.CosTaper(
+                    tmin_fit - 5., tmin_fit, tmax_fit, tmax_fit + 5.)
+
+                trs = [
+                    trace.Trace(
+                        tmin=deltat * rstate.randint(-10, 10),
+                        deltat=deltat,
+                        ydata=rstate.normal(size=rstate.randint(100, 200)))
+                    for _ in range(2)]
+
+                processed_obs = _process(
+                    trs[0], tmin_fit - 5., tmax_fit + 5., taper, domain)
+
+                targets.append(target)
+                prepared.append(
+                    (trs[0], trs[1], taper, processed_obs, 1.0, None))
+
+    for target, (tr_obs, tr_syn, taper, processed_obs, _, _), result in zip(
+            targets, prepared, misfit_many(targets, prepared)):
+
+        config = target.misfit_config
+        result_ref = misfit(
+            tr_obs, tr_syn, taper,
+            domain=config.domain,
+            exponent=config.norm_exponent,
+            tautoshift_max=0.0,
+            autoshift_penalty_max=0.0,
+            flip=target.flip_norm)
+
+        num.testing.assert_allclose(
+            result.misfits, result_ref.misfits, rtol=1e-10)
+
+        assert result.tobs_shift == 1.0
+        assert result.tsyn_pick is None
+
+
+def test_mt_linearity_cache():
+    from grond.problems.cmt.linearity import MTLinearityCache
+
+    engine = gf.LocalEngine(
+        store_superdirs=[common.get_ahfullgreen_store_superdir()])
+
+    store_id = 'ahfullgreen_test'
+    config = engine.get_store(store_id).config
+    dx = config.distance_delta
+    dz = config.source_depth_delta
+
+    rstate = num.random.RandomState(17)
+
+    def random_mt_source():
+        # on the grid, so that the cache does not snap the location
+        return gf.MTSource(
+            north_shift=dx * rstate.randint(-2, 3),
+            east_shift=dx * rstate.randint(-2, 3),
+            depth=dz * rstate.randint(3, 7),
+            time=rstate.uniform(-1., 1.),
+            m6=rstate.normal(size=6) * 1e15,
+            stf=gf.HalfSinusoidSTF(duration=rstate.uniform(0., 2.)))
+
+    sources = [random_mt_source() for _ in range(4)]
+    sources.append(gf.CombiSource(
+        subsources=[random_mt_source() for _ in range(2)]))
+
+    targets = [
+        gf.Target(
+            codes=('', 'S%i' % i, '', cha),
+            store_id=store_id,
+            quantity='displacement',
+            north_shift=rstate.uniform(-8000., 8000.),
+            east_shift=rstate.uniform(-8000., 8000.),
+            tmin=0.5,
+            tmax=rstate.uniform(5., 10.))
+        for i in range(3)
+        for cha in 'NEZ']
+
+    targets.append(gf.StaticTarget(
+        store_id=store_id,
+        north_shifts=rstate.uniform(-8000., 8000., 10),
+        east_shifts=rstate.uniform(-8000., 8000., 10)))
+
+    results_ref = engine.process(sources, targets).results_list
+
+    cache = MTLinearityCache()
+    for _ in range(2):
+        results = cache.process(engine, sources, targets)
+        for results_source, results_source_ref in zip(results, results_ref):
+            for result, result_ref in zip(results_source, results_source_ref):
+                if isinstance(result_ref, gf.meta.StaticResult):
+                    for k, v in result_ref.result.items():
+                        num.testing.assert_allclose(
+                            result.result[k], v,
+                            rtol=1e-5, atol=1e-5 * num.max(num.abs(v)))
+                else:
+                    tr, tr_ref = result.trace, result_ref.trace
+                    assert tr.deltat == tr_ref.deltat
+                    assert abs(tr.tmin - tr_ref.tmin) < 1e-6 * tr.deltat
+                    num.testing.assert_allclose(
+                        tr.data, tr_ref.data,
+                        rtol=1e-5, atol=1e-5 * num.max(num.abs(tr_ref.data)))
+
+    assert cache.nhits > 0
+
+
+def multi_cmt_problem():
+    from grond.problems.cmt.problem import MultiCMTProblem
+
+    subsources = [
+        gf.MTSource(
+            name='a', time=10., depth=5e3,
+            stf=gf.HalfSinusoidSTF(duration=1.)),
+        gf.MTSource(
+            name='b', time=20., depth=7e3, north_shift=1e3,
+            stf=gf.HalfSinusoidSTF(duration=1.))]
+
+    ranges = dict(
+        time=gf.Range(-5., 5., relative='add'),
+        north_shift=gf.Range(-1e3, 1e3, relative='add'),
+        east_shift=gf.Range(-1e3, 1e3, relative='add'),
+        depth=gf.Range(2e3, 8e3),
+        magnitude=gf.Range(5., 6.),
+        rmnn=gf.Range(-1.4, 1.4),
+        rmee=gf.Range(-1.4, 1.4),
+        rmdd=gf.Range(-1.4, 1.4),
+        rmne=gf.Range(-1., 1.),
+        rmnd=gf.Range(-1., 1.),
+        rmed=gf.Range(-1., 1.),
+        duration=gf.Range(0.5, 2.))
+
+    return MultiCMTProblem(
+        name='test',
+        base_source=gf.CombiSource(name='ab', subsources=subsources),
+        target_groups=[],
+        targets=[],
+        ranges=ranges)
+
+
+def multi_rectangular_problem():
+    from grond.problems.rectangular.problem import MultiRectangularProblem
+
+    subsources = [
+        gf.RectangularSource(
+            name=name, time=time, depth=5e3, length=5e3, width=2e3,
+            strike=strike, dip=60., rake=90., slip=1.)
+        for (name, time, strike) in [('a', 10., 0.), ('b', 20., 90.)]]
+
+    ranges = dict(
+        north_shift=gf.Range(-1e3, 1e3),
+        east_shift=gf.Range(-1e3, 1e3),
+        depth=gf.Range(3e3, 7e3),
+        length=gf.Range(2e3, 8e3),
+        width=gf.Range(1e3, 3e3),
+        slip=gf.Range(0.5, 2.),
+        strike=gf.Range(-20., 20., relative='add'),
+        dip=gf.Range(40., 80.),
+        rake=gf.Range(60., 120.),
+        nucleation_x=gf.Range(-1., 1.),
+        nucleation_y=gf.Range(-1., 1.),
+        time=gf.Range(-5., 5., relative='add'),
+        velocity=gf.Range(2000., 4000.))
+
+    return MultiRectangularProblem(
+        name='test',
+        base_source=gf.CombiSource(name='ab', subsources=subsources),
+        target_groups=[],
+        targets=[],
+        ranges=ranges)
+
+
+def random_models(problem, nmodels, rstate):
+    xbounds = num.array(problem.get_parameter_bounds(), dtype=float)
+    return rstate.uniform(
+        xbounds[:, 0], xbounds[:, 1], size=(nmodels, problem.nparameters))
+
+
+def same_value(a, b):
+    if isinstance(a, Object):
+        return a.dump() == b.dump()
+
+    return a == b
+
+
+def check_subsource_parameter_map(problem):
+    pmap = problem.get_parameter_map()
+    base_subsources = problem.base_source.subsources
+    assert pmap.nsubsources == len(base_subsources)
+
+    rstate = num.random.RandomState(23)
+    xs = random_models(problem, 5, rstate)
+    for isub, base in enumerate(base_subsources):
+        names = [
+            p.name[len(base.name)+1:] for p in problem.problem_parameters
+            if p.name.startswith(base.name + '.')]
+
+        for name in names:
+            assert problem.parameter_names[pmap.index(isub, name)] \
+                == base.name + '.' + name
+
+        num.testing.assert_equal(
+            pmap.indices(isub, names),
+            [pmap.index(isub, name) for name in names])
+
+        keys, values = pmap.get_attributes(xs.copy(), isub)
+        assert values.shape == (xs.shape[0], len(keys))
+        assert set(keys) == set(names) & set(base.keys())
+        for ikey, k in enumerate(keys):
+            r = problem.get_range(base.name + '.' + k)
+            x = xs[:, pmap.index(isub, k)]
+            num.testing.assert_equal(
+                values[:, ikey], [r.make_relative(base[k], v) for v in x])
+
+        clones = pmap.clone_subsources(
+            isub, [dict(zip(keys, vals)) for vals in values.tolist()])
+
+        assert len(clones) == xs.shape[0]
+        for clone, vals in zip(clones, values):
+            assert type(clone) is type(base)
+            assert clone.name == base.name
+            for k, v in zip(keys, vals):
+                assert clone[k] == v
+
+            for k in base.keys():
+                if k not in keys:
+                    assert same_value(clone[k], base[k])
+
+            if hasattr(base, 'stf') and base.stf is not None:
+                assert clone.stf is not base.stf
+
+
+def test_subsource_parameter_map_multi_cmt():
+    check_subsource_parameter_map(multi_cmt_problem())
+
+
+def test_subsource_parameter_map_multi_rectangular():
+    check_subsource_parameter_map(multi_rectangular_problem())
+
+
+def test_multi_rectangular_get_sources():
+    problem = multi_rectangular_problem()
+    rstate = num.random.RandomState(29)
+    xs = random_models(problem, 5, rstate)
+
+    sources = problem.get_sources(xs)
+    assert len(sources) == xs.shape[0]
+    for x, source in zip(xs, sources):
+        d = problem.get_parameter_dict(x)
+        for subsource, base in zip(
+                source.subsources, problem.base_source.subsources):
+
+            for k in base.keys():
+                name = base.name + '.' + k
+                if name in d:
+                    assert subsource[k] == problem.get_range(name) \
+                        .make_relative(base[k], d[name])
+                else:
+                    assert same_value(subsource[k], base[k])
+
+        assert problem.get_source(x).dump() == source.dump()
+
+
+def test_multi_cmt_get_sources():
+    from pyrocko import moment_tensor as mtm
+
+    problem = multi_cmt_problem()
+    rstate = num.random.RandomState(31)
+    xs = random_models(problem, 5, rstate)
+
+    sources = problem.get_sources(xs)
+    assert len(sources) == xs.shape[0]
+    for x, source in zip(xs, sources):
+        d = problem.get_parameter_dict(x)
+        for subsource, base in zip(
+                source.subsources, problem.base_source.subsources):
+
+            n = base.name
+            m0 = mtm.magnitude_to_moment(d[n + '.magnitude'])
+            num.testing.assert_equal(
+                subsource.m6,
+                num.array([d[n + '.' + k] for k in problem.m6_names]) * m0)
+
+            assert subsource.stf.duration == d[n + '.duration']
+
+            # centroid of the sub-sources is not sampled
+            for k in ['time', 'north_shift', 'east_shift', 'depth']:
+                assert subsource[k] == base[k]
+
+        assert problem.get_source(x).dump() == source.dump()
+
+
+def test_multi_cmt_pack():
+    problem = multi_cmt_problem()
+    rstate = num.random.RandomState(32)
+    x = random_models(problem, 1, rstate)[0]
+
+    source = problem.get_source(x)
+    for subsource in source.subsources:
+        subsource.time += 1.
+        subsource.north_shift += 200.
+        subsource.east_shift -= 300.
+        subsource.depth = 4e3
+
+    d = problem.get_parameter_dict(problem.pack(source))
+    for subsource, base in zip(
+            source.subsources, problem.base_source.subsources):
+
+        n = base.name
+        for k in ['time', 'north_shift', 'east_shift', 'depth']:
+            # packed values are in the convention of the ranges
+            num.testing.assert_allclose(
+                problem.get_range(n + '.' + k).make_relative(
+                    base[k], d[n + '.' + k]),
+                subsource[k])
+
+
+def test_sum_subsource_statics():
+    from grond.problems.base import _sum_subsource_statics
+
+    class FakeMeta(object):
+        time_primary = 0.
+        time_secondary = 10.
+
+    class FakeSceneTarget(object):
+        class scene(object):
+            meta = FakeMeta()
+
+    def combi(*times):
+        return gf.CombiSource(subsources=[
+            gf.MTSource(time=time) for time in times])
+
+    def static(value):
+        return gf.meta.StaticResult(result=dict(
+            displacement_d=num.full(3, value)))
+
+    error_a = gf.SeismosizerError('a')
+    error_b = gf.SeismosizerError('b')
+
+    sources = [
+        combi(1., 2., 20.),
+        combi(1., 2., 20.),
+        combi(1., 2., 20.),
+        combi(1., 2., 20.)]
+
+    components = [
+        # all valid, third sub-source outside of acquisition period
+        [static(1.), static(2.), static(4.)],
+        # one of the overlapping sub-sources fails
+        [static(1.), error_a, static(4.)],
+        # all overlapping sub-sources fail
+        [error_a, error_b, static(4.)],
+        # failure outside of acquisition period
+        [static(1.), static(2.), error_a]]
+
+    summed = _sum_subsource_statics(FakeSceneTarget(), sources, components)
+
+    num.testing.assert_equal(summed[0]['displacement_d'], 3.)
+    num.testing.assert_equal(summed[1]['displacement_d'], 1.)
+    assert summed[2] is error_a
+    num.testing.assert_equal(summed[3]['displacement_d'], 3.)
+
+
+def test_processed_obs_cache():
+    from pyrocko import trace
+    from grond.targets.waveform.target import (
+        WaveformMisfitTarget, WaveformMisfitConfig, DomainChoice, misfit)
+
+    rstate = num.random.RandomState(43)
+    deltat = 0.5
+
+    for domain in DomainChoice.choices:
+        for tautoshift_max in (0., 2.):
+            target = WaveformMisfitTarget(
+                codes=('', 'STA', '', 'Z'),
+                path='wf',
+                misfit_config=WaveformMisfitConfig(
+                    fmax=0.2,
+                    domain=domain,
+                    tautoshift_max=tautoshift_max))
+
+            target.set_result_mode('sparse')
+
+            tr_obs, tr_syn = [
+                trace.Trace(
+                    tmin=deltat * 3, deltat=deltat,
+                    ydata=rstate.normal(size=200))
+                for _ in range(2)]
+
+            obs_key = (0., 100., 0., tr_obs.tmin, tr_obs.data_len(), deltat)
+
+            processed_obs_first = {}
+            tmins_fit = 20. + rstate.uniform(-0.2, 0.2, size=3) * deltat
+            for tmin_fit in num.repeat(tmins_fit, 2):
+                tmax_fit = tmin_fit + 40.
+                taper = trace.CosTaper(
+                    tmin_fit - 5., tmin_fit, tmax_fit, tmax_fit + 5.)
+
+                processed_obs = target.get_processed_obs(
+                    tr_obs, taper, domain, obs_key)
+
+                # reused only for identical tapers
+                if tmin_fit not in processed_obs_first:
+                    assert all(
+                        processed_obs is not processed_obs_
+                        for processed_obs_ in processed_obs_first.values())
+
+                    processed_obs_first[tmin_fit] = processed_obs
+                else:
+                    assert processed_obs is processed_obs_first[tmin_fit]
+
+                results = [
+                    misfit(
+                        tr_obs, tr_syn, taper,
+                        domain=domain,
+                        exponent=2,
+                        tautoshift_max=tautoshift_max,
+                        autoshift_penalty_max=0.,
+                        flip=False,
+                        processed_obs=processed_obs_)
+                    for processed_obs_ in (processed_obs, None)]
+
+                num.testing.assert_equal(
+                    results[0].misfits, results[1].misfits)
+
+
+def test_filter_synthetic():
+    from pyrocko import trace
+    from grond.targets.waveform.target import (
+        WaveformMisfitTarget, WaveformMisfitConfig)
+
+    rstate = num.random.RandomState(44)
+    deltat = 0.5
+
+    for quantity, syn_resp in [
+            ('displacement', None),
+            ('velocity', trace.DifferentiationResponse(1)),
+            ('acceleration', trace.DifferentiationResponse(2))]:
+
+        for fmin, tfade_taper in [(0., None), (0.02, 5.)]:
+            config = WaveformMisfitConfig(
+                quantity=quantity, fmin=fmin, fmax=0.2, tfade=tfade_taper)
+
+            target = WaveformMisfitTarget(
+                codes=('', 'STA', '', 'Z'),
+                path='wf',
+                misfit_config=config)
+
+            tfade = 1.0 / (fmin if fmin > 0. else config.fmax)
+            if tfade_taper is None:
+                tfade_taper = tfade
+
+            # varying lengths, repeated to go through the memoised filters
+            for nsamples in [1000, 1100, 1000, 1300, 1200, 1400, 1100]:
+                tr_syn = trace.Trace(
+                    '', 'STA', '', 'Z', tmin=10., deltat=deltat,
+                    ydata=rstate.normal(size=nsamples))
+
+                # sometimes reaching beyond the data, which is extended
+                tmin_fit = tr_syn.tmin + rstate.uniform(1., 3.) * tfade
+                tmax_fit = tr_syn.tmax - rstate.uniform(1., 3.) * tfade
+                tmin = tmin_fit - 2. * tfade
+                tmax = tmax_fit + 2. * tfade
+
+                tr_ref = tr_syn.copy()
+                tr_ref.extend(tmin, tmax, fillmethod='repeat')
+                tr_ref = tr_ref.transfer(
+                    freqlimits=target.get_freqlimits(), tfade=tfade,
+                    transfer_function=syn_resp)
+                tr_ref.chop(tmin, tmax)
+
+                tr_filtered = target.filter_synthetic(
+                    tr_syn.copy(), tmin, tmax, tfade)
+
+                assert tr_filtered.tmin == tr_ref.tmin
+                num.testing.assert_equal(tr_filtered.ydata, tr_ref.ydata)
+
+                taper = trace.CosTaper(
+                    tmin_fit - tfade_taper, tmin_fit,
+                    tmax_fit, tmax_fit + tfade_taper)
+
+                for tr in (tr_ref, tr_filtered):
+                    tr.taper(taper)
+
+                num.testing.assert_equal(tr_filtered.ydata, tr_ref.ydata)
+
+    assert len(target._synthetic_filters) <= target.nsynthetic_filters_max
+
+
+def test_toy_misfits_many():
+    source, targets = scenario('wellposed', 'noisefree')
+
+    p = ToyProblem(
+        name='toy_problem',
+        ranges={
+            'north': gf.Range(start=-10., stop=10.),
+            'east': gf.Range(start=-10., stop=10.),
+            'depth': gf.Range(start=0., stop=10.)},
+        base_source=source,
+        targets=targets)
+
+    rstate = num.random.RandomState(37)
+    xs = random_models(p, 20, rstate)
+
+    num.testing.assert_equal(
+        p.misfits_many(xs), num.array([p.misfits(x) for x in xs]))
+
+
+def test_evaluate_many():
+    from pyrocko import trace, io, model
+    from grond.dataset import Dataset
+    from grond.problems.cmt.problem import CMTProblem
+    from grond.targets.waveform.target import (
+        WaveformMisfitTarget, WaveformMisfitConfig)
+    from .test_dataset import make_stationxml
+
+    engine = gf.LocalEngine(
+        store_superdirs=[common.get_ahfullgreen_store_superdir()])
+
+    store_id = 'ahfullgreen_test'
+    rstate = num.random.RandomState(3)
+
+    tempdir = tempfile.mkdtemp(prefix='grond-test-')
+    try:
+        os.mkdir(os.path.join(tempdir, 'waveforms'))
+        stations = []
+        fns = []
+        trs = []
+        for ista, (lat, lon) in enumerate(
+                [(0.05, 0.), (0., 0.06), (-0.04, -0.03)]):
+
+            sta = 'STA%i' % ista
+            fns.append(os.path.join(tempdir, '%s.xml' % sta))
+            make_stationxml(
+                sta, 1.0, ('BHE', 'BHN', 'BHZ')).dump_xml(filename=fns[-1])
+
+            for cha in 'ENZ':
+                trs.append(trace.Trace(
+                    'XX', sta, '', 'BH' + cha, tmin=-200., deltat=0.2,
+                    ydata=rstate.normal(size=2500)))
+
+            stations.append(model.Station(
+                'XX', sta, '', lat=lat, lon=lon, channels=[
+                    model.Channel('BHE', azimuth=90., dip=0.),
+                    model.Channel('BHN', azimuth=0., dip=0.),
+                    model.Channel('BHZ', azimuth=0., dip=-90.)]))
+
+        io.save(trs, os.path.join(tempdir, 'waveforms', 'data.mseed'))
+
+        ds = Dataset()
+        ds.add_waveforms([os.path.join(tempdir, 'waveforms')])
+        ds.add_responses(stationxml_filenames=fns)
+        ds.add_stations(stations=stations)
+
+        targets = []
+        for station in stations:
+            for cha, domain in zip(
+                    'ZNE', ['time_domain', 'envelope', 'frequency_domain']):
+
+                target = WaveformMisfitTarget(
+                    quantity='displacement',
+                    codes=station.nsl() + (cha,),
+                    lat=station.lat,
+                    lon=station.lon,
+                    store_id=store_id,
+                    path='wf',
+                    misfit_config=WaveformMisfitConfig(
+                        fmin=0.1,
+                        fmax=1.0,
+                        tmin='{stored:anyP}-1',
+                        tmax='{stored:anyS}+2',
+                        domain=domain,
+                        tautoshift_max=0.4 if cha == 'Z' else 0.))
+
+                target.set_dataset(ds)
+                targets.append(target)
+
+        p = CMTProblem(
+            name='test',
+            base_source=gf.MTSource(
+                lat=0., lon=0., depth=5e3,
+                stf=gf.HalfSinusoidSTF(duration=1.)),
+            target_groups=[],
+            targets=targets,
+            ranges=dict(
+                time=gf.Range(-1., 1., relative='add'),
+                north_shift=gf.Range(-2e3, 2e3),
+                east_shift=gf.Range(-2e3, 2e3),
+                depth=gf.Range(3e3, 7e3),
+                magnitude=gf.Range(4., 5.),
+                rmnn=gf.Range(-1.4, 1.4),
+                rmee=gf.Range(-1.4, 1.4),
+                rmdd=gf.Range(-1.4, 1.4),
+                rmne=gf.Range(-1., 1.),
+                rmnd=gf.Range(-1., 1.),
+                rmed=gf.Range(-1., 1.),
+                duration=gf.Range(0.5, 2.)))
+
+        p.set_engine(engine)
+
+        xs = random_models(p, 6, rstate)
+
+        # models of a batch are modelled over the union of their time
+        # windows and cut afterwards
+        results_many = p.evaluate_many(xs)
+        for x, results in zip(xs, results_many):
+            for result, result_ref in zip(
+                    results, p.evaluate(x, result_mode='sparse')):
+
+                num.testing.assert_allclose(
+                    result.misfits, result_ref.misfits, rtol=1e-8)
+
+        misfits = p.misfits_many(xs)
+        assert not num.any(num.isnan(misfits))
+        num.testing.assert_allclose(
+            misfits, num.array([p.misfits(x) for x in xs]), rtol=1e-8)
+
+    finally:
+        shutil.rmtree(tempdir)
+
+
+class CountingToyProblem(ToyProblem):
+
+    def misfits_many(self, xs, mask=None):
+        self.batch_sizes.append(len(xs))
+        return ToyProblem.misfits_many(self, xs, mask=mask)
+
+
+def test_optimiser_batch_size():
+    source, targets = scenario('wellposed', 'noisefree')
+
+    def optimise(rundir, batch_size):
+        p = CountingToyProblem(
+            name='toy_problem',
+            ranges={
+                'north': gf.Range(start=-10., stop=10.),
+                'east': gf.Range(start=-10., stop=10.),
+                'depth': gf.Range(start=0., stop=10.)},
+            base_source=source,
+            targets=targets)
+
+        p.batch_sizes = []
+
+        optimiser = HighScoreOptimiser(
+            sampler_phases=[
+                UniformSamplerPhase(
+                    niterations=40, seed=1, batch_size=batch_size),
+                DirectedSamplerPhase(niterations=40, seed=2)],
+            nbootstrap=10)
+
+        optimiser.optimise(p, rundir=rundir)
+        return p
+
+    rundirs = [tempfile.mkdtemp(prefix='grond-test-') for _ in range(2)]
+    try:
+        p1 = optimise(rundirs[0], 1)
+        p7 = optimise(rundirs[1], 7)
+
+        assert p1.batch_sizes == [1] * 80
+        assert p7.batch_sizes == [7] * 5 + [5] + [1] * 40
+
+        # uniform sampling does not depend on the batch size
+        xs1, misfits1, bootstraps1, contexts1 = load_problem_data(
+            rundirs[0], p1, nchains=10)
+        xs7, misfits7, bootstraps7, contexts7 = load_problem_data(
+            rundirs[1], p7, nchains=10)
+
+        num.testing.assert_equal(xs1, xs7)
+        num.testing.assert_equal(misfits1, misfits7)
+        num.testing.assert_equal(contexts1, contexts7)
+
+        # bootstrap misfits of a batch are combined at once
+        num.testing.assert_allclose(bootstraps1, bootstraps7, rtol=1e-12)
+
+    finally:
+        for rundir in rundirs:
+            shutil.rmtree(rundir)
+
+
+class ExactRecordingToyProblem(ToyProblem):
+
+    def combine_misfits(self, misfits, *args, **kwargs):
+        self.exact.add(kwargs.get('exact', True))
+        return ToyProblem.combine_misfits(self, misfits, *args, **kwargs)
+
+
+def test_optimiser_fast_bootstrap_misfits():
+    from grond.optimisers.highscore.optimiser import HighScoreOptimiserConfig
+
+    source, targets = scenario('wellposed', 'noisefree')
+
+    # bit-compatible reduction unless explicitly enabled
+    assert not HighScoreOptimiserConfig().get_optimiser().fast_bootstrap_misfits
+
+    for fast in (False, True):
+        p = ExactRecordingToyProblem(
+            name='toy_problem',
+            ranges={
+                'north': gf.Range(start=-10., stop=10.),
+                'east': gf.Range(start=-10., stop=10.),
+                'depth': gf.Range(start=0., stop=10.)},
+            base_source=source,
+            targets=targets)
+
+        p.exact = set()
+
+        optimiser = HighScoreOptimiserConfig(
+            sampler_phases=[
+                UniformSamplerPhase(niterations=20, seed=1),
+                DirectedSamplerPhase(niterations=20, seed=2)],
+            nbootstrap=10,
+            fast_bootstrap_misfits=fast).get_optimiser()
+
+        rundir = tempfile.mkdtemp(prefix='grond-test-')
+        try:
+            optimiser.optimise(p, rundir=rundir)
+        finally:
+            shutil.rmtree(rundir)
+
+        assert p.exact == {not fast}
+
+
+def autoshift_lx_norms_loop(a, b, nshift_max, exponent):
+    from pyrocko import trace
+
+    mns = []
+    for ishift in range(-nshift_max, nshift_max + 1):
+        if ishift < 0:
+            a_cut = a[-ishift:]
+            b_cut = b[:ishift]
+        elif ishift == 0:
+            a_cut = a
+            b_cut = b
+        elif ishift > 0:
+            a_cut = a[:-ishift]
+            b_cut = b[ishift:]
+
+        mns.append(trace.Lx_norm(a_cut, b_cut, norm=exponent))
+
+    return num.array(mns).T
+
+
+def test_autoshift_lx_norms():
+    from pyrocko import trace
+    from grond.targets.waveform.target import (
+        _autoshift_lx_norms, _shift_cut)
+
+    rstate = num.random.RandomState(41)
+    for nsamples in (1, 2, 50, 301):
+        a = rstate.normal(size=nsamples)
+        b = 0.8 * num.roll(a, 3) + 0.3 * rstate.normal(size=nsamples)
+
+        for nshift_max in sorted(set([0, 1, nsamples // 3, nsamples - 1])):
+            if nshift_max >= nsamples:
+                continue
+
+            ms_ref, ns_ref = autoshift_lx_norms_loop(a, b, nshift_max, 2)
+            for ishift in range(-nshift_max, nshift_max + 1):
+                a_cut, b_cut = _shift_cut(a, b, ishift)
+                m, n = trace.Lx_norm(a_cut, b_cut, norm=2)
+                assert m == ms_ref[ishift + nshift_max]
+                assert n == ns_ref[ishift + nshift_max]
+
+            for exponent in (1, 2, 3):
+                ms_ref, ns_ref = autoshift_lx_norms_loop(
+                    a, b, nshift_max, exponent)
+
+                for nelements_block in (1, 2**16):
+                    ms, ns = _autoshift_lx_norms(
+                        a, b, nshift_max, exponent,
+                        nelements_block=nelements_block)
+
+                    scale = num.max(ns_ref) + num.max(ms_ref)
+                    num.testing.assert_allclose(
+                        ms, ms_ref, rtol=1e-10, atol=1e-10 * scale)
+                    num.testing.assert_allclose(
+                        ns, ns_ref, rtol=1e-10, atol=1e-10 * scale)
+
+                    # the chosen shift is the same
+                    assert num.argmin(ms) == num.argmin(ms_ref)
+
+
+def test_evaluation_plan():
+    from grond.problems.base import EvaluationPlan
+    from grond.targets.satellite.target import (
+        SatelliteMisfitTarget, SatelliteMisfitConfig)
+    from grond.targets.waveform.target import (
+        WaveformMisfitTarget, WaveformMisfitConfig)
+
+    problem = multi_cmt_problem()
+
+    source = gf.CombiSource(subsources=[
+        gf.MTSource(name=name) for name in ['ev_1a', 'ev_1b', 'ev_2a']])
+
+    zeros = num.zeros(3)
+    sat = SatelliteMisfitTarget(
+        scene_id='scene', lats=zeros, lons=zeros, north_shifts=zeros,
+        east_shifts=zeros, theta=zeros, phi=zeros,
+        misfit_config=SatelliteMisfitConfig(), path='sat')
+
+    def waveform_target(sta, origin_name=None):
+        return WaveformMisfitTarget(
+            codes=('', sta, '', 'Z'), origin_name=origin_name, path='wf',
+            misfit_config=WaveformMisfitConfig(fmax=1.0))
+
+    wf_ev2 = waveform_target('EV2', origin_name='ev_2')
+    wf_all = waveform_target('ALL')
+    wf_masked = waveform_target('MASKED')
+    shared = gf.Target(codes=('', 'SHARED', '', 'Z'))
+
+    targets = [sat, wf_ev2, wf_all, wf_masked]
+    t2m = [[sat], [wf_ev2, shared], [wf_all, shared], [wf_masked]]
+    mask = [True, True, True, False]
+
+    plan = EvaluationPlan(problem, targets, mask, t2m, source)
+
+    assert plan.umtargets == [sat, wf_ev2, shared, wf_all]
+    assert plan.nunique == 4
+    assert plan.wtargets == [wf_ev2, wf_all, wf_masked]
+    assert plan.target_slices == [
+        slice(0, 1), slice(1, 3), slice(3, 5), None]
+    assert plan.iu_of_slot == [0, 1, 2, 3, 2]
+    assert plan.upositions == [(0, 0), (1, 0), (1, 1), (2, 0)]
+    assert plan.get_modelling_results(2, ['r0', 'r1', 'r2', 'r3']) \
+        == ['r3', 'r2']
+
+    assert plan.event_subsources == {1: [0, 1], 2: [2]}
+    assert plan.uroles == [
+        [('sub', 0), ('sub', 1), ('sub', 2)],
+        [('event', 2)],
+        [('all', None)],
+        [('all', None)]]
+
+    role_groups = dict(
+        (tuple(roles), ius) for (roles, ius) in plan.role_groups)
+    assert role_groups == {
+        (('sub', 0), ('sub', 1), ('sub', 2)): [0],
+        (('event', 2),): [1],
+        (('all', None),): [2, 3]}
+
+    assert [type(proxy) for proxy in plan.proxies] == [
+        gf.SatelliteTarget, gf.Target, gf.Target, gf.Target]
+    assert plan.proxies[2] is shared
+    assert plan.proxies[1].codes == wf_ev2.codes
+    assert plan.is_misfit == [True, True, False, True]
+    assert plan.is_static == [True, False, False, False]
+    assert plan.is_subsource_sum == [True, False, False, False]
+
+    assert [s.name for s in plan.get_role_source(
+        source, ('event', 1)).subsources] == ['ev_1a', 'ev_1b']
+    assert plan.get_role_source(source, ('sub', 2)) is source.subsources[2]
+    assert plan.get_role_source(source, ('all', None)) is source
+
+    # sources without sub-sources are modelled as a whole
+    plan = EvaluationPlan(problem, targets, None, t2m, gf.MTSource())
+    assert plan.nunique == 5
+    assert plan.role_groups == [([('all', None)], [0, 1, 2, 3, 4])]
+    assert plan.is_subsource_sum == [False] * 5
+
+    # plans are reused until the modelling setup changes
+    plan = problem.get_evaluation_plan(targets, mask, t2m, source)
+    assert problem.get_evaluation_plan(
+        targets, list(mask), [list(mts) for mts in t2m], source) is plan
+
+    assert problem.get_evaluation_plan(
+        targets, None, t2m, source) is not plan
+
+    t2m_new = [[sat], [wf_ev2, gf.Target()], [wf_all], [wf_masked]]
+    plan_new = problem.get_evaluation_plan(targets, mask, t2m_new, source)
+    assert plan_new is not plan
+    assert problem.get_evaluation_plan(
+        targets, mask, t2m_new, source) is plan_new
+
+
+def test_travel_time_table():
+    from grond.targets.traveltimes import TravelTimeTable, TravelTimes
+
+    engine = gf.LocalEngine(
+        store_superdirs=[common.get_ahfullgreen_store_superdir()])
+
+    store_id = 'ahfullgreen_test'
+    store = engine.get_store(store_id)
+    rstate = num.random.RandomState(47)
+
+    receivers = [
+        gf.Target(
+            codes=('', 'R%i' % i, '', 'Z'),
+            store_id=store_id,
+            lat=lat,
+            lon=lon,
+            north_shift=rstate.uniform(-8e3, 8e3),
+            east_shift=rstate.uniform(-8e3, 8e3))
+        for i, (lat, lon) in enumerate(
+            [(0., 0.)] * 5 + [(0.01, 0.02), (-0.03, 0.01)])]
+
+    # out of range of the store
+    receivers.append(gf.Target(
+        codes=('', 'FAR', '', 'Z'), store_id=store_id, north_shift=30e3))
+
+    def random_source():
+        return gf.MTSource(
+            lat=[0., 0.01][rstate.randint(2)],
+            lon=0.,
+            north_shift=rstate.uniform(-5e3, 5e3),
+            east_shift=rstate.uniform(-5e3, 5e3),
+            depth=rstate.uniform(0.5e3, 11e3))
+
+    sources = [random_source() for _ in range(40)]
+    sources.extend(sources[:5])
+
+    def t_or_error(t, *args):
+        try:
+            return t(*args)
+        except gf.OutOfBounds:
+            return 'out of bounds'
+
+    for timing in [
+            '{stored:anyP}',
+            'anyS-2',
+            'first(anyP|anyS)',
+            'last{stored:anyP|stored:anyS}+10%',
+            '{stored:anyP}+0.1S',
+            '{vel_surface:3}',
+            '3.5']:
+
+        table = TravelTimeTable(store, timing)
+        table.nsources_max = 8
+        table.add_receivers(receivers[:4])
+        travel_times = TravelTimes(engine, receivers)
+
+        ncompared = 0
+        for source in sources:
+            for receiver in receivers:
+                t_ref = t_or_error(
+                    store.t, gf.Timing(timing), source, receiver)
+
+                for t in (
+                        t_or_error(table.t, source, receiver),
+                        t_or_error(travel_times.t, timing, source, receiver)):
+
+                    if isinstance(t_ref, float):
+                        assert abs(t - t_ref) < 1e-9
+                        ncompared += 1
+                    else:
+                        assert t == t_ref
+
+        assert ncompared > len(sources) * len(receivers)
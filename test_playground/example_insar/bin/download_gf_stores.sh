@@ -0,0 +1,7 @@
+#!/bin/bash
+set -e
+
+mkdir gf_stores
+cd gf_stores
+fomosto download kinherd crust2_ib_static
+cd ..
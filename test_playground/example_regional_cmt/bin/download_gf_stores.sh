@@ -0,0 +1,8 @@
+#!/bin/bash
+
+set -e
+
+mkdir gf_stores
+cd gf_stores
+fomosto download kinherd crust2_j3
+cd ..
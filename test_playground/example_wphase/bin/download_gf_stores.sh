@@ -0,0 +1,8 @@
+#!/bin/bash
+
+set -e
+
+mkdir gf_stores
+cd gf_stores
+fomosto download kinherd global_20s_shallow
+cd ..